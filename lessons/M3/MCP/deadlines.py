@@ -0,0 +1,94 @@
+import asyncio
+import time
+from contextvars import Context, ContextVar
+from typing import Tuple
+
+import httpx
+
+# ===== Per-request deadlines =====
+# A tool call's time budget is set once in the dispatcher and read by everything
+# the call does: Overpass HTTP timeouts and retries shrink to the time left, and
+# generate() stops at the deadline. A timed-out call stops consuming CPU and
+# sockets instead of running to completion in the background.
+
+_deadline: ContextVar["float | SharedDeadline | None"] = ContextVar("request_deadline", default=None)
+
+
+def current_deadline() -> float | None:
+    """
+    time.monotonic() value at which the current request gives up, or None.
+    """
+    deadline = _deadline.get()
+    return deadline.deadline if isinstance(deadline, SharedDeadline) else deadline
+
+
+def remaining(default: float | None = None) -> float | None:
+    deadline = current_deadline()
+    if deadline is None:
+        return default
+    return max(0.0, deadline - time.monotonic())
+
+
+def expired(deadline: float | None) -> bool:
+    return deadline is not None and time.monotonic() >= deadline
+
+
+def check_deadline() -> None:
+    if expired(current_deadline()):
+        raise asyncio.TimeoutError("request deadline exceeded")
+
+
+class SharedDeadline:
+    """
+    The deadline of work several requests wait on (single-flight): it only
+    ever moves later, to the latest deadline among the waiters.
+    """
+
+    def __init__(self, deadline: float | None):
+        self.deadline = deadline
+
+    def extend(self, deadline: float | None) -> None:
+        if self.deadline is not None and (deadline is None or deadline > self.deadline):
+            self.deadline = deadline
+
+
+def start_shared(coro, deadline: float | None) -> Tuple[asyncio.Task, SharedDeadline]:
+    """
+    Run `coro` as a task in a fresh context that carries none of the starting
+    request's state, only a SharedDeadline. The task copies that context, but
+    the copy holds the same object, so extend() reaches the running task.
+    """
+    shared = SharedDeadline(deadline)
+
+    def start() -> asyncio.Task:
+        _deadline.set(shared)
+        return asyncio.get_running_loop().create_task(coro)
+
+    return Context().run(start), shared
+
+
+def http_timeout(connect: float = 5.0, read: float = 20.0, write: float = 10.0, pool: float = 5.0) -> httpx.Timeout:
+    """
+    httpx timeouts clamped to the time left on the current request.
+    """
+    left = remaining()
+    if left is None:
+        return httpx.Timeout(connect=connect, read=read, write=write, pool=pool)
+    left = max(left, 0.001)
+    return httpx.Timeout(connect=min(connect, left), read=min(read, left), write=min(write, left), pool=min(pool, left))
+
+
+async def run_with_deadline(coro, seconds: float, on_timeout: str):
+    """
+    Await `coro` with a deadline `seconds` from now, visible to everything it
+    calls via current_deadline(). On expiry the coroutine is cancelled and
+    `on_timeout` is returned.
+    """
+    token = _deadline.set(time.monotonic() + seconds)
+    try:
+        # wait_for runs coro in a task that copies the context, deadline included
+        return await asyncio.wait_for(coro, timeout=seconds)
+    except asyncio.TimeoutError:
+        return on_timeout
+    finally:
+        _deadline.reset(token)
@@ -1,32 +1,74 @@
 import httpx
 from fastmcp import FastMCP
-from transformers import MBart50TokenizerFast, MBartForConditionalGeneration
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+
+from mbart_backend import BACKEND, load_translation_model
+from mbart_engine import DEFAULT_PROFILE, decoding_kwargs, resolve_profile
+from mbart_daemon import SOCKET_PATH, USE_DAEMON, request_sync
+from translation_cache import TranslationCache
+from translation_memory import load_translation_memory
 
 # Initialize FastMCP server
 mcp = FastMCP("Japanese Translator")
 
 # Initialize model
 model_name = "facebook/mbart-large-50-many-to-many-mmt"
-print("Loading model... This may take a minute...")
-tokenizer = MBart50TokenizerFast.from_pretrained(model_name)
-model = MBartForConditionalGeneration.from_pretrained(model_name)
-print("Model loaded successfully!")
+if USE_DAEMON:
+    # Shared mbart_daemon.py process holds the model; no private copy here
+    print(f"Using shared mBART daemon at unix://{SOCKET_PATH}")
+    model_id = None  # taken from the daemon's health on first use (cache key)
+else:
+    print(f"Loading model (backend={BACKEND})... This may take a minute...")
+    tokenizer, model, model_id = load_translation_model(model_name)
+    print("Model loaded successfully!")
+
+# Repeated requests are answered from cache (memory LRU + SQLite on disk)
+translation_cache = TranslationCache()
+
+# Human translations from the Kyoto corpus are returned before touching the model
+translation_memory = load_translation_memory()
 
 
 @mcp.tool()
-def translate_ja_to_en(text: str, max_length: int = 512) -> str:
+def translate_ja_to_en(text: str, max_length: int = 512, profile: str = DEFAULT_PROFILE) -> str:
     """
     Translate Japanese text to English using mBART model.
 
     Args:
         text: Japanese text to translate
         max_length: Maximum length of translation (default: 512)
+        profile: Decoding profile: greedy-fast, beam-2-balanced or beam-4-quality
 
     Returns:
         English translation as a string
     """
     print(f"Translating: {text}")
     
+    match = translation_memory.lookup(text) if translation_memory is not None else None
+    if match is not None:
+        print(f"Translation (memory, {match.kind} {match.similarity}): {match.translation}")
+        return match.translation
+    
+    global model_id
+    if USE_DAEMON and model_id is None:
+        model_id = request_sync("health")["model_id"]
+    try:
+        profile = resolve_profile(profile)
+    except ValueError as e:
+        return f"[translation-error] {e}"
+    params = {"max_length": max_length, "profile": profile}
+    cached = translation_cache.get(text, "ja_XX", "en_XX", model_id, params)
+    if cached is not None:
+        print(f"Translation (cached): {cached}")
+        return cached
+    
+    if USE_DAEMON:
+        translation = request_sync("translate", text=text, params=params)["translation"]
+        print(f"Translation (daemon): {translation}")
+        translation_cache.put(text, "ja_XX", "en_XX", model_id, params, translation)
+        return translation
+    
     # Set Japanese as source
     tokenizer.src_lang = "ja_XX"
     
@@ -36,18 +78,29 @@ def translate_ja_to_en(text: str, max_length: int = 512) -> str:
     # Generate English translation
     generated_tokens = model.generate(
         **encoded,
-        forced_bos_token_id=tokenizer.lang_code_to_id["en_XX"],
-        max_length=max_length
+        **decoding_kwargs(profile, encoded["input_ids"].shape[1], tokenizer.lang_code_to_id["en_XX"], max_length)
     )
     
     # Decode
     translation = tokenizer.batch_decode(generated_tokens, skip_special_tokens=True)[0]
     
     print(f"Translation: {translation}")
+    translation_cache.put(text, "ja_XX", "en_XX", model_id, params, translation)
     
     return translation
 
 
+@mcp.custom_route("/info", methods=["GET"])
+async def info(request: Request) -> JSONResponse:
+    return JSONResponse({
+        "service": "Japanese Translator",
+        "model": model_name,
+        "backend": BACKEND,
+        "translation_cache": translation_cache.stats(),
+        "translation_memory": translation_memory.stats() if translation_memory is not None else None,
+    })
+
+
 if __name__ == "__main__":
     # Run with HTTP transport on port 8765
     print("Starting Japanese Translator FastMCP server on http://0.0.0.0:8765")
@@ -2,19 +2,36 @@ import asyncio
 from mcp.server import Server
 from mcp.server.sse import SseServerTransport
 from mcp.types import Tool, TextContent
-from transformers import MBart50TokenizerFast, MBartForConditionalGeneration
 from starlette.applications import Starlette
 from starlette.routing import Route, Mount
 from starlette.responses import JSONResponse
 from starlette.middleware.cors import CORSMiddleware
 import uvicorn
 
+from mbart_backend import BACKEND, load_translation_model
+from mbart_engine import DECODING_PROFILES, DEFAULT_PROFILE, decoding_kwargs, resolve_profile
+from mbart_daemon import SOCKET_PATH, USE_DAEMON, MbartDaemonClient
+from translation_cache import TranslationCache
+from translation_memory import load_translation_memory
+
 # Initialize model
 model_name = "facebook/mbart-large-50-many-to-many-mmt"
-print("Loading model... This may take a minute...")
-tokenizer = MBart50TokenizerFast.from_pretrained(model_name)
-model = MBartForConditionalGeneration.from_pretrained(model_name)
-print("Model loaded successfully!")
+if USE_DAEMON:
+    # Shared mbart_daemon.py process holds the model; no private copy here
+    print(f"Using shared mBART daemon at unix://{SOCKET_PATH}")
+    daemon = MbartDaemonClient()
+    model_id = None  # taken from the daemon's health on first use (cache key)
+else:
+    print(f"Loading model (backend={BACKEND})... This may take a minute...")
+    daemon = None
+    tokenizer, model, model_id = load_translation_model(model_name)
+    print("Model loaded successfully!")
+
+# Repeated requests are answered from cache (memory LRU + SQLite on disk)
+translation_cache = TranslationCache()
+
+# Human translations from the Kyoto corpus are returned before touching the model
+translation_memory = load_translation_memory()
 
 # Create MCP server
 mcp_server = Server("japanese-translator")
@@ -36,6 +53,12 @@ async def list_tools() -> list[Tool]:
                         "type": "integer", 
                         "description": "Maximum length of translation", 
                         "default": 512
+                    },
+                    "profile": {
+                        "type": "string",
+                        "enum": list(DECODING_PROFILES),
+                        "description": "Decoding profile (speed vs. quality)",
+                        "default": DEFAULT_PROFILE
                     }
                 },
                 "required": ["text"]
@@ -48,9 +71,33 @@ async def call_tool(name: str, arguments: dict) -> list[TextContent]:
     if name == "translate_ja_to_en":
         text = arguments["text"]
         max_length = arguments.get("max_length", 512)
+        try:
+            profile = resolve_profile(arguments.get("profile"))
+        except ValueError as e:
+            return [TextContent(type="text", text=f"[translation-error] {e}")]
+        params = {"max_length": int(max_length), "profile": profile}
         
         print(f"Translating: {text}")
         
+        match = translation_memory.lookup(text) if translation_memory is not None else None
+        if match is not None:
+            print(f"Translation (memory, {match.kind} {match.similarity}): {match.translation}")
+            return [TextContent(type="text", text=match.translation)]
+        
+        global model_id
+        if daemon is not None and model_id is None:
+            model_id = (await daemon.health())["model_id"]
+        cached = translation_cache.get(text, "ja_XX", "en_XX", model_id, params)
+        if cached is not None:
+            print(f"Translation (cached): {cached}")
+            return [TextContent(type="text", text=cached)]
+        
+        if daemon is not None:
+            translation = await daemon.translate(text, params)
+            print(f"Translation (daemon): {translation}")
+            translation_cache.put(text, "ja_XX", "en_XX", model_id, params, translation)
+            return [TextContent(type="text", text=translation)]
+        
         # Set Japanese as source
         tokenizer.src_lang = "ja_XX"
         
@@ -60,14 +107,16 @@ async def call_tool(name: str, arguments: dict) -> list[TextContent]:
         # Generate English translation
         generated_tokens = model.generate(
             **encoded,
-            forced_bos_token_id=tokenizer.lang_code_to_id["en_XX"],
-            max_length=max_length
+            **decoding_kwargs(
+                profile, encoded["input_ids"].shape[1], tokenizer.lang_code_to_id["en_XX"], int(max_length)
+            )
         )
         
         # Decode
         translation = tokenizer.batch_decode(generated_tokens, skip_special_tokens=True)[0]
         
         print(f"Translation: {translation}")
+        translation_cache.put(text, "ja_XX", "en_XX", model_id, params, translation)
         
         return [TextContent(type="text", text=translation)]
 
@@ -116,10 +165,21 @@ async def root(request):
         "endpoints": {
             "sse": "/sse",
             "health": "/health",
-            "openapi": "/openapi.json"
+            "openapi": "/openapi.json",
+            "info": "/info"
         }
     })
 
+# Info endpoint (model + cache stats)
+async def info(request):
+    return JSONResponse({
+        "service": "japanese-translator",
+        "model": model_name,
+        "backend": BACKEND,
+        "translation_cache": translation_cache.stats(),
+        "translation_memory": translation_memory.stats() if translation_memory is not None else None
+    })
+
 # Create Starlette app with catch-all for openapi.json
 app = Starlette(
     routes=[
@@ -130,6 +190,7 @@ app = Starlette(
         Route("/sse/openapi.json", endpoint=openapi),  # Handle /sse/openapi.json
         Route("/openapi.json/openapi.json", endpoint=openapi),  # Handle duplicate
         Route("/health", endpoint=health),
+        Route("/info", endpoint=info),
     ]
 )
 
@@ -149,4 +210,5 @@ if __name__ == "__main__":
     print("  - SSE: http://localhost:8765/sse")
     print("  - Health: http://localhost:8765/health")
     print("  - OpenAPI: http://localhost:8765/openapi.json")
+    print("  - Info: http://localhost:8765/info")
     uvicorn.run(app, host="0.0.0.0", port=8765)
\ No newline at end of file
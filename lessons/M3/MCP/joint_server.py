@@ -1,9 +1,9 @@
 import json
+import os
 from datetime import datetime, timezone as dt_timezone
 from typing import Any, Dict, List
 
 import asyncio
-import random
 import httpx
 from mcp.server import Server
 from mcp.types import Tool, TextContent
@@ -14,6 +14,8 @@ from starlette.responses import JSONResponse, PlainTextResponse
 from starlette.middleware.cors import CORSMiddleware
 from starlette.requests import Request
 import uvicorn
+import time
+import threading
 import traceback
 
 # ===== Timezone helper =====
@@ -39,30 +41,84 @@ mcp_server = Server(SERVICE_NAME)
 
 # ===== Translation model (lazy globals + startup loader) =====
 import torch
-from transformers import MBart50TokenizerFast, MBartForConditionalGeneration
+from transformers import StoppingCriteriaList
+
+from mbart_backend import BACKEND, format_timings, load_translation_model, warmup_model
+from mbart_engine import (
+    DECODING_PROFILES,
+    DEFAULT_PROFILE,
+    StopWhen,
+    decoding_kwargs,
+    make_inference_executor,
+    resolve_profile,
+)
+from mbart_daemon import SOCKET_PATH, USE_DAEMON, MbartDaemonClient, wait_until_ready
+from translation_cache import TranslationCache
+from translation_memory import load_translation_memory
+from deadlines import current_deadline, expired, run_with_deadline
+from osm_overpass import OverpassClient
+from osm_tiles import RestaurantTileCache
+from osm_index import load_restaurant_index, search_restaurants
+from osm_entities import MAX_BATCH_IDS, OSM_TYPES, OsmEntityCache
 
 MODEL_NAME = "facebook/mbart-large-50-many-to-many-mmt"
 _tokenizer = None
 _model = None
+_model_id = MODEL_NAME  # includes the inference backend; used in cache keys
 _model_ready = False
 _model_error = None
+_model_state = "loading"  # loading -> warming -> ready (or error); shown on /health
+_startup_timings = {}
+# generate() runs in a bounded pool (not asyncio.to_thread's default executor):
+# excess calls queue instead of each starting its own torch thread
+INFERENCE_WORKERS = int(os.getenv("MBART_WORKERS", "1"))
+INFERENCE_THREADS_PER_WORKER = int(os.getenv("MBART_THREADS_PER_WORKER", "0")) or None
+_inference_executor = make_inference_executor(INFERENCE_WORKERS, INFERENCE_THREADS_PER_WORKER)
+_translation_cache = TranslationCache()
+# Human ja->en translations (Kyoto corpus), answered before the cache and the model
+_translation_memory = load_translation_memory()
+# With MBART_DAEMON_SOCKET set, translate through the shared mbart_daemon.py process
+_daemon = MbartDaemonClient() if USE_DAEMON else None
 
 async def load_model_on_startup():
     """
     Eager-load mBART ONCE at app startup. Never raise—just capture error.
     """
-    global _tokenizer, _model, _model_ready, _model_error
-    print("[startup] Beginning eager model load…")
+    global _tokenizer, _model, _model_id, _model_ready, _model_error, _model_state
+    print(f"[startup] Beginning eager model load (backend={BACKEND})…")
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
     try:
-        _tokenizer = MBart50TokenizerFast.from_pretrained(MODEL_NAME)
-        _model = MBartForConditionalGeneration.from_pretrained(MODEL_NAME)
-        _model.eval()
+        if _daemon is not None:
+            def on_state(state):
+                global _model_state
+                _model_state = state
+            print(f"[startup] Using shared mBART daemon at unix://{SOCKET_PATH}")
+            health = await wait_until_ready(_daemon, on_state)
+            _model_id = health["model_id"]
+            _model_ready = True
+            _model_error = None
+            _model_state = "ready"
+            return
+        # Runs in a thread so /health answers (loading/warming) during startup.
+        # Weights come from the local safetensors snapshot when present.
+        _model_state = "loading"
+        _tokenizer, _model, _model_id = await loop.run_in_executor(
+            None, load_translation_model, MODEL_NAME, None, _startup_timings
+        )
+        _model_state = "warming"
+        _startup_timings["warmup_s"] = round(
+            await loop.run_in_executor(_inference_executor, warmup_model, _tokenizer, _model), 3
+        )
+        _startup_timings["total_s"] = round(time.perf_counter() - started, 3)
         _model_ready = True
         _model_error = None
-        print("[startup] mBART loaded successfully.")
+        _model_state = "ready"
+        print(f"[startup] mBART loaded successfully: {format_timings(_startup_timings)}")
     except Exception as e:
         _model_ready = False
         _model_error = f"{type(e).__name__}: {e}"
+        _model_state = "error"
         print("[startup] ERROR loading mBART!")
         traceback.print_exc()  # <-- full stacktrace to console for debugging
 
@@ -86,41 +142,29 @@ def schema_get_osm_place_details() -> Dict[str, Any]:
         "osm_id":{"type":"integer"}
     },"required":["osm_type","osm_id"]}
 
+def schema_get_osm_places_details() -> Dict[str, Any]:
+    return {"type":"object","properties":{
+        "places":{"type":"array","items":schema_get_osm_place_details(),"maxItems":MAX_BATCH_IDS}
+    },"required":["places"]}
+
 def schema_translate_ja_to_en() -> Dict[str, Any]:
     return {"type":"object","properties":{
         "text":{"type":"string","description":"Japanese text"},
-        "max_length":{"type":"integer","default":512}
+        "max_length":{"type":"integer","default":512},
+        "profile":{"type":"string","enum":list(DECODING_PROFILES),"default":DEFAULT_PROFILE}
     },"required":["text"]}
 
 def schema_ping() -> Dict[str, Any]:
     return {"type":"object","properties":{"msg":{"type":"string","default":"ok"}}, "required":[]}
 
 # ===== Overpass helper with mirrors/retries =====
-async def overpass_query(client: httpx.AsyncClient, query: str) -> dict:
-    endpoints = OVERPASS_ENDPOINTS[:]
-    random.shuffle(endpoints)
-    attempts = 0
-    last_exc = None
-    while attempts < 4:
-        for base in endpoints:
-            try:
-                resp = await client.post(
-                    base,
-                    data={"data": query},
-                    headers={
-                        "content-type": "application/x-www-form-urlencoded",
-                        "user-agent": USER_AGENT,
-                    },
-                    timeout=httpx.Timeout(connect=5.0, read=20.0, write=10.0, pool=5.0),
-                )
-                resp.raise_for_status()
-                return resp.json()
-            except (httpx.TimeoutException, httpx.HTTPStatusError, httpx.TransportError) as e:
-                last_exc = e
-                continue
-        attempts += 1
-        await asyncio.sleep(min(2 ** attempts, 6))
-    raise RuntimeError(f"Overpass query failed across mirrors. Last error: {last_exc}")
+# Process-wide pooled client (keep-alive / HTTP/2); opened and closed in the lifespan
+_overpass = OverpassClient(USER_AGENT, OVERPASS_ENDPOINTS)
+_restaurants = RestaurantTileCache(_overpass)
+# Optional offline index (osm_index.py import ...); None -> every search goes to Overpass
+_osm_index = load_restaurant_index()
+# Places seen in search results, for detail lookups without another query
+_entities = OsmEntityCache(_overpass, _osm_index)
 
 # ===== Helpers =====
 def format_hours(tags: dict) -> str:
@@ -155,26 +199,19 @@ async def tool_get_current_time(arguments: Dict[str, Any]) -> str:
 async def tool_search_osm_restaurants(arguments: Dict[str, Any]) -> str:
     lat = float(arguments["latitude"]); lon = float(arguments["longitude"])
     limit = int(arguments.get("limit", 10)); radius_m = int(arguments.get("radius_m", DEFAULT_SEARCH_RADIUS_M))
-    query = f"""
-    [out:json][timeout:25];
-    (
-      node["amenity"="restaurant"](around:{radius_m},{lat},{lon});
-      way["amenity"="restaurant"](around:{radius_m},{lat},{lon});
-      relation["amenity"="restaurant"](around:{radius_m},{lat},{lon});
-    );
-    out tags center {limit};
-    """
-    async with httpx.AsyncClient() as client:
-        try:
-            data = await overpass_query(client, query)
-        except httpx.HTTPStatusError as e:
-            return f"Overpass error {e.response.status_code}. Reduce radius/limit and try again."
-        except Exception as e:
-            return f"Error querying Overpass: {e}"
-    els = data.get("elements", [])
+    try:
+        # Offline index when it covers the area, else cached geohash tiles / live Overpass
+        els = await search_restaurants(_osm_index, _restaurants, lat, lon, radius_m, limit)
+    except httpx.HTTPStatusError as e:
+        return f"Overpass error {e.response.status_code}. Reduce radius/limit and try again."
+    except LookupError as e:
+        return str(e)
+    except Exception as e:
+        return f"Error querying Overpass: {e}"
+    _entities.remember(els)
     if not els:
         return f"No OSM restaurants found near {lat}, {lon} within {radius_m} m."
-    lines=[f"OSM restaurants near {lat}, {lon} (radius {radius_m} m):",""]
+    lines=[f"OSM restaurants near {lat}, {lon} (radius {radius_m} m, nearest first):",""]
     for i, el in enumerate(els[:limit], 1):
         tags = el.get("tags") or {}
         name = tags.get("name","Unnamed")
@@ -189,6 +226,7 @@ async def tool_search_osm_restaurants(arguments: Dict[str, Any]) -> str:
         lines += [f"{i}. {name}",
                   f"   OSM: {url}",
                   f"   Coords: {el_lat}, {el_lon}",
+                  f"   Distance: {el.get('distance_m','N/A')} m",
                   f"   Address: {addr}",
                   f"   Cuisine: {cuisine}",
                   f"   Phone: {phone}",
@@ -197,28 +235,14 @@ async def tool_search_osm_restaurants(arguments: Dict[str, Any]) -> str:
                   ""]
     return "\n".join(lines).strip()
 
-async def tool_get_osm_place_details(arguments: Dict[str, Any]) -> str:
-    osm_type = str(arguments["osm_type"]).lower().strip(); osm_id = int(arguments["osm_id"])
-    if osm_type not in {"node","way","relation"}:
-        return "osm_type must be one of: node, way, relation."
-    query = f"""[out:json][timeout:25]; {osm_type}({osm_id}); out tags center;"""
-    async with httpx.AsyncClient() as client:
-        try:
-            data = await overpass_query(client, query)
-        except httpx.HTTPStatusError as e:
-            return f"Overpass error {e.response.status_code}."
-        except Exception as e:
-            return f"Error querying Overpass: {e}"
-    els = data.get("elements", [])
-    if not els:
-        return f"No element found for {osm_type} {osm_id}."
-    el = els[0]; tags = el.get("tags") or {}
+def format_place_details(osm_type: str, osm_id: int, el: dict) -> str:
+    tags = el.get("tags") or {}
     name = tags.get("name","Unnamed"); addr = format_osm_address(tags)
     cuisine = format_cuisine_tag(tags)
     phone = tags.get("phone") or tags.get("contact:phone") or "N/A"
     website = tags.get("website") or tags.get("contact:website") or "N/A"
     opening = format_hours(tags); url = osm_url(osm_type, osm_id)
-    if "lat" in el and "lon" in el: el_lat, el_lon = el["lat"], el["lon"]
+    if el.get("lat") is not None and el.get("lon") is not None: el_lat, el_lon = el["lat"], el["lon"]
     else:
         center = el.get("center") or {}; el_lat, el_lon = center.get("lat","N/A"), center.get("lon","N/A")
     lines=[f"Details for {name}","",f"OSM: {url}",f"Type/ID: {osm_type} {osm_id}",
@@ -227,19 +251,83 @@ async def tool_get_osm_place_details(arguments: Dict[str, Any]) -> str:
            "All tags:",json.dumps(tags, ensure_ascii=False, indent=2)]
     return "\n".join(lines).strip()
 
+async def tool_get_osm_place_details(arguments: Dict[str, Any]) -> str:
+    osm_type = str(arguments["osm_type"]).lower().strip(); osm_id = int(arguments["osm_id"])
+    if osm_type not in OSM_TYPES:
+        return "osm_type must be one of: node, way, relation."
+    try:
+        el = await _entities.get(osm_type, osm_id)  # recent search results are answered locally
+    except httpx.HTTPStatusError as e:
+        return f"Overpass error {e.response.status_code}."
+    except Exception as e:
+        return f"Error querying Overpass: {e}"
+    if el is None:
+        return f"No element found for {osm_type} {osm_id}."
+    return format_place_details(osm_type, osm_id, el)
+
+async def tool_get_osm_places_details(arguments: Dict[str, Any]) -> str:
+    try:
+        refs = [(str(p["osm_type"]).lower().strip(), int(p["osm_id"])) for p in arguments["places"]]
+    except (KeyError, TypeError, ValueError):
+        return "places must be a list of {osm_type, osm_id} objects."
+    if not refs: return "places must not be empty."
+    if len(refs) > MAX_BATCH_IDS: return f"At most {MAX_BATCH_IDS} places per call."
+    if any(t not in OSM_TYPES for t, _ in refs):
+        return "osm_type must be one of: node, way, relation."
+    try:
+        found = await _entities.get_many(refs)  # uncached places share one Overpass union query
+    except httpx.HTTPStatusError as e:
+        return f"Overpass error {e.response.status_code}."
+    except Exception as e:
+        return f"Error querying Overpass: {e}"
+    return "\n\n---\n\n".join(
+        format_place_details(t, i, found[(t, i)]) if found[(t, i)] is not None else f"No element found for {t} {i}."
+        for t, i in dict.fromkeys(refs))
+
 async def tool_translate_ja_to_en(arguments: Dict[str, Any]) -> str:
-    if not _model_ready or _tokenizer is None:
-        return f"[translation-error] mBART not ready: {_model_error or 'unknown error'}"
+    match = _translation_memory.lookup(arguments["text"]) if _translation_memory is not None else None
+    if match is not None:
+        return match.translation
+    if not _model_ready:
+        return f"[translation-error] mBART not ready: {_model_error or 'model ' + _model_state}"
     text = arguments["text"]; max_length = int(arguments.get("max_length", 512))
+    try:
+        profile = resolve_profile(arguments.get("profile"))
+    except ValueError as e:
+        return f"[translation-error] {e}"
+    params = {"max_length": max_length, "profile": profile}
+    cached = _translation_cache.get(text, "ja_XX", "en_XX", _model_id, params)
+    if cached is not None:
+        return cached
+    if _daemon is not None:
+        translation = await _daemon.translate(text, params)
+        _translation_cache.put(text, "ja_XX", "en_XX", _model_id, params, translation)
+        return translation
     _tokenizer.src_lang = "ja_XX"
     encoded = _tokenizer(text, return_tensors="pt", truncation=True)
-    with torch.no_grad():
-        generated = _model.generate(
-            **encoded,
-            forced_bos_token_id=_tokenizer.lang_code_to_id["en_XX"],
-            max_length=max_length,
-        )
+    # generate() runs on an inference worker so the event loop (and /health) stays
+    # responsive; it stops between decode steps at the call's deadline or when the
+    # call is cancelled (a call cancelled while queued never starts)
+    deadline = current_deadline()
+    cancelled = threading.Event()
+    stop = StopWhen(lambda: cancelled.is_set() or expired(deadline))
+
+    def run():
+        with torch.no_grad():
+            return _model.generate(
+                **encoded,
+                stopping_criteria=StoppingCriteriaList([stop]),
+                **decoding_kwargs(profile, encoded["input_ids"].shape[1], _tokenizer.lang_code_to_id["en_XX"], max_length),
+            )
+
+    try:
+        generated = await asyncio.get_running_loop().run_in_executor(_inference_executor, run)
+    finally:
+        cancelled.set()
+    if expired(deadline):
+        raise asyncio.TimeoutError("translation deadline exceeded")
     translation = _tokenizer.batch_decode(generated, skip_special_tokens=True)[0]
+    _translation_cache.put(text, "ja_XX", "en_XX", _model_id, params, translation)
     return translation
 
 async def tool_ping(arguments: Dict[str, Any]) -> str:
@@ -252,15 +340,15 @@ async def list_tools() -> List[Tool]:
         Tool(name="get_current_time", description="Get the current time.", inputSchema=schema_get_current_time()),
         Tool(name="search_osm_restaurants", description="Find nearby restaurants from OSM (no key).", inputSchema=schema_search_osm_restaurants()),
         Tool(name="get_osm_place_details", description="Get detailed tags for an OSM element.", inputSchema=schema_get_osm_place_details()),
+        Tool(name="get_osm_places_details", description="Get detailed tags for many OSM elements in one call.", inputSchema=schema_get_osm_places_details()),
         Tool(name="translate_ja_to_en", description="Translate Japanese to English.", inputSchema=schema_translate_ja_to_en()),
         Tool(name="ping", description="Quick connectivity check.", inputSchema=schema_ping()),
     ]
 
 async def _with_timeout(coro, seconds: float, msg: str):
-    try:
-        return await asyncio.wait_for(coro, timeout=seconds)
-    except asyncio.TimeoutError:
-        return msg
+    # The deadline is visible to the work inside `coro`: Overpass timeouts and
+    # retries shrink to it and generate() stops at it
+    return await run_with_deadline(coro, seconds, msg)
 
 @mcp_server.call_tool()
 async def call_tool(name: str, arguments: Dict[str, Any]) -> List[TextContent]:
@@ -271,6 +359,8 @@ async def call_tool(name: str, arguments: Dict[str, Any]) -> List[TextContent]:
             out = await _with_timeout(tool_search_osm_restaurants(arguments), 25.0, "Timed out searching OSM restaurants.")
         elif name == "get_osm_place_details":
             out = await _with_timeout(tool_get_osm_place_details(arguments), 20.0, "Timed out getting OSM place details.")
+        elif name == "get_osm_places_details":
+            out = await _with_timeout(tool_get_osm_places_details(arguments), 25.0, "Timed out getting OSM place details.")
         elif name == "translate_ja_to_en":
             out = await _with_timeout(tool_translate_ja_to_en(arguments), 60.0, "Timed out translating text.")
         elif name == "ping":
@@ -326,13 +416,27 @@ async def info(_request: Request):
         "version": "1.0.0",
         "endpoints": {"rpc": "/", "health": "/health", "openapi": "/openapi.json", "info": "/info"},
         "tools": [t.name for t in await list_tools()],
-        "model": {"name": MODEL_NAME, "ready": _model_ready, "error": _model_error},
+        "model": {"name": MODEL_NAME, "backend": BACKEND, "ready": _model_ready, "state": _model_state,
+                  "error": _model_error, "startup_timings": _startup_timings},
+        "translation_cache": _translation_cache.stats(),
+        "translation_memory": _translation_memory.stats() if _translation_memory is not None else None,
+        "overpass": _overpass.stats(),
+        "restaurant_tiles": _restaurants.stats(),
+        "osm_index": _osm_index.stats() if _osm_index is not None else None,
+        "osm_entities": _entities.stats(),
     })
 
 async def health(_request: Request):
-    return JSONResponse({"status": "healthy" if _model_ready else "degraded",
+    if _model_ready:
+        status = "healthy"
+    elif _model_state in ("loading", "warming", "waiting-for-daemon"):
+        status = _model_state
+    else:
+        status = "degraded"
+    return JSONResponse({"status": status,
                          "service": SERVICE_NAME,
                          "model_ready": _model_ready,
+                         "model_state": _model_state,
                          "model_error": _model_error})
 
 async def openapi(_request: Request):
@@ -345,8 +449,16 @@ async def openapi(_request: Request):
 
 # ===== Lifespan (do model load here; DO NOT crash on failure) =====
 async def lifespan(app):
-    await load_model_on_startup()
+    # Background load: the app serves /health right away while mBART loads and warms up
+    startup = asyncio.create_task(load_model_on_startup())
+    await _overpass.start()
     yield
+    startup.cancel()
+    await _overpass.close()
+    if _daemon is not None:
+        await _daemon.close()
+    _inference_executor.shutdown(wait=False, cancel_futures=True)
+    _translation_cache.close()
 
 # ===== Starlette app =====
 app = Starlette(
@@ -1,16 +1,19 @@
+import os
 import json
+import threading
+import time
+from contextlib import aclosing
 from datetime import datetime, timezone as dt_timezone
 from typing import Any, Dict, List
 
 import asyncio
-import random
 import httpx
 from mcp.server import Server
 from mcp.types import Tool, TextContent
 from pydantic import BaseModel
 from starlette.applications import Starlette
 from starlette.routing import Route
-from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from starlette.middleware.cors import CORSMiddleware
 from starlette.requests import Request
 from starlette.types import Scope, Receive, Send
@@ -24,38 +27,153 @@ except Exception:
 
 # ===== Translation model (eager loaded at startup) =====
 import torch
-from transformers import MBart50TokenizerFast, MBartForConditionalGeneration
-
+from transformers import StoppingCriteriaList
+
+from mbart_backend import BACKEND, WARMUP_TEXT, format_timings, load_translation_model
+
+from mbart_engine import (
+    DECODING_PROFILES,
+    DEFAULT_PROFILE,
+    AsyncTextStreamer,
+    MbartRunner,
+    StopWhen,
+    TranslationBatcher,
+    MBART50_LANGUAGES,
+    join_translated_paragraphs,
+    decoding_kwargs,
+    make_inference_executor,
+    resolve_language,
+    resolve_profile,
+    split_japanese_sentences,
+)
+from mbart_daemon import SOCKET_PATH, USE_DAEMON, MbartDaemonClient, wait_until_ready
+from translation_cache import TranslationCache
+from translation_memory import load_translation_memory
+from deadlines import run_with_deadline
+from osm_overpass import OverpassClient
+from osm_tiles import RestaurantTileCache
+from osm_index import load_restaurant_index, search_restaurants
+from osm_entities import MAX_BATCH_IDS, OSM_TYPES, OsmEntityCache
+
+MODEL_NAME = "facebook/mbart-large-50-many-to-many-mmt"
 _tokenizer = None
 _model = None
+_model_id = MODEL_NAME  # includes the inference backend; used in cache keys
+_runner: MbartRunner | None = None
 _model_lock = asyncio.Lock()
 _model_ready = False
 _model_error: str | None = None
+_model_state = "loading"  # loading -> warming -> ready (or error); shown on /health
+_startup_timings: Dict[str, Any] = {}
+
+# Micro-batching: concurrent translate calls share one padded generate
+BATCH_WINDOW_MS = 10.0
+BATCH_MAX_SIZE = 16
+BATCH_MAX_TOKENS = 4096
+
+# Inference runs off the event loop in a dedicated pool. Each worker gets its
+# own share of intra-op threads (default: CPU cores / workers).
+INFERENCE_WORKERS = int(os.getenv("MBART_WORKERS", "1"))
+INFERENCE_THREADS_PER_WORKER = int(os.getenv("MBART_THREADS_PER_WORKER", "0")) or None
+
+def _count_source_tokens(text: str) -> int:
+    return _runner.count_tokens(text)
+
+def _generate_batch(texts: List[str], params: Dict[str, Any], should_stop) -> List[str]:
+    """
+    Translate a batch of texts (one language pair, given in params) with a single
+    padded generate call. Runs on an inference worker; stops early if every
+    caller has given up.
+    """
+    return _runner.generate_batch(texts, params, should_stop)
+
+_inference_executor = make_inference_executor(INFERENCE_WORKERS, INFERENCE_THREADS_PER_WORKER)
+_batcher = TranslationBatcher(
+    _generate_batch,
+    _count_source_tokens,
+    window_ms=BATCH_WINDOW_MS,
+    max_batch_size=BATCH_MAX_SIZE,
+    max_batch_tokens=BATCH_MAX_TOKENS,
+    executor=_inference_executor,
+    max_concurrent_batches=INFERENCE_WORKERS,
+)
+
+# With MBART_DAEMON_SOCKET set, translation goes to the shared mbart_daemon.py
+# process instead of loading a private copy of the model here
+_daemon = MbartDaemonClient() if USE_DAEMON else None
+
+# Agents ask for the same strings again and again: LRU + SQLite in front of the model
+_translation_cache = TranslationCache()
+
+# Human ja->en translations from the Kyoto corpus, checked before the cache and
+# the model (optional: built offline with `python translation_memory.py build`)
+_translation_memory = load_translation_memory()
 
 async def _ensure_model_loaded():
     """
-    Load the mBART model once. Safe to call multiple times due to the lock.
+    Load the mBART model once, then warm it up. Safe to call multiple times due to the lock.
+    Loading runs in a thread so the server answers /health while it starts.
     """
-    global _tokenizer, _model, _model_ready, _model_error
-    if _model_ready and _tokenizer is not None and _model is not None:
+    global _tokenizer, _model, _model_id, _runner, _model_ready, _model_error, _model_state
+    if _model_ready:
         return
 
     async with _model_lock:
-        if _model_ready and _tokenizer is not None and _model is not None:
+        if _model_ready:
             return
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
         try:
-            model_name = "facebook/mbart-large-50-many-to-many-mmt"
-            _tokenizer = MBart50TokenizerFast.from_pretrained(model_name)
-            _model = MBartForConditionalGeneration.from_pretrained(model_name)
-            _model.eval()  # inference mode
+            if _daemon is not None:
+                await _attach_daemon()
+                return
+
+            if _runner is None:  # pre-fork workers inherit the master's model
+                _model_state = "loading"
+                # backend (torch / onnx / onnx-int8) is picked by $MBART_BACKEND;
+                # weights come from the local safetensors snapshot when present
+                _tokenizer, _model, _model_id = await loop.run_in_executor(
+                    None, load_translation_model, MODEL_NAME, None, _startup_timings
+                )
+                _runner = MbartRunner(_tokenizer, _model, "ja_XX", "en_XX")
+                print(f"[startup] mBART weights loaded from {_startup_timings.get('weights_source')}.")
+
+            # Synthetic generate on every inference worker: lazy init is paid here,
+            # not by the first real request
+            _model_state = "warming"
+            warm_start = time.perf_counter()
+            await asyncio.gather(*[
+                loop.run_in_executor(_inference_executor, _generate_batch, [WARMUP_TEXT], {"max_length": 32}, lambda: False)
+                for _ in range(INFERENCE_WORKERS)
+            ])
+            _startup_timings["warmup_s"] = round(time.perf_counter() - warm_start, 3)
+            _startup_timings["total_s"] = round(time.perf_counter() - started, 3)
+
             _model_ready = True
             _model_error = None
-            print("[startup] mBART model loaded.")
+            _model_state = "ready"
+            print(f"[startup] mBART ready (backend={BACKEND}): {format_timings(_startup_timings)}")
         except Exception as e:
             _model_ready = False
             _model_error = f"{type(e).__name__}: {e}"
+            _model_state = "error"
             print(f"[startup] ERROR loading mBART: {_model_error}")
 
+async def _attach_daemon():
+    global _model_id, _model_ready, _model_error, _model_state
+
+    def on_state(state: str):
+        global _model_state
+        _model_state = state
+
+    print(f"[startup] Using shared mBART daemon at unix://{SOCKET_PATH}")
+    health = await wait_until_ready(_daemon, on_state)
+    _model_id = health["model_id"]
+    _model_ready = True
+    _model_error = None
+    _model_state = "ready"
+    print(f"[startup] mBART daemon ready (backend={health['backend']}).")
+
 # ===== Service config =====
 SERVICE_NAME = "translator-and-osm"
 PORT = 8001
@@ -109,45 +227,78 @@ def schema_get_osm_place_details() -> Dict[str, Any]:
         "required": ["osm_type", "osm_id"],
     }
 
+def schema_get_osm_places_details() -> Dict[str, Any]:
+    return {
+        "type": "object",
+        "properties": {
+            "places": {
+                "type": "array",
+                "description": f"OSM elements to look up (at most {MAX_BATCH_IDS})",
+                "items": schema_get_osm_place_details(),
+                "maxItems": MAX_BATCH_IDS,
+            },
+        },
+        "required": ["places"],
+    }
+
 def schema_translate_ja_to_en() -> Dict[str, Any]:
     return {
         "type": "object",
         "properties": {
             "text": {"type": "string", "description": "Japanese text"},
-            "max_length": {"type": "integer", "default": 512},
+            "max_length": {
+                "type": "integer",
+                "description": "Upper bound; the profile's budget scales with the source length",
+                "default": 512,
+            },
+            "profile": {
+                "type": "string",
+                "enum": list(DECODING_PROFILES),
+                "description": "Decoding profile: greedy-fast (lowest latency) ... beam-4-quality (best BLEU)",
+                "default": DEFAULT_PROFILE,
+            },
+            "mode": {
+                "type": "string",
+                "enum": ["auto", "single", "document"],
+                "description": "document: split into sentences and translate them as one batch; auto: document mode for multi-sentence input",
+                "default": "auto",
+            },
+            "stream": {
+                "type": "boolean",
+                "description": "Stream partial English text as Server-Sent Events (greedy-fast profile)",
+                "default": False,
+            },
         },
         "required": ["text"],
     }
 
+def schema_translate() -> Dict[str, Any]:
+    schema = schema_translate_ja_to_en()
+    schema["properties"]["text"] = {"type": "string", "description": "Text in the source language"}
+    schema["properties"]["src_lang"] = {
+        "type": "string",
+        "description": "Source language: mBART-50 code (ja_XX) or ISO 639-1 (ja)",
+        "default": "ja",
+    }
+    schema["properties"]["tgt_lang"] = {
+        "type": "string",
+        "description": "Target language: mBART-50 code (en_XX) or ISO 639-1 (en)",
+        "default": "en",
+    }
+    schema["properties"]["stream"]["description"] = "Stream partial translated text as Server-Sent Events (greedy-fast profile)"
+    return schema
+
 def schema_ping() -> Dict[str, Any]:
     return {"type": "object", "properties": {"msg": {"type": "string", "default": "ok"}}, "required": []}
 
 # ===== Overpass helper with mirrors/retries =====
-async def overpass_query(client: httpx.AsyncClient, query: str) -> dict:
-    endpoints = OVERPASS_ENDPOINTS[:]
-    random.shuffle(endpoints)
-    attempts = 0
-    last_exc = None
-    while attempts < 4:
-        for base in endpoints:
-            try:
-                resp = await client.post(
-                    base,
-                    data={"data": query},
-                    headers={
-                        "content-type": "application/x-www-form-urlencoded",
-                        "user-agent": USER_AGENT,
-                    },
-                    timeout=httpx.Timeout(connect=5.0, read=20.0, write=10.0, pool=5.0),
-                )
-                resp.raise_for_status()
-                return resp.json()
-            except (httpx.TimeoutException, httpx.HTTPStatusError, httpx.TransportError) as e:
-                last_exc = e
-                continue
-        attempts += 1
-        await asyncio.sleep(min(2 ** attempts, 6))
-    raise RuntimeError(f"Overpass query failed across mirrors. Last error: {last_exc}")
+# Process-wide pooled client (keep-alive / HTTP/2); opened and closed in the lifespan
+_overpass = OverpassClient(USER_AGENT, OVERPASS_ENDPOINTS)
+_restaurants = RestaurantTileCache(_overpass)
+# Optional offline index (osm_index.py import ...); None -> every search goes to Overpass
+_osm_index = load_restaurant_index()
+# Places seen in search results, for detail lookups without another query
+_entities = OsmEntityCache(_overpass, _osm_index)
 
 # ===== Helpers =====
 def format_hours(tags: dict) -> str:
@@ -192,26 +343,19 @@ async def tool_search_osm_restaurants(arguments: Dict[str, Any]) -> str:
     lon = float(arguments["longitude"])
     limit = int(arguments.get("limit", 10))
     radius_m = int(arguments.get("radius_m", DEFAULT_SEARCH_RADIUS_M))
-    query = f"""
-    [out:json][timeout:25];
-    (
-      node["amenity"="restaurant"](around:{radius_m},{lat},{lon});
-      way["amenity"="restaurant"](around:{radius_m},{lat},{lon});
-      relation["amenity"="restaurant"](around:{radius_m},{lat},{lon});
-    );
-    out tags center {limit};
-    """
-    async with httpx.AsyncClient() as client:
-        try:
-            data = await overpass_query(client, query)
-        except httpx.HTTPStatusError as e:
-            return f"Overpass error {e.response.status_code}. Reduce radius/limit and try again."
-        except Exception as e:
-            return f"Error querying Overpass: {e}"
-    els = data.get("elements", [])
+    try:
+        # Offline index when it covers the area, else cached geohash tiles / live Overpass
+        els = await search_restaurants(_osm_index, _restaurants, lat, lon, radius_m, limit)
+    except httpx.HTTPStatusError as e:
+        return f"Overpass error {e.response.status_code}. Reduce radius/limit and try again."
+    except LookupError as e:
+        return str(e)
+    except Exception as e:
+        return f"Error querying Overpass: {e}"
+    _entities.remember(els)
     if not els:
         return f"No OSM restaurants found near {lat}, {lon} within {radius_m} m."
-    lines = [f"OSM restaurants near {lat}, {lon} (radius {radius_m} m):", ""]
+    lines = [f"OSM restaurants near {lat}, {lon} (radius {radius_m} m, nearest first):", ""]
     for i, el in enumerate(els[:limit], 1):
         tags = el.get("tags") or {}
         name = tags.get("name", "Unnamed")
@@ -232,6 +376,7 @@ async def tool_search_osm_restaurants(arguments: Dict[str, Any]) -> str:
             f"{i}. {name}",
             f"   OSM: {url}",
             f"   Coords: {el_lat}, {el_lon}",
+            f"   Distance: {el.get('distance_m', 'N/A')} m",
             f"   Address: {addr}",
             f"   Cuisine: {cuisine}",
             f"   Phone: {phone}",
@@ -241,23 +386,7 @@ async def tool_search_osm_restaurants(arguments: Dict[str, Any]) -> str:
         ]
     return "\n".join(lines).strip()
 
-async def tool_get_osm_place_details(arguments: Dict[str, Any]) -> str:
-    osm_type = str(arguments["osm_type"]).lower().strip()
-    osm_id = int(arguments["osm_id"])
-    if osm_type not in {"node", "way", "relation"}:
-        return "osm_type must be one of: node, way, relation."
-    query = f"""[out:json][timeout:25]; {osm_type}({osm_id}); out tags center;"""
-    async with httpx.AsyncClient() as client:
-        try:
-            data = await overpass_query(client, query)
-        except httpx.HTTPStatusError as e:
-            return f"Overpass error {e.response.status_code}."
-        except Exception as e:
-            return f"Error querying Overpass: {e}"
-    els = data.get("elements", [])
-    if not els:
-        return f"No element found for {osm_type} {osm_id}."
-    el = els[0]
+def format_place_details(osm_type: str, osm_id: int, el: dict) -> str:
     tags = el.get("tags") or {}
     name = tags.get("name", "Unnamed")
     addr = format_osm_address(tags)
@@ -266,7 +395,7 @@ async def tool_get_osm_place_details(arguments: Dict[str, Any]) -> str:
     website = tags.get("website") or tags.get("contact:website") or "N/A"
     opening = format_hours(tags)
     url = osm_url(osm_type, osm_id)
-    if "lat" in el and "lon" in el:
+    if el.get("lat") is not None and el.get("lon") is not None:
         el_lat, el_lon = el["lat"], el["lon"]
     else:
         center = el.get("center") or {}
@@ -288,30 +417,168 @@ async def tool_get_osm_place_details(arguments: Dict[str, Any]) -> str:
     ]
     return "\n".join(lines).strip()
 
+async def tool_get_osm_place_details(arguments: Dict[str, Any]) -> str:
+    osm_type = str(arguments["osm_type"]).lower().strip()
+    osm_id = int(arguments["osm_id"])
+    if osm_type not in OSM_TYPES:
+        return "osm_type must be one of: node, way, relation."
+    try:
+        # Places from recent search results are answered from the entity cache
+        el = await _entities.get(osm_type, osm_id)
+    except httpx.HTTPStatusError as e:
+        return f"Overpass error {e.response.status_code}."
+    except Exception as e:
+        return f"Error querying Overpass: {e}"
+    if el is None:
+        return f"No element found for {osm_type} {osm_id}."
+    return format_place_details(osm_type, osm_id, el)
+
+async def tool_get_osm_places_details(arguments: Dict[str, Any]) -> str:
+    try:
+        refs = [(str(p["osm_type"]).lower().strip(), int(p["osm_id"])) for p in arguments["places"]]
+    except (KeyError, TypeError, ValueError):
+        return "places must be a list of {osm_type, osm_id} objects."
+    if not refs:
+        return "places must not be empty."
+    if len(refs) > MAX_BATCH_IDS:
+        return f"At most {MAX_BATCH_IDS} places per call."
+    if any(t not in OSM_TYPES for t, _ in refs):
+        return "osm_type must be one of: node, way, relation."
+    try:
+        # Cached places are answered locally; the rest share one Overpass union query
+        found = await _entities.get_many(refs)
+    except httpx.HTTPStatusError as e:
+        return f"Overpass error {e.response.status_code}."
+    except Exception as e:
+        return f"Error querying Overpass: {e}"
+    blocks = [
+        format_place_details(t, i, found[(t, i)]) if found[(t, i)] is not None else f"No element found for {t} {i}."
+        for t, i in dict.fromkeys(refs)
+    ]
+    return "\n\n---\n\n".join(blocks)
+
 async def tool_translate_ja_to_en(arguments: Dict[str, Any]) -> str:
+    return await tool_translate({**arguments, "src_lang": "ja_XX", "tgt_lang": "en_XX"})
+
+async def tool_translate(arguments: Dict[str, Any]) -> str:
     """
-    Real translation via mBART (eager loaded at startup).
+    Real translation via mBART (eager loaded at startup), any mBART-50 language pair.
     """
+    try:
+        src_lang = resolve_language(arguments.get("src_lang", "ja"))
+        tgt_lang = resolve_language(arguments.get("tgt_lang", "en"))
+        profile = resolve_profile(arguments.get("profile"))
+    except ValueError as e:
+        return f"[translation-error] {e}"
+
+    text = arguments["text"]
     if not _model_ready:
-        # Surface a clear error if startup failed
-        err = _model_error or "model not loaded"
+        # The translation memory needs no model: it answers even during startup
+        remembered = _memory_lookup(text, src_lang, tgt_lang)
+        if remembered is not None:
+            return remembered
+        # Surface a clear error if startup failed (or is still running)
+        err = _model_error or f"model {_model_state}"
         return f"[translation-error] mBART not ready: {err}"
+    max_length = int(arguments.get("max_length", 512))
+    mode = str(arguments.get("mode", "auto")).lower()
+    # The runner turns profile + source length into the actual generate() settings
+    params = {"max_length": max_length, "profile": profile}
+
+    if mode != "single":
+        paragraphs = split_japanese_sentences(text)
+        if mode == "document" or sum(len(p) for p in paragraphs) > 1:
+            # Submitted together, the sentences land in the same batching window
+            translated = await asyncio.gather(*[
+                asyncio.gather(*[_translate_cached(s, src_lang, tgt_lang, params) for s in sentences])
+                for sentences in paragraphs
+            ])
+            return join_translated_paragraphs(translated)
+
+    return await _translate_cached(text, src_lang, tgt_lang, params)
+
+def _memory_lookup(text: str, src_lang: str, tgt_lang: str) -> str | None:
+    if _translation_memory is None or (src_lang, tgt_lang) != ("ja_XX", "en_XX"):
+        return None
+    match = _translation_memory.lookup(text)
+    return match.translation if match else None
+
+async def _translate_cached(text: str, src_lang: str, tgt_lang: str, params: Dict[str, Any]) -> str:
+    remembered = _memory_lookup(text, src_lang, tgt_lang)
+    if remembered is not None:
+        return remembered
+    cached = _translation_cache.get(text, src_lang, tgt_lang, _model_id, params)
+    if cached is not None:
+        return cached
+
+    if _daemon is not None:
+        # Batched inside the daemon, together with the other servers' requests
+        translation = await _daemon.translate(text, params, src_lang, tgt_lang)
+    else:
+        # Queued; the batcher groups requests by (src_lang, tgt_lang) + params
+        # and runs one generate per group in the window
+        translation = await _batcher.submit(text, {**params, "src_lang": src_lang, "tgt_lang": tgt_lang})
+    _translation_cache.put(text, src_lang, tgt_lang, _model_id, params, translation)
+    return translation
 
+# ===== Streaming translation (SSE) =====
+# Greedy decoding only: transformers streamers do not support beam search.
+STREAM_TIMEOUT_S = 60.0
+
+def _generate_streaming(
+    text: str, src_lang: str, tgt_lang: str, max_length: int, streamer: AsyncTextStreamer, stop: threading.Event
+) -> None:
+    encoded = _runner.encode([text], src_lang)
+    try:
+        with torch.no_grad():
+            _model.generate(
+                **encoded,
+                **decoding_kwargs("greedy-fast", encoded["input_ids"].shape[1], _runner.lang_ids[tgt_lang], max_length),
+                streamer=streamer,
+                stopping_criteria=StoppingCriteriaList([StopWhen(stop.is_set)]),
+            )
+    finally:
+        streamer.end()
+
+async def stream_translation(arguments: Dict[str, Any], src_lang: str, tgt_lang: str):
+    """
+    Yield partial translated text sentence by sentence, token by token.
+    Stops the running generate() if the client disconnects or time runs out.
+    """
     text = arguments["text"]
     max_length = int(arguments.get("max_length", 512))
-
-    # Set Japanese as source
-    _tokenizer.src_lang = "ja_XX"
-
-    encoded = _tokenizer(text, return_tensors="pt", truncation=True)
-    with torch.no_grad():
-        generated = _model.generate(
-            **encoded,
-            forced_bos_token_id=_tokenizer.lang_code_to_id["en_XX"],
-            max_length=max_length,
-        )
-    translation = _tokenizer.batch_decode(generated, skip_special_tokens=True)[0]
-    return translation
+    # Same cache entries as non-streamed greedy-fast calls
+    params = {"max_length": max_length, "profile": "greedy-fast"}
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + STREAM_TIMEOUT_S
+    stop = threading.Event()
+    try:
+        for p_idx, sentences in enumerate(split_japanese_sentences(text)):
+            for s_idx, sentence in enumerate(sentences):
+                if p_idx or s_idx:
+                    yield " " if s_idx else "\n"
+                cached = _memory_lookup(sentence, src_lang, tgt_lang)
+                if cached is None:
+                    cached = _translation_cache.get(sentence, src_lang, tgt_lang, _model_id, params)
+                if cached is not None:
+                    yield cached
+                    continue
+                streamer = AsyncTextStreamer(_runner.decode, loop)
+                job = loop.run_in_executor(
+                    _inference_executor, _generate_streaming, sentence, src_lang, tgt_lang, max_length, streamer, stop
+                )
+                parts = []
+                while True:
+                    delta = await asyncio.wait_for(streamer.queue.get(), timeout=max(0.0, deadline - loop.time()))
+                    if delta is None:
+                        break
+                    parts.append(delta)
+                    yield delta
+                await job
+                _translation_cache.put(sentence, src_lang, tgt_lang, _model_id, params, "".join(parts))
+    finally:
+        # Client gone or timed out: the running generate stops at its next step
+        stop.set()
 
 async def tool_ping(arguments: Dict[str, Any]) -> str:
     return f"pong: {arguments.get('msg','ok')}"
@@ -324,15 +591,24 @@ async def list_tools() -> List[Tool]:
         Tool(name="get_current_time", description="Get the current time.", inputSchema=schema_get_current_time()),
         Tool(name="search_osm_restaurants", description="Find nearby restaurants from OSM (no key).", inputSchema=schema_search_osm_restaurants()),
         Tool(name="get_osm_place_details", description="Get detailed tags for an OSM element.", inputSchema=schema_get_osm_place_details()),
+        Tool(
+            name="get_osm_places_details",
+            description="Get detailed tags for many OSM elements in one call.",
+            inputSchema=schema_get_osm_places_details(),
+        ),
         Tool(name="translate_ja_to_en", description="Translate Japanese to English.", inputSchema=schema_translate_ja_to_en()),
+        Tool(
+            name="translate",
+            description=f"Translate between any two of the {len(MBART50_LANGUAGES)} mBART-50 languages.",
+            inputSchema=schema_translate(),
+        ),
         Tool(name="ping", description="Quick connectivity check.", inputSchema=schema_ping()),
     ]
 
 async def _with_timeout(coro, seconds: float, msg: str):
-    try:
-        return await asyncio.wait_for(coro, timeout=seconds)
-    except asyncio.TimeoutError:
-        return msg
+    # The deadline is visible to the work inside `coro`: Overpass timeouts and
+    # retries shrink to it and generate() stops at it
+    return await run_with_deadline(coro, seconds, msg)
 
 @mcp_server.call_tool()
 async def call_tool(name: str, arguments: Dict[str, Any]) -> List[TextContent]:
@@ -344,9 +620,14 @@ async def call_tool(name: str, arguments: Dict[str, Any]) -> List[TextContent]:
             out = await _with_timeout(tool_search_osm_restaurants(arguments), 25.0, "Timed out searching OSM restaurants.")
         elif name == "get_osm_place_details":
             out = await _with_timeout(tool_get_osm_place_details(arguments), 20.0, "Timed out getting OSM place details.")
+        elif name == "get_osm_places_details":
+            out = await _with_timeout(tool_get_osm_places_details(arguments), 25.0, "Timed out getting OSM place details.")
         elif name == "translate_ja_to_en":
-            # allow more time (model is already loaded at startup, but generation takes a moment)
+            # allow more time (model is already loaded at startup, but generation takes a moment).
+            # On timeout the queued request is dropped, or its batch stops decoding.
             out = await _with_timeout(tool_translate_ja_to_en(arguments), 60.0, "Timed out translating text.")
+        elif name == "translate":
+            out = await _with_timeout(tool_translate(arguments), 60.0, "Timed out translating text.")
         elif name == "ping":
             out = await _with_timeout(tool_ping(arguments), 3.0, "Timed out pinging.")
         else:
@@ -369,6 +650,53 @@ def _tool_to_dict(t: Tool) -> dict:
         "inputSchema": t.inputSchema or {"type": "object", "properties": {}},
     }
 
+def _wants_stream(request: Request, params: dict) -> bool:
+    """
+    Stream only if the client accepts SSE and asked for it, either with
+    arguments.stream or by sending a progress token.
+    """
+    if "text/event-stream" not in request.headers.get("accept", ""):
+        return False
+    arguments = params.get("arguments") or {}
+    progress_token = (params.get("_meta") or {}).get("progressToken")
+    return bool(arguments.get("stream")) or progress_token is not None
+
+def _sse_event(message: dict) -> str:
+    return f"event: message\ndata: {json.dumps(message, ensure_ascii=False)}\n\n"
+
+async def _sse_translation(rid, params: dict, arguments: Dict[str, Any]):
+    """
+    Emit partial text as notifications/progress messages, then the usual tools/call result.
+    """
+    name = params.get("name")
+    progress_token = (params.get("_meta") or {}).get("progressToken", rid)
+    partial = ""
+    tokens = 0
+    try:
+        if name == "translate_ja_to_en":
+            src_lang, tgt_lang = "ja_XX", "en_XX"
+        else:
+            src_lang = resolve_language(arguments.get("src_lang", "ja"))
+            tgt_lang = resolve_language(arguments.get("tgt_lang", "en"))
+        # aclosing: a client disconnect closes the generator and stops generate() right away
+        async with aclosing(stream_translation(arguments, src_lang, tgt_lang)) as deltas:
+            async for delta in deltas:
+                partial += delta
+                tokens += 1
+                yield _sse_event({
+                    "jsonrpc": "2.0",
+                    "method": "notifications/progress",
+                    "params": {"progressToken": progress_token, "progress": tokens, "message": partial},
+                })
+        text = partial
+    except asyncio.TimeoutError:
+        text = "Timed out translating text."
+    except ValueError as e:
+        text = f"[translation-error] {e}"
+    except Exception as e:
+        text = f"Unhandled error in tool '{name}': {e}"
+    yield _sse_event({"jsonrpc": "2.0", "id": rid, "result": {"content": [{"type": "text", "text": text}]}})
+
 async def handle_streamable_http(request: Request):
     if request.method != "POST":
         return PlainTextResponse("Method Not Allowed", status_code=405)
@@ -399,6 +727,12 @@ async def handle_streamable_http(request: Request):
         params = req.params or {}
         name = params.get("name")
         arguments = params.get("arguments") or {}
+        if name in ("translate", "translate_ja_to_en") and _wants_stream(request, params) and _model_ready and _daemon is None:
+            return StreamingResponse(
+                _sse_translation(rid, params, arguments),
+                media_type="text/event-stream",
+                headers={"cache-control": "no-cache", "x-accel-buffering": "no"},
+            )
         content = await call_tool(name, arguments)  # List[TextContent]
         result_content = [{"type": "text", "text": c.text} for c in content]
         return JSONResponse({"jsonrpc": "2.0", "id": rid, "result": {"content": result_content}})
@@ -407,18 +741,57 @@ async def handle_streamable_http(request: Request):
 
 # ===== Service info & health =====
 async def info(_request: Request):
+    daemon_metrics = None
+    if _daemon is not None:
+        try:
+            daemon_metrics = await _daemon.metrics()
+        except Exception as e:
+            daemon_metrics = {"error": f"{type(e).__name__}: {e}"}
     return JSONResponse({
         "service": SERVICE_NAME,
         "version": "1.0.0",
         "endpoints": {"rpc": "/", "health": "/health", "openapi": "/openapi.json", "info": "/info"},
         "tools": [t.name for t in await list_tools()],
         "model_ready": _model_ready,
+        "model_state": _model_state,
         "model_error": _model_error,
+        "model_backend": BACKEND,
+        "startup_timings": _startup_timings,
+        "worker": {"pid": os.getpid(), **_memory_usage()},
+        "translation_batching": _batcher.stats(),
+        "inference_daemon": daemon_metrics,
+        "translation_cache": _translation_cache.stats(),
+        "translation_memory": _translation_memory.stats() if _translation_memory is not None else None,
+        "overpass": _overpass.stats(),
+        "restaurant_tiles": _restaurants.stats(),
+        "osm_index": _osm_index.stats() if _osm_index is not None else None,
+        "osm_entities": _entities.stats(),
     })
 
+def _memory_usage() -> Dict[str, Any]:
+    """
+    RSS and PSS of this process (Linux). With pre-fork workers PSS shows the
+    shared model weights split across processes instead of counted per worker.
+    """
+    usage = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("Rss", "Pss", "Shared_Clean", "Private_Dirty"):
+                    usage[f"{key.lower()}_mb"] = round(int(value.split()[0]) / 1024, 1)
+    except OSError:
+        pass
+    return usage
+
 async def health(_request: Request):
-    status = "healthy" if _model_ready else "degraded"
-    return JSONResponse({"status": status, "service": SERVICE_NAME, "model_ready": _model_ready, "model_error": _model_error})
+    if _model_ready:
+        status = "healthy"
+    elif _model_state in ("loading", "warming", "waiting-for-daemon"):
+        status = _model_state
+    else:
+        status = "degraded"
+    return JSONResponse({"status": status, "service": SERVICE_NAME, "model_ready": _model_ready, "model_state": _model_state, "model_error": _model_error})
 
 async def openapi(_request: Request):
     return JSONResponse({
@@ -428,12 +801,22 @@ async def openapi(_request: Request):
         "paths": {"/": {"post": {"summary": "Streamable HTTP JSON-RPC"}}},
     })
 
-# ===== Lifespan to eager-load the model =====
+# ===== Lifespan to eager-load (and warm up) the model =====
 async def lifespan(app):
+    # Load in the background: the server accepts requests right away and
+    # /health reports loading -> warming -> healthy
     print("[startup] Beginning eager model load…")
-    await _ensure_model_loaded()
-    print(f"[startup] model_ready={_model_ready} error={_model_error}")
+    await _batcher.start()
+    startup = asyncio.create_task(_ensure_model_loaded())
+    await _overpass.start()
     yield
+    startup.cancel()
+    await _overpass.close()
+    if _daemon is not None:
+        await _daemon.close()
+    await _batcher.stop()
+    _inference_executor.shutdown(wait=False, cancel_futures=True)
+    _translation_cache.close()
     print("[shutdown] Server stopping.")
 
 # ===== Starlette app =====
@@ -455,7 +838,105 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ===== Pre-fork multi-worker mode =====
+# The master loads mBART once, freezes the GC and forks workers that share the
+# weights copy-on-write. Each worker runs its own event loop, batcher and
+# inference pool on the shared listening socket, so JSON parsing and Overpass
+# I/O scale across cores while memory stays near one model copy.
+def _run_prefork_worker(sock, workers: int) -> None:
+    global _translation_cache, _inference_executor, _osm_index
+    # SQLite connections must not cross fork(); each worker opens its own
+    _translation_cache = TranslationCache()
+    _osm_index = load_restaurant_index()
+    _entities.index = _osm_index
+    # Split the cores between processes as well as between inference threads
+    threads = INFERENCE_THREADS_PER_WORKER or max(1, (os.cpu_count() or 1) // (workers * INFERENCE_WORKERS))
+    _inference_executor = make_inference_executor(INFERENCE_WORKERS, threads)
+    _batcher.executor = _inference_executor
+    print(f"[prefork] worker {os.getpid()} serving")
+    uvicorn.Server(uvicorn.Config(app)).run(sockets=[sock])
+
+def serve_prefork(workers: int, host: str = "0.0.0.0", port: int = PORT) -> None:
+    global _tokenizer, _model, _model_id, _runner
+    import gc
+    import signal
+    import socket
+
+    if _daemon is None:
+        print(f"[prefork] Loading mBART in master (pid {os.getpid()})…")
+        started = time.perf_counter()
+        _tokenizer, _model, _model_id = load_translation_model(MODEL_NAME, None, _startup_timings)
+        _runner = MbartRunner(_tokenizer, _model, "ja_XX", "en_XX")
+        print(f"[prefork] Model loaded in {time.perf_counter() - started:.1f}s; warmup runs in each worker.")
+    # Generation is never run here: OpenMP and worker threads do not survive fork()
+    _translation_cache.close()
+    if _osm_index is not None:
+        _osm_index.close()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    # Move everything allocated so far into the permanent generation: the GC
+    # never writes to these objects again, so their pages stay shared
+    gc.collect()
+    gc.freeze()
+
+    children: Dict[int, bool] = {}
+    stopping = False
+
+    def spawn() -> None:
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            try:
+                _run_prefork_worker(sock, workers)
+            finally:
+                os._exit(0)
+        children[pid] = True
+
+    def stop(signum, _frame) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    for _ in range(workers):
+        spawn()
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    print(f"[prefork] {workers} workers on http://{host}:{port} (master pid {os.getpid()})")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.pop(pid, None)
+        if not stopping:
+            print(f"[prefork] worker {pid} exited (status {status}); restarting")
+            spawn()
+    print("[prefork] All workers stopped.")
+
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Translator + OSM MCP server")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("SERVER_WORKERS", "1")),
+                        help="Pre-fork this many workers sharing one model copy (default: 1, single process)")
+    args = parser.parse_args()
+
     print(f"Starting combined MCP server on http://localhost:{PORT}")
-    uvicorn.run(app, host="0.0.0.0", port=PORT)
+    if args.workers > 1:
+        serve_prefork(args.workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=PORT)
 
@@ -0,0 +1,56 @@
+import os
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import List, Tuple
+
+# ===== Kyoto wiki parallel corpus (ja/en) =====
+# Same loading and splits as Projects/machine_translation.ipynb, so numbers
+# measured here are comparable with the notebook's evaluations.
+# Set KYOTO_CORPUS_DIR to an unpacked copy to skip the kagglehub download.
+
+KAGGLE_DATASET = "team-ai/japaneseenglish-bilingual-corpus"
+
+
+def corpus_root() -> Path:
+    if os.getenv("KYOTO_CORPUS_DIR"):
+        return Path(os.environ["KYOTO_CORPUS_DIR"])
+    import kagglehub
+
+    return Path(kagglehub.dataset_download(KAGGLE_DATASET))
+
+
+def _strip_ns(tag: str) -> str:
+    return tag.split("}", 1)[1] if "}" in tag else tag
+
+
+def _text(el) -> str | None:
+    return (el.text or "").strip() or None
+
+
+def load_kyoto_pairs(root: Path | None = None) -> List[Tuple[str, str]]:
+    """
+    All (ja, en) pairs from wiki_corpus_2.01/BDS*.xml: every element with
+    both a <j> and an <e> child.
+    """
+    base = (root or corpus_root()) / "wiki_corpus_2.01" / "BDS"
+    pairs = []
+    for xf in sorted(base.glob("BDS*.xml")):
+        for node in ET.parse(xf).getroot().iter():
+            tagmap = {_strip_ns(c.tag).lower(): c for c in node}
+            if "j" in tagmap and "e" in tagmap:
+                ja, en = _text(tagmap["j"]), _text(tagmap["e"])
+                if ja and en:
+                    pairs.append((ja, en))
+    return pairs
+
+
+def kyoto_splits(pairs: List[Tuple[str, str]]) -> dict:
+    """
+    {"train": ..., "val": ..., "test": ...} lists of (ja, en), split like the
+    notebook: 20% test, then 10% of the rest for validation (random_state=42).
+    """
+    from sklearn.model_selection import train_test_split
+
+    train, test = train_test_split(pairs, test_size=0.2, random_state=42)
+    train, val = train_test_split(train, test_size=0.1, random_state=42)
+    return {"train": train, "val": val, "test": test}
@@ -0,0 +1,280 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import torch
+from transformers import MBart50TokenizerFast, MBartForConditionalGeneration
+
+# ===== Pluggable inference backend for the translation servers =====
+# torch      fp32 PyTorch MBartForConditionalGeneration (default)
+# onnx       ONNX Runtime: encoder + decoder + decoder-with-past graphs (optimum)
+# onnx-int8  same graphs after int8 dynamic quantization
+# Every backend returns a model with the usual `.generate()`, so the servers'
+# generate calls (stopping criteria, streamers) work unchanged.
+
+MODEL_NAME = "facebook/mbart-large-50-many-to-many-mmt"
+BACKEND = os.getenv("MBART_BACKEND", "torch")
+ONNX_DIR = Path(os.getenv("MBART_ONNX_DIR", Path(__file__).resolve().parent / "onnx" / "mbart-large-50"))
+# Pre-converted local copy (safetensors, memory-mapped on load); see `snapshot` below
+SNAPSHOT_DIR = Path(os.getenv("MBART_SNAPSHOT_DIR", Path(__file__).resolve().parent / "snapshots" / "mbart-large-50"))
+BACKENDS = ("torch", "onnx", "onnx-int8")
+WARMUP_TEXT = "こんにちは。今日はいい天気ですね。"
+
+SAMPLE_SENTENCES = [
+    "今日はとても良い天気ですね。",
+    "駅の近くにおいしいラーメン屋はありますか？",
+    "京都は日本の古都として知られている。",
+    "このお寺は八世紀に建てられた。",
+    "会議は午後三時から始まります。",
+    "彼は東京大学で物理学を学んだ。",
+    "予約をキャンセルしたいのですが。",
+    "天皇は平安京に都を移した。",
+]
+
+
+def onnx_dir_for(backend: str) -> Path:
+    return ONNX_DIR / ("int8" if backend == "onnx-int8" else "fp32")
+
+
+def has_local_snapshot() -> bool:
+    return any(SNAPSHOT_DIR.glob("*.safetensors"))
+
+
+def load_translation_model(
+    model_name: str = MODEL_NAME,
+    backend: str | None = None,
+    timings: Dict[str, float] | None = None,
+) -> Tuple[Any, Any, str]:
+    """
+    Load tokenizer + model for `backend` (default: $MBART_BACKEND).
+    Returns (tokenizer, model, model_id); model_id includes the backend so
+    caches never mix outputs of different backends.
+    The torch backend reads the local safetensors snapshot when present
+    (memory-mapped, no hub lookup). Phase durations go into `timings`.
+    """
+    backend = backend or BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}'. Use one of: {', '.join(BACKENDS)}")
+    timings = {} if timings is None else timings
+    source = str(SNAPSHOT_DIR) if has_local_snapshot() else model_name
+
+    start = time.perf_counter()
+    tokenizer = MBart50TokenizerFast.from_pretrained(source)
+    timings["tokenizer_s"] = round(time.perf_counter() - start, 3)
+
+    start = time.perf_counter()
+    if backend == "torch":
+        model = MBartForConditionalGeneration.from_pretrained(source, use_safetensors=True if source != model_name else None)
+        model.eval()
+        timings["weights_s"] = round(time.perf_counter() - start, 3)
+        timings["weights_source"] = source
+        return tokenizer, model, model_name
+
+    from optimum.onnxruntime import ORTModelForSeq2SeqLM
+
+    path = onnx_dir_for(backend)
+    if not path.exists():
+        raise FileNotFoundError(f"{path} not found. Run: python mbart_backend.py export{' --quantize' if backend == 'onnx-int8' else ''}")
+    model = ORTModelForSeq2SeqLM.from_pretrained(path, use_cache=True, provider="CPUExecutionProvider")
+    timings["weights_s"] = round(time.perf_counter() - start, 3)
+    timings["weights_source"] = str(path)
+    return tokenizer, model, f"{model_name}+{backend}"
+
+
+def warmup_model(tokenizer, model) -> float:
+    """
+    Run one short synthetic generate so kernel selection, thread-pool creation and
+    other lazy init happen before the first real request. Returns seconds spent.
+    """
+    start = time.perf_counter()
+    tokenizer.src_lang = "ja_XX"
+    encoded = tokenizer(WARMUP_TEXT, return_tensors="pt")
+    with torch.no_grad():
+        model.generate(**encoded, forced_bos_token_id=tokenizer.lang_code_to_id["en_XX"], max_length=32)
+    return time.perf_counter() - start
+
+
+def format_timings(timings: Dict[str, Any]) -> str:
+    return " | ".join(f"{k[:-2]} {v:.2f}s" for k, v in timings.items() if k.endswith("_s"))
+
+
+# ===== Local snapshot =====
+def write_snapshot(model_name: str = MODEL_NAME) -> None:
+    """
+    Save tokenizer + weights as safetensors under SNAPSHOT_DIR. Later startups
+    mmap the weights from there instead of unpickling a 2.4 GB checkpoint.
+    """
+    print(f"[snapshot] Converting {model_name} -> {SNAPSHOT_DIR}")
+    model = MBartForConditionalGeneration.from_pretrained(model_name)
+    model.save_pretrained(SNAPSHOT_DIR, safe_serialization=True)
+    MBart50TokenizerFast.from_pretrained(model_name).save_pretrained(SNAPSHOT_DIR)
+    print("[snapshot] Done.")
+
+
+# ===== Export / quantization =====
+def export_onnx(model_name: str = MODEL_NAME, quantize: bool = False) -> None:
+    from optimum.onnxruntime import ORTModelForSeq2SeqLM
+
+    fp32_dir = onnx_dir_for("onnx")
+    if not any(fp32_dir.glob("*.onnx")):
+        print(f"[export] Exporting {model_name} to ONNX (encoder, decoder, decoder with past) -> {fp32_dir}")
+        model = ORTModelForSeq2SeqLM.from_pretrained(model_name, export=True, use_cache=True)
+        model.save_pretrained(fp32_dir)
+        MBart50TokenizerFast.from_pretrained(model_name).save_pretrained(fp32_dir)
+    else:
+        print(f"[export] Reusing existing export in {fp32_dir}")
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        int8_dir = onnx_dir_for("onnx-int8")
+        int8_dir.mkdir(parents=True, exist_ok=True)
+        for f in fp32_dir.iterdir():
+            if f.suffix == ".onnx":
+                print(f"[export] int8 dynamic quantization: {f.name}")
+                quantize_dynamic(f, int8_dir / f.name, weight_type=QuantType.QInt8, use_external_data_format=True)
+            elif f.is_file() and not f.name.endswith((".onnx_data", ".onnx.data")):
+                shutil.copy2(f, int8_dir / f.name)  # configs + tokenizer files
+    print("[export] Done.")
+
+
+# ===== Parity + latency report =====
+def _translate(tokenizer, model, text: str, num_beams: int) -> Tuple[str, float]:
+    tokenizer.src_lang = "ja_XX"
+    encoded = tokenizer(text, return_tensors="pt", truncation=True)
+    start = time.perf_counter()
+    with torch.no_grad():
+        generated = model.generate(
+            **encoded,
+            forced_bos_token_id=tokenizer.lang_code_to_id["en_XX"],
+            max_length=128,
+            num_beams=num_beams,
+        )
+    elapsed = time.perf_counter() - start
+    return tokenizer.batch_decode(generated, skip_special_tokens=True)[0], elapsed
+
+
+def backend_report(backends: List[str], sentences: List[str], num_beams: int = 5, repeats: int = 3) -> Dict[str, Any]:
+    """
+    Translate `sentences` with every backend and compare against the PyTorch path:
+    exact-match rate, corpus BLEU vs. the PyTorch output, and per-request CPU latency.
+    """
+    outputs: Dict[str, List[str]] = {}
+    report: Dict[str, Any] = {"num_beams": num_beams, "sentences": len(sentences), "threads": torch.get_num_threads(), "backends": {}}
+    for backend in ["torch"] + [b for b in backends if b != "torch"]:
+        print(f"[report] Loading backend '{backend}'…")
+        tokenizer, model, _ = load_translation_model(MODEL_NAME, backend)
+        _translate(tokenizer, model, sentences[0], num_beams)  # warmup
+        latencies = []
+        outputs[backend] = []
+        for text in sentences:
+            for _ in range(repeats):
+                translation, elapsed = _translate(tokenizer, model, text, num_beams)
+                latencies.append(elapsed * 1000)
+            outputs[backend].append(translation)
+        latencies.sort()
+        report["backends"][backend] = {
+            "latency_ms_mean": round(statistics.mean(latencies), 1),
+            "latency_ms_p50": round(latencies[len(latencies) // 2], 1),
+            "latency_ms_p95": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 1),
+        }
+        del model
+
+    base = report["backends"]["torch"]["latency_ms_mean"]
+    for backend, stats in report["backends"].items():
+        same = sum(a == b for a, b in zip(outputs[backend], outputs["torch"]))
+        stats["exact_match_vs_torch"] = round(same / len(sentences), 3)
+        stats["speedup_vs_torch"] = round(base / stats["latency_ms_mean"], 2)
+        try:
+            from sacrebleu import corpus_bleu
+            stats["bleu_vs_torch"] = round(corpus_bleu(outputs[backend], [outputs["torch"]]).score, 2)
+        except ImportError:
+            stats["bleu_vs_torch"] = None
+    report["examples"] = [
+        {"ja": text, **{b: outputs[b][i] for b in outputs}} for i, text in enumerate(sentences[:3])
+    ]
+    return report
+
+
+# ===== Decoding profiles: latency vs. BLEU =====
+def profile_benchmark(profiles: List[str], samples: int = 200, backend: str | None = None) -> Dict[str, Any]:
+    """
+    Translate the first `samples` sentences of the Kyoto test split with every
+    decoding profile (one request at a time, as an agent would send them) and
+    report per-sentence CPU latency and corpus BLEU against the human references.
+    """
+    from sacrebleu import corpus_bleu
+
+    from kyoto_corpus import kyoto_splits, load_kyoto_pairs
+    from mbart_engine import DECODING_PROFILES, MbartRunner
+
+    test = kyoto_splits(load_kyoto_pairs())["test"][:samples]
+    sources = [ja for ja, _ in test]
+    references = [en for _, en in test]
+    tokenizer, model, model_id = load_translation_model(MODEL_NAME, backend)
+    runner = MbartRunner(tokenizer, model)
+    runner.generate_batch([WARMUP_TEXT], {"max_length": 32})
+    report: Dict[str, Any] = {"model_id": model_id, "samples": len(test), "threads": torch.get_num_threads(), "profiles": {}}
+    for profile in profiles:
+        print(f"[profiles] {profile} on {len(test)} Kyoto test sentences…")
+        outputs, latencies = [], []
+        for text in sources:
+            start = time.perf_counter()
+            outputs.append(runner.generate_batch([text], {"profile": profile, "max_length": 512})[0])
+            latencies.append((time.perf_counter() - start) * 1000)
+        latencies.sort()
+        report["profiles"][profile] = {
+            "settings": DECODING_PROFILES[profile],
+            "bleu": round(corpus_bleu(outputs, [references]).score, 2),
+            "latency_ms_mean": round(statistics.mean(latencies), 1),
+            "latency_ms_p50": round(latencies[len(latencies) // 2], 1),
+            "latency_ms_p95": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 1),
+            "examples": [{"ja": sources[i], "ref": references[i], "out": outputs[i]} for i in range(min(3, len(test)))],
+        }
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Snapshot, ONNX export, backend parity and decoding-profile reports for mBART-50")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("snapshot", help="Write a local safetensors snapshot for fast startup")
+    p_export = sub.add_parser("export", help="Export encoder/decoder(+past) to ONNX")
+    p_export.add_argument("--quantize", action="store_true", help="Also write an int8 dynamically quantized copy")
+    p_report = sub.add_parser("report", help="Compare backends against PyTorch")
+    p_report.add_argument("--backends", nargs="+", default=["onnx", "onnx-int8"], choices=BACKENDS)
+    p_report.add_argument("--sentences", help="Text file with one Japanese sentence per line")
+    p_report.add_argument("--num-beams", type=int, default=5)
+    p_report.add_argument("--out", default="backend_report.json")
+    p_profiles = sub.add_parser("profiles", help="Latency vs. BLEU of each decoding profile on the Kyoto test split")
+    p_profiles.add_argument("--profiles", nargs="+", default=None, help="Default: all profiles")
+    p_profiles.add_argument("--samples", type=int, default=200)
+    p_profiles.add_argument("--backend", choices=BACKENDS, default=None)
+    p_profiles.add_argument("--out", default="profile_report.json")
+    args = parser.parse_args()
+
+    if args.command == "snapshot":
+        write_snapshot()
+    elif args.command == "export":
+        export_onnx(quantize=args.quantize)
+    elif args.command == "profiles":
+        from mbart_engine import DECODING_PROFILES
+
+        result = profile_benchmark(args.profiles or list(DECODING_PROFILES), args.samples, args.backend)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(json.dumps({p: {k: v for k, v in r.items() if k != "examples"} for p, r in result["profiles"].items()}, indent=2))
+        print(f"[profiles] Written to {args.out}")
+    else:
+        sentences = SAMPLE_SENTENCES
+        if args.sentences:
+            sentences = [l.strip() for l in open(args.sentences, encoding="utf-8") if l.strip()]
+        result = backend_report(args.backends, sentences, num_beams=args.num_beams)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(json.dumps(result["backends"], indent=2))
+        print(f"[report] Written to {args.out}")
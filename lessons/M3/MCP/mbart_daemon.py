@@ -0,0 +1,312 @@
+import asyncio
+import itertools
+import json
+import os
+import socket
+import time
+from typing import Any, Dict
+
+from deadlines import remaining
+
+# ===== Shared mBART inference daemon =====
+# One process per host loads mBART-50 once and serves every MCP server over a
+# Unix socket, batching requests across all clients. Protocol: one JSON object
+# per line in both directions, matched by "id".
+#
+#   -> {"id": 1, "op": "translate", "text": "...", "params": {"max_length": 512},
+#       "src_lang": "ja_XX", "tgt_lang": "en_XX", "timeout_s": 59.2}
+#       (pair defaults to ja_XX -> en_XX; timeout_s = time left on the caller's deadline)
+#   <- {"id": 1, "translation": "..."}        (or {"id": 1, "error": "..."})
+#   -> {"id": 2, "op": "health"}   /   {"id": 3, "op": "metrics"}
+#
+# Servers use it when MBART_DAEMON_SOCKET is set:
+#   python mbart_daemon.py
+#   MBART_DAEMON_SOCKET=/tmp/mbart.sock python joint_server_v2.py
+
+SOCKET_PATH = os.getenv("MBART_DAEMON_SOCKET", "/tmp/mbart.sock")
+USE_DAEMON = "MBART_DAEMON_SOCKET" in os.environ
+CLIENT_TIMEOUT_S = 120.0
+
+
+class MbartDaemonClient:
+    """
+    Async client: one persistent connection, many in-flight requests multiplexed by id.
+    Reconnects on the next call if the daemon restarted.
+    """
+
+    def __init__(self, path: str = SOCKET_PATH):
+        self.path = path
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._ids = itertools.count(1)
+        self._connect_lock = asyncio.Lock()
+        self._read_task: asyncio.Task | None = None
+
+    async def _connect(self) -> None:
+        async with self._connect_lock:
+            if self._writer is not None and not self._writer.is_closing():
+                return
+            self._reader, self._writer = await asyncio.open_unix_connection(self.path, limit=2**24)
+            self._read_task = asyncio.create_task(self._read_loop())
+
+    async def _read_loop(self) -> None:
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    break
+                msg = json.loads(line)
+                fut = self._pending.pop(msg.get("id"), None)
+                if fut is not None and not fut.done():
+                    fut.set_result(msg)
+        finally:
+            self._writer = None
+            for fut in self._pending.values():
+                if not fut.done():
+                    fut.set_exception(ConnectionError("mBART daemon connection closed"))
+            self._pending.clear()
+
+    async def request(self, op: str, **payload) -> Dict[str, Any]:
+        await self._connect()
+        rid = next(self._ids)
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[rid] = fut
+        self._writer.write((json.dumps({"id": rid, "op": op, **payload}, ensure_ascii=False) + "\n").encode("utf-8"))
+        await self._writer.drain()
+        try:
+            msg = await fut
+        finally:
+            if not fut.done() or fut.cancelled():
+                # Caller timed out: tell the daemon so the queued/running work is dropped
+                self._pending.pop(rid, None)
+                if self._writer is not None:
+                    self._writer.write((json.dumps({"id": rid, "op": "cancel"}) + "\n").encode("utf-8"))
+        if "error" in msg:
+            raise RuntimeError(msg["error"])
+        return msg
+
+    async def translate(self, text: str, params: Dict[str, Any], src_lang: str = "ja_XX", tgt_lang: str = "en_XX") -> str:
+        msg = await self.request(
+            "translate", text=text, params=params, src_lang=src_lang, tgt_lang=tgt_lang, timeout_s=remaining()
+        )
+        return msg["translation"]
+
+    async def health(self) -> Dict[str, Any]:
+        return await self.request("health")
+
+    async def metrics(self) -> Dict[str, Any]:
+        return await self.request("metrics")
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        if self._read_task is not None:
+            self._read_task.cancel()
+
+
+async def wait_until_ready(client: MbartDaemonClient, on_state=None, poll_s: float = 1.0) -> Dict[str, Any]:
+    """
+    Poll the daemon until its model is ready; `on_state(state)` mirrors
+    loading/warming into the calling server's /health. Raises if loading failed.
+    """
+    while True:
+        try:
+            health = await client.health()
+            state = health["model_state"]
+        except (ConnectionError, FileNotFoundError):
+            health, state = None, "waiting-for-daemon"
+        if on_state is not None:
+            on_state(state)
+        if state == "ready":
+            return health
+        if state == "error":
+            raise RuntimeError(f"mBART daemon failed to load: {health.get('model_error')}")
+        await asyncio.sleep(poll_s)
+
+
+def request_sync(op: str, path: str = SOCKET_PATH, timeout: float = CLIENT_TIMEOUT_S, **payload) -> Dict[str, Any]:
+    """
+    Blocking one-shot request, for synchronous tools (e.g. FastMCP sync functions).
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall((json.dumps({"id": 1, "op": op, **payload}, ensure_ascii=False) + "\n").encode("utf-8"))
+        buf = b""
+        while not buf.endswith(b"\n"):
+            chunk = sock.recv(65536)
+            if not chunk:
+                raise ConnectionError("mBART daemon closed the connection")
+            buf += chunk
+    msg = json.loads(buf)
+    if "error" in msg:
+        raise RuntimeError(msg["error"])
+    return msg
+
+
+# ===== Daemon =====
+class MbartDaemon:
+    def __init__(self, path: str = SOCKET_PATH):
+        from mbart_backend import BACKEND, MODEL_NAME
+        from mbart_engine import TranslationBatcher, make_inference_executor
+
+        self.path = path
+        self.backend = BACKEND
+        self.model_name = MODEL_NAME
+        self.model_id = MODEL_NAME
+        self.state = "loading"
+        self.error: str | None = None
+        self.timings: Dict[str, Any] = {}
+        self.runner = None
+        self.workers = int(os.getenv("MBART_WORKERS", "1"))
+        self.executor = make_inference_executor(self.workers, int(os.getenv("MBART_THREADS_PER_WORKER", "0")) or None)
+        self.batcher = TranslationBatcher(
+            lambda texts, params, should_stop: self.runner.generate_batch(texts, params, should_stop),
+            lambda text: self.runner.count_tokens(text),
+            window_ms=float(os.getenv("MBART_BATCH_WINDOW_MS", "10")),
+            max_batch_size=int(os.getenv("MBART_BATCH_MAX_SIZE", "32")),
+            max_batch_tokens=int(os.getenv("MBART_BATCH_MAX_TOKENS", "8192")),
+            executor=self.executor,
+            max_concurrent_batches=self.workers,
+        )
+        self.started_at = time.time()
+        self.clients = 0
+        self.total_connections = 0
+        self.requests = 0
+        self.errors = 0
+
+    async def load(self) -> None:
+        from mbart_backend import format_timings, load_translation_model, WARMUP_TEXT
+        from mbart_engine import MbartRunner
+
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            tokenizer, model, self.model_id = await loop.run_in_executor(
+                None, load_translation_model, self.model_name, None, self.timings
+            )
+            self.runner = MbartRunner(tokenizer, model, "ja_XX", "en_XX")
+            self.state = "warming"
+            warm_start = time.perf_counter()
+            await asyncio.gather(*[
+                loop.run_in_executor(self.executor, self.runner.generate_batch, [WARMUP_TEXT], {"max_length": 32})
+                for _ in range(self.workers)
+            ])
+            self.timings["warmup_s"] = round(time.perf_counter() - warm_start, 3)
+            self.timings["total_s"] = round(time.perf_counter() - started, 3)
+            self.state = "ready"
+            print(f"[daemon] mBART ready (backend={self.backend}): {format_timings(self.timings)}")
+        except Exception as e:
+            self.state = "error"
+            self.error = f"{type(e).__name__}: {e}"
+            print(f"[daemon] ERROR loading mBART: {self.error}")
+
+    def health(self) -> Dict[str, Any]:
+        return {
+            "status": "healthy" if self.state == "ready" else (self.state if self.state != "error" else "degraded"),
+            "model_state": self.state,
+            "model_error": self.error,
+            "model_id": self.model_id,
+            "backend": self.backend,
+        }
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            **self.health(),
+            "uptime_s": round(time.time() - self.started_at, 1),
+            "connected_clients": self.clients,
+            "total_connections": self.total_connections,
+            "requests": self.requests,
+            "errors": self.errors,
+            "startup_timings": self.timings,
+            "batching": self.batcher.stats(),
+        }
+
+    async def _translate(self, msg: Dict[str, Any], writer: asyncio.StreamWriter, inflight: Dict[Any, asyncio.Task]) -> None:
+        from mbart_engine import resolve_language
+
+        rid = msg.get("id")
+        try:
+            if self.state != "ready":
+                raise RuntimeError(f"mBART not ready: {self.error or self.state}")
+            params = {
+                **(msg.get("params") or {"max_length": 512}),
+                "src_lang": resolve_language(msg.get("src_lang", "ja_XX")),
+                "tgt_lang": resolve_language(msg.get("tgt_lang", "en_XX")),
+            }
+            deadline = time.monotonic() + msg["timeout_s"] if msg.get("timeout_s") is not None else None
+            # Batches are grouped per language pair, across all connected servers
+            translation = await self.batcher.submit(msg["text"], params, deadline)
+            reply = {"id": rid, "translation": translation}
+        except asyncio.CancelledError:
+            return
+        except Exception as e:
+            self.errors += 1
+            reply = {"id": rid, "error": f"{type(e).__name__}: {e}"}
+        finally:
+            inflight.pop(rid, None)
+        if not writer.is_closing():
+            writer.write((json.dumps(reply, ensure_ascii=False) + "\n").encode("utf-8"))
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.clients += 1
+        self.total_connections += 1
+        inflight: Dict[Any, asyncio.Task] = {}
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    msg = json.loads(line)
+                except json.JSONDecodeError:
+                    writer.write(b'{"id": null, "error": "Parse error"}\n')
+                    continue
+                op = msg.get("op")
+                if op == "translate":
+                    self.requests += 1
+                    inflight[msg.get("id")] = asyncio.create_task(self._translate(msg, writer, inflight))
+                elif op == "cancel":
+                    task = inflight.pop(msg.get("id"), None)
+                    if task is not None:
+                        task.cancel()
+                elif op == "health":
+                    writer.write((json.dumps({"id": msg.get("id"), **self.health()}) + "\n").encode("utf-8"))
+                elif op == "metrics":
+                    writer.write((json.dumps({"id": msg.get("id"), **self.metrics()}) + "\n").encode("utf-8"))
+                else:
+                    writer.write((json.dumps({"id": msg.get("id"), "error": f"Unknown op: {op}"}) + "\n").encode("utf-8"))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            for task in inflight.values():
+                task.cancel()
+            self.clients -= 1
+            writer.close()
+
+    async def serve(self) -> None:
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # stale socket from a previous run
+        await self.batcher.start()
+        loader = asyncio.create_task(self.load())
+        server = await asyncio.start_unix_server(self.handle_client, path=self.path, limit=2**24)
+        print(f"[daemon] Listening on unix://{self.path}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            loader.cancel()
+            await self.batcher.stop()
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+
+if __name__ == "__main__":
+    print("Starting shared mBART inference daemon")
+    try:
+        asyncio.run(MbartDaemon().serve())
+    except KeyboardInterrupt:
+        print("\n[daemon] Stopped.")
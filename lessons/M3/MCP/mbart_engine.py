@@ -0,0 +1,528 @@
+import asyncio
+import copy
+import threading
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList
+from transformers.generation.streamers import BaseStreamer
+
+from deadlines import current_deadline, expired
+
+# ===== Inference worker pool =====
+# generate() is blocking; it runs here so the event loop keeps serving
+# /health, Overpass calls and other requests while a translation decodes.
+
+
+def make_inference_executor(workers: int = 1, threads_per_worker: int | None = None) -> ThreadPoolExecutor:
+    """
+    Thread pool for mBART inference. Each worker gets `threads_per_worker`
+    intra-op threads so concurrent batches don't oversubscribe the CPU
+    (default: cores split evenly between workers).
+    """
+    if threads_per_worker is None:
+        threads_per_worker = max(1, torch.get_num_threads() // max(1, workers))
+
+    def _init_worker():
+        torch.set_num_threads(threads_per_worker)
+
+    return ThreadPoolExecutor(
+        max_workers=workers,
+        thread_name_prefix="mbart-worker",
+        initializer=_init_worker,
+    )
+
+
+class StopWhen(StoppingCriteria):
+    """
+    Stop generate() between decode steps once `should_stop()` returns True,
+    e.g. when every caller waiting on the batch has timed out.
+    """
+
+    def __init__(self, should_stop: Callable[[], bool]):
+        self.should_stop = should_stop
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        return bool(self.should_stop())
+
+
+# ===== Language pairs =====
+# mBART-50 many-to-many: any of these codes can be source or target.
+MBART50_LANGUAGES = (
+    "ar_AR", "cs_CZ", "de_DE", "en_XX", "es_XX", "et_EE", "fi_FI", "fr_XX", "gu_IN", "hi_IN",
+    "it_IT", "ja_XX", "kk_KZ", "ko_KR", "lt_LT", "lv_LV", "my_MM", "ne_NP", "nl_XX", "ro_RO",
+    "ru_RU", "si_LK", "tr_TR", "vi_VN", "zh_CN", "af_ZA", "az_AZ", "bn_IN", "fa_IR", "he_IL",
+    "hr_HR", "id_ID", "ka_GE", "km_KH", "mk_MK", "ml_IN", "mn_MN", "mr_IN", "pl_PL", "ps_AF",
+    "pt_XX", "sv_SE", "sw_KE", "ta_IN", "te_IN", "th_TH", "tl_XX", "uk_UA", "ur_PK", "xh_ZA",
+    "gl_ES", "sl_SI",
+)
+_SHORT_CODES = {code.split("_")[0]: code for code in MBART50_LANGUAGES}
+
+
+def resolve_language(code: str) -> str:
+    """
+    Accept a full mBART code ("ja_XX") or its ISO 639-1 prefix ("ja").
+    """
+    code = str(code).strip()
+    if code in MBART50_LANGUAGES:
+        return code
+    if code.lower() in _SHORT_CODES:
+        return _SHORT_CODES[code.lower()]
+    raise ValueError(f"Unsupported language '{code}'. Use one of: {', '.join(sorted(_SHORT_CODES))}")
+
+
+# ===== Decoding profiles =====
+# Named generate() settings selectable per call. The output budget scales with
+# the source length (max_length = ratio * source tokens + margin, capped by
+# the caller's max_length), so a short sentence can never run on for 512 steps.
+
+DECODING_PROFILES: Dict[str, Dict[str, Any]] = {
+    "greedy-fast": {"num_beams": 1, "length_ratio": 1.5, "length_margin": 10},
+    "beam-2-balanced": {"num_beams": 2, "early_stopping": True, "length_ratio": 2.0, "length_margin": 16},
+    "beam-4-quality": {"num_beams": 4, "early_stopping": True, "length_ratio": 2.0, "length_margin": 16},
+}
+DEFAULT_PROFILE = "beam-4-quality"
+
+
+def resolve_profile(name: str | None) -> str:
+    name = name or DEFAULT_PROFILE
+    if name not in DECODING_PROFILES:
+        raise ValueError(f"Unknown decoding profile '{name}'. Use one of: {', '.join(DECODING_PROFILES)}")
+    return name
+
+
+def length_budget(profile: str, source_tokens: int, max_length: int | None = None) -> int:
+    cfg = DECODING_PROFILES[profile]
+    budget = int(cfg["length_ratio"] * source_tokens + cfg["length_margin"])
+    return min(budget, max_length) if max_length else budget
+
+
+def decoding_kwargs(
+    profile: str, source_tokens: int, forced_bos_token_id: int, max_length: int | None = None
+) -> Dict[str, Any]:
+    """
+    generate() kwargs for `profile` and a source of `source_tokens` tokens.
+    The target-language id is required: without forced_bos_token_id mBART-50
+    picks its own first token and may answer in the wrong language.
+    """
+    cfg = DECODING_PROFILES[profile]
+    kwargs = {k: v for k, v in cfg.items() if k not in ("length_ratio", "length_margin")}
+    kwargs["max_length"] = length_budget(profile, source_tokens, max_length)
+    kwargs["forced_bos_token_id"] = forced_bos_token_id
+    return kwargs
+
+
+class MbartRunner:
+    """
+    Tokenize -> generate -> decode for one loaded model, callable from any
+    inference worker and for any language pair.
+
+    Nothing here mutates shared tokenizer state: the source language tag is
+    added explicitly per call (instead of setting `tokenizer.src_lang`), and
+    each thread works on its own tokenizer copy, because the Rust tokenizer
+    rejects concurrent calls. Batches of different pairs run side by side
+    on one model without a lock.
+    """
+
+    def __init__(self, tokenizer, model, src_lang: str = "ja_XX", tgt_lang: str = "en_XX"):
+        self.tokenizer = tokenizer
+        self.model = model
+        # Defaults for callers that don't pass a pair in `params`
+        self.src_lang = src_lang
+        self.tgt_lang = tgt_lang
+        self.lang_ids = {code: tokenizer.convert_tokens_to_ids(code) for code in MBART50_LANGUAGES}
+        # Room for the language tag and </s> within the model's input limit
+        self.max_source_tokens = min(tokenizer.model_max_length, 1024) - 2
+        self._local = threading.local()
+
+    def _tok(self):
+        tok = getattr(self._local, "tokenizer", None)
+        if tok is None:
+            tok = self._local.tokenizer = copy.deepcopy(self.tokenizer)
+        return tok
+
+    def count_tokens(self, text: str) -> int:
+        ids = self._tok()(text, add_special_tokens=False, truncation=True, max_length=self.max_source_tokens).input_ids
+        return len(ids) + 2
+
+    def encode(self, texts: List[str], src_lang: str | None = None):
+        """
+        Same tensors as `tokenizer(texts)` after `tokenizer.src_lang = src_lang`:
+        [src_lang] tokens </s>, padded to the longest text.
+        """
+        tok = self._tok()
+        lang_id = self.lang_ids[src_lang or self.src_lang]
+        bodies = tok(texts, add_special_tokens=False, truncation=True, max_length=self.max_source_tokens).input_ids
+        return tok.pad(
+            {"input_ids": [[lang_id] + ids + [tok.eos_token_id] for ids in bodies]},
+            return_tensors="pt",
+        )
+
+    def decode(self, token_ids) -> str:
+        return self._tok().decode(token_ids, skip_special_tokens=True)
+
+    def generate_batch(self, texts: List[str], params: Dict[str, Any], should_stop: Callable[[], bool] = lambda: False) -> List[str]:
+        """
+        Translate a batch with a single padded generate call. `params` may carry
+        "src_lang" / "tgt_lang" and a decoding "profile" (its length budget follows
+        the longest text in the batch, with params["max_length"] as the cap);
+        everything else is passed to generate(). Stops early once `should_stop()` is True.
+        """
+        params = dict(params)
+        src_lang = params.pop("src_lang", self.src_lang)
+        tgt_lang = params.pop("tgt_lang", self.tgt_lang)
+        profile = params.pop("profile", None)
+        encoded = self.encode(texts, src_lang)
+        if profile is not None:
+            source_tokens = encoded["input_ids"].shape[1]
+            params = {
+                **decoding_kwargs(profile, source_tokens, self.lang_ids[tgt_lang], params.pop("max_length", None)),
+                **params,
+            }
+        # The target language is always forced here; params cannot override it
+        params["forced_bos_token_id"] = self.lang_ids[tgt_lang]
+        with torch.no_grad():
+            generated = self.model.generate(
+                **encoded,
+                stopping_criteria=StoppingCriteriaList([StopWhen(should_stop)]),
+                **params,
+            )
+        return self._tok().batch_decode(generated, skip_special_tokens=True)
+
+
+# ===== Dynamic micro-batching for mBART generate =====
+# Requests that arrive within a short window are grouped and translated with
+# ONE padded generate call instead of one generate per JSON-RPC call.
+
+
+class _PendingTranslation:
+    __slots__ = ("text", "params", "key", "tokens", "future", "enqueued_at", "deadline")
+
+    def __init__(self, text: str, params: Dict[str, Any], tokens: int, future: asyncio.Future, deadline: float | None = None):
+        self.text = text
+        self.params = params
+        # Only requests with identical generation params (language pair included)
+        # can share a generate call
+        self.key = tuple(sorted(params.items()))
+        self.tokens = tokens
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+        self.deadline = deadline  # time.monotonic(); None = no deadline
+
+    def abandoned(self) -> bool:
+        """
+        Nobody needs the result anymore: the caller was cancelled or its deadline passed.
+        """
+        return self.future.done() or expired(self.deadline)
+
+
+class TranslationBatcher:
+    """
+    Collect translation requests for up to `window_ms` and run them as a single batch.
+
+    A batch is flushed as soon as it holds `max_batch_size` requests or
+    `max_batch_tokens` source tokens, or when the window expires.
+    Requests are grouped by their params, so each batch holds a single
+    language pair when params carry "src_lang" / "tgt_lang".
+    `run_batch(texts, params, should_stop)` runs on `executor` and must return
+    one translation per input text; it should poll `should_stop()` (see
+    StopWhen) so a batch whose callers all timed out frees its worker early.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[List[str], Dict[str, Any], Callable[[], bool]], List[str]],
+        count_tokens: Callable[[str], int],
+        window_ms: float = 10.0,
+        max_batch_size: int = 16,
+        max_batch_tokens: int = 4096,
+        executor: Executor | None = None,
+        max_concurrent_batches: int = 1,
+    ):
+        self._run_batch = run_batch
+        self._count_tokens = count_tokens
+        self.window_s = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.executor = executor
+        self.max_concurrent_batches = max_concurrent_batches
+        self._slots: asyncio.Semaphore | None = None
+        self._running: set[asyncio.Task] = set()
+        self._queue: asyncio.Queue | None = None
+        self._carry: List[_PendingTranslation] = []
+        self._worker: asyncio.Task | None = None
+        # metrics
+        self._requests = 0
+        self._batches = 0
+        self._batched_items = 0
+        self._max_batch_seen = 0
+        self._wait_total_s = 0.0
+        self._wait_max_s = 0.0
+        self._generate_total_s = 0.0
+        self._stopped_early = 0
+        self._expired = 0
+
+    async def start(self) -> None:
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.max_concurrent_batches)
+            self._worker = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        for task in list(self._running):
+            task.cancel()
+        for item in self._carry:
+            if not item.future.done():
+                item.future.set_exception(RuntimeError("translation batcher stopped"))
+        self._carry = []
+
+    async def submit(self, text: str, params: Dict[str, Any], deadline: float | None = None) -> str:
+        """
+        `deadline` (time.monotonic()) defaults to the current request's deadline;
+        once it passes the request is dropped from the queue, or stops decoding.
+        """
+        if self._queue is None or self._worker is None:
+            raise RuntimeError("translation batcher not started")
+        future = asyncio.get_running_loop().create_future()
+        if deadline is None:
+            deadline = current_deadline()
+        item = _PendingTranslation(text, params, self._count_tokens(text), future, deadline)
+        self._requests += 1
+        await self._queue.put(item)
+        return await future
+
+    async def _next_item(self, timeout: float | None) -> _PendingTranslation | None:
+        if self._carry:
+            return self._carry.pop(0)
+        if timeout is None:
+            return await self._queue.get()
+        if timeout <= 0:
+            try:
+                return self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return None
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def _collect(self) -> Tuple[List[_PendingTranslation], List[_PendingTranslation]]:
+        first = await self._next_item(None)
+        batch = [first]
+        tokens = first.tokens
+        deferred: List[_PendingTranslation] = []
+        deadline = time.perf_counter() + self.window_s
+        while len(batch) < self.max_batch_size and tokens < self.max_batch_tokens:
+            item = await self._next_item(deadline - time.perf_counter())
+            if item is None:
+                break
+            if item.abandoned():
+                self._expire(item)
+                continue  # caller already gave up
+            if item.key != first.key or tokens + item.tokens > self.max_batch_tokens:
+                deferred.append(item)
+                continue
+            batch.append(item)
+            tokens += item.tokens
+        return batch, deferred
+
+    async def _loop(self) -> None:
+        while True:
+            # Wait for a free worker first: requests arriving meanwhile keep
+            # queueing and are picked up together as one larger batch.
+            await self._slots.acquire()
+            batch, deferred = await self._collect()
+            self._carry = deferred + self._carry
+            for item in batch:
+                self._expire(item)
+            batch = [item for item in batch if not item.abandoned()]
+            if not batch:
+                self._slots.release()
+                continue
+            task = asyncio.create_task(self._dispatch(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    def _expire(self, item: _PendingTranslation) -> None:
+        if not item.future.done() and expired(item.deadline):
+            self._expired += 1
+            item.future.set_exception(asyncio.TimeoutError("translation deadline exceeded"))
+
+    async def _dispatch(self, batch: List[_PendingTranslation]) -> None:
+        now = time.perf_counter()
+        for item in batch:
+            wait = now - item.enqueued_at
+            self._wait_total_s += wait
+            self._wait_max_s = max(self._wait_max_s, wait)
+        self._batches += 1
+        self._batched_items += len(batch)
+        self._max_batch_seen = max(self._max_batch_seen, len(batch))
+
+        def should_stop() -> bool:
+            # Polled between decode steps: stop once no caller is still waiting in time
+            return all(item.abandoned() for item in batch)
+
+        loop = asyncio.get_running_loop()
+        try:
+            outputs = await loop.run_in_executor(
+                self.executor,
+                self._run_batch,
+                [item.text for item in batch],
+                batch[0].params,
+                should_stop,
+            )
+        except Exception as e:
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_exception(e)
+            return
+        finally:
+            self._generate_total_s += time.perf_counter() - now
+            self._slots.release()
+        if should_stop():
+            self._stopped_early += 1
+        for item, out in zip(batch, outputs):
+            self._expire(item)  # may be cut short: never hand out a partial translation
+            if not item.future.done():
+                item.future.set_result(out)
+
+    def stats(self) -> Dict[str, Any]:
+        batches = self._batches or 1
+        items = self._batched_items or 1
+        return {
+            "requests": self._requests,
+            "batches": self._batches,
+            "avg_batch_size": round(self._batched_items / batches, 2),
+            "max_batch_size_seen": self._max_batch_seen,
+            "avg_queue_wait_ms": round(1000 * self._wait_total_s / items, 2),
+            "max_queue_wait_ms": round(1000 * self._wait_max_s, 2),
+            "avg_generate_ms": round(1000 * self._generate_total_s / batches, 2),
+            "queue_depth": (self._queue.qsize() if self._queue else 0) + len(self._carry),
+            "running_batches": len(self._running),
+            "abandoned_batches": self._stopped_early,
+            "expired_requests": self._expired,
+            "config": {
+                "window_ms": self.window_s * 1000.0,
+                "max_batch_size": self.max_batch_size,
+                "max_batch_tokens": self.max_batch_tokens,
+                "max_concurrent_batches": self.max_concurrent_batches,
+            },
+        }
+
+
+# ===== Document mode: Japanese sentence segmentation =====
+# Long inputs are split into sentences and translated as one padded batch,
+# instead of being truncated at the tokenizer limit and decoded as one long beam.
+
+_FULL_STOPS = "。！？"
+_ASCII_STOPS = "!?"
+_OPENING = "「『（("
+_CLOSING = "」』）)"
+# After a quote that ends in 。！？, these carry the sentence on: 「本当？」と彼は言った
+_QUOTE_CONTINUATIONS = ("と", "って", "など", "なんて", "の")
+
+
+def _ends_sentence(line: str, i: int) -> bool:
+    """
+    Whether the terminator at line[i] ends a sentence. 。！？ always do; ASCII
+    !? only before whitespace or the end of the line, so "Yahoo!ニュース" stays whole.
+    """
+    if line[i] in _FULL_STOPS:
+        return True
+    j = i
+    while j < len(line) and (line[j] in _FULL_STOPS or line[j] in _ASCII_STOPS or line[j] in _CLOSING):
+        j += 1
+    return j == len(line) or line[j].isspace()
+
+
+def _split_line(line: str) -> List[str]:
+    sentences = []
+    start = depth = i = 0
+    while i < len(line):
+        ch = line[i]
+        i += 1
+        if ch in _OPENING:
+            depth += 1
+        elif ch in _CLOSING:
+            depth = max(0, depth - 1)
+            if depth == 0:
+                # A closed quote ending in a terminator ends the sentence, unless it continues
+                k = i - 2
+                while k >= start and line[k] in _CLOSING:
+                    k -= 1
+                quoted_end = k >= start and (line[k] in _FULL_STOPS or line[k] in _ASCII_STOPS)
+                if quoted_end and not line.startswith(_QUOTE_CONTINUATIONS, i):
+                    sentences.append(line[start:i])
+                    start = i
+        elif depth == 0 and (ch in _FULL_STOPS or ch in _ASCII_STOPS) and _ends_sentence(line, i - 1):
+            # Keep the whole run of terminators and closing brackets: 「…」！？）
+            while i < len(line) and (line[i] in _FULL_STOPS or line[i] in _ASCII_STOPS or line[i] in _CLOSING):
+                i += 1
+            sentences.append(line[start:i])
+            start = i
+    sentences.append(line[start:])
+    return [s.strip() for s in sentences if s.strip()]
+
+
+def split_japanese_sentences(text: str) -> List[List[str]]:
+    """
+    Split text into paragraphs (on newlines) and each paragraph into sentences
+    (on 。！？, and on ASCII !? followed by whitespace), keeping the terminator
+    and closing brackets. Terminators inside 「」『』（） do not split, and a
+    quote followed by と/って/... stays part of its sentence.
+    """
+    paragraphs = []
+    for line in text.splitlines():
+        sentences = _split_line(line)
+        if sentences:
+            paragraphs.append(sentences)
+    return paragraphs
+
+
+def join_translated_paragraphs(paragraphs: List[List[str]]) -> str:
+    return "\n".join(" ".join(s for s in sentences if s) for sentences in paragraphs)
+
+
+# ===== Token streaming =====
+
+
+class AsyncTextStreamer(BaseStreamer):
+    """
+    Receives token ids from generate() on an inference worker and hands the newly
+    decoded text to the event loop through `queue` (None marks the end).
+    Streaming only works with greedy decoding (num_beams=1) and batch size 1.
+    """
+
+    def __init__(self, decode: Callable[[List[int]], str], loop: asyncio.AbstractEventLoop):
+        self.decode = decode
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._token_ids: List[int] = []
+        self._emitted = ""
+        self._prompt_skipped = False
+
+    def put(self, value) -> None:
+        if not self._prompt_skipped:
+            # First call carries the decoder start ids, not generated text
+            self._prompt_skipped = True
+            return
+        self._token_ids.extend(value.reshape(-1).tolist())
+        text = self.decode(self._token_ids)
+        # Hold back incomplete multi-byte pieces until the next token completes them
+        if len(text) > len(self._emitted) and not text.endswith("\ufffd"):
+            delta = text[len(self._emitted):]
+            self._emitted = text
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, delta)
+
+    def end(self) -> None:
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, None)
+
@@ -1,5 +1,6 @@
 import os
 import json
+import asyncio
 from datetime import datetime, timezone as dt_timezone
 from typing import Any, Dict, List
 
@@ -24,6 +25,8 @@ except Exception:  # pragma: no cover
 SERVICE_NAME = "time-and-tripadvisor"
 DEFAULT_LANGUAGE = "en"
 TRIPADVISOR_API_KEY = os.getenv("TRIPADVISOR_API_KEY")
+# Max /details requests in flight at once (across all tool calls) while enriching search results
+DETAIL_CONCURRENCY = int(os.getenv("TRIPADVISOR_DETAIL_CONCURRENCY", "5"))
 
 # Create MCP server
 mcp_server = Server(SERVICE_NAME)
@@ -137,6 +140,36 @@ async def tripadvisor_get(client: httpx.AsyncClient, url: str, params: Dict[str,
     resp.raise_for_status()
     return resp.json()
 
+# One pooled client for the whole process (keep-alive across tool calls); closed in the lifespan
+_client: httpx.AsyncClient | None = None
+_detail_slots = asyncio.Semaphore(DETAIL_CONCURRENCY)
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=DETAIL_CONCURRENCY + 5, max_keepalive_connections=DETAIL_CONCURRENCY),
+        )
+    return _client
+
+async def fetch_location_details(client: httpx.AsyncClient, location_id: Any) -> Dict[str, Any] | None:
+    """
+    /details for one search result, or None if it fails (the result is then
+    listed without enrichment).
+    """
+    if not location_id or location_id == "N/A":
+        return None
+    detail_url = f"https://api.content.tripadvisor.com/api/v1/location/{location_id}/details"
+    detail_params = {"language": DEFAULT_LANGUAGE, "key": TRIPADVISOR_API_KEY}
+    async with _detail_slots:
+        try:
+            return await tripadvisor_get(client, detail_url, detail_params)
+        except httpx.HTTPStatusError:
+            # Skip detail enrichment failures silently per item
+            return None
+        except Exception:
+            return None
+
 # ------------- Tool Implementation -------------
 async def tool_get_current_time(arguments: Dict[str, Any]) -> str:
     tzname = (arguments.get("timezone") or "UTC").strip()
@@ -178,59 +211,53 @@ async def tool_search_tripadvisor_restaurants(arguments: Dict[str, Any]) -> str:
 
     lines: List[str] = [f"Found restaurants near {lat}, {lon}:\n"]
 
-    async with httpx.AsyncClient() as client:
-        try:
-            data = await tripadvisor_get(client, url, params)
-        except httpx.HTTPStatusError as e:
-            return f"HTTP error {e.response.status_code}. Ensure your TripAdvisor API key is valid."
-        except Exception as e:
-            return f"Error searching restaurants: {e}"
-
-        results = data.get("data") or []
-        if not results:
-            return f"No restaurants found near {lat}, {lon}"
-
-        for idx, r in enumerate(results, 1):
-            location_id = r.get("location_id", "N/A")
-            name = r.get("name", "N/A")
-            address = (r.get("address_obj") or {}).get("address_string", "N/A")
-            rating = r.get("rating", "N/A")
-            cuisine = format_cuisine(r.get("cuisine"))
-            price = r.get("price_level", "N/A")
-            url_link = r.get("web_url", "N/A")
-
-            lines.append(f"{idx}. {name}")
-            lines.append(f"   Location ID: {location_id}")
-            lines.append(f"   Address: {address}")
-            lines.append(f"   Rating: {rating}")
-            lines.append(f"   Cuisine: {cuisine}")
-            lines.append(f"   Price: {price}")
-            lines.append(f"   URL: {url_link}")
-
-            # Fetch details for each location to enrich
-            if location_id and location_id != "N/A":
-                detail_url = f"https://api.content.tripadvisor.com/api/v1/location/{location_id}/details"
-                detail_params = {"language": DEFAULT_LANGUAGE, "key": TRIPADVISOR_API_KEY}
-                try:
-                    detail_data = await tripadvisor_get(client, detail_url, detail_params)
-                    phone = detail_data.get("phone", "N/A")
-                    website = detail_data.get("website", "N/A")
-                    email = detail_data.get("email", "N/A")
-                    hours = detail_data.get("hours", {})
-
-                    lines.append(f"   Phone: {phone}")
-                    lines.append(f"   Website: {website}")
-                    if email and email != "N/A":
-                        lines.append(f"   Email: {email}")
-                    if hours:
-                        lines.append(f"   Hours: {format_hours(hours)}")
-                except httpx.HTTPStatusError:
-                    # Skip detail enrichment failures silently per item
-                    pass
-                except Exception:
-                    pass
-
-            lines.append("")  # blank line between items
+    client = get_client()
+    try:
+        data = await tripadvisor_get(client, url, params)
+    except httpx.HTTPStatusError as e:
+        return f"HTTP error {e.response.status_code}. Ensure your TripAdvisor API key is valid."
+    except Exception as e:
+        return f"Error searching restaurants: {e}"
+
+    results = data.get("data") or []
+    if not results:
+        return f"No restaurants found near {lat}, {lon}"
+
+    # Fetch details for all locations concurrently (bounded by _detail_slots);
+    # gather keeps them in rank order
+    details = await asyncio.gather(*[fetch_location_details(client, r.get("location_id")) for r in results])
+
+    for idx, (r, detail_data) in enumerate(zip(results, details), 1):
+        location_id = r.get("location_id", "N/A")
+        name = r.get("name", "N/A")
+        address = (r.get("address_obj") or {}).get("address_string", "N/A")
+        rating = r.get("rating", "N/A")
+        cuisine = format_cuisine(r.get("cuisine"))
+        price = r.get("price_level", "N/A")
+        url_link = r.get("web_url", "N/A")
+
+        lines.append(f"{idx}. {name}")
+        lines.append(f"   Location ID: {location_id}")
+        lines.append(f"   Address: {address}")
+        lines.append(f"   Rating: {rating}")
+        lines.append(f"   Cuisine: {cuisine}")
+        lines.append(f"   Price: {price}")
+        lines.append(f"   URL: {url_link}")
+
+        if detail_data is not None:
+            phone = detail_data.get("phone", "N/A")
+            website = detail_data.get("website", "N/A")
+            email = detail_data.get("email", "N/A")
+            hours = detail_data.get("hours", {})
+
+            lines.append(f"   Phone: {phone}")
+            lines.append(f"   Website: {website}")
+            if email and email != "N/A":
+                lines.append(f"   Email: {email}")
+            if hours:
+                lines.append(f"   Hours: {format_hours(hours)}")
+
+        lines.append("")  # blank line between items
 
     return "\n".join(lines).strip()
 
@@ -242,14 +269,13 @@ async def tool_get_restaurant_details(arguments: Dict[str, Any]) -> str:
     url = f"https://api.content.tripadvisor.com/api/v1/location/{location_id}/details"
     params = {"language": DEFAULT_LANGUAGE, "key": TRIPADVISOR_API_KEY}
 
-    async with httpx.AsyncClient() as client:
-        try:
-            data = await tripadvisor_get(client, url, params)
-        except httpx.HTTPStatusError as e:
-            body = e.response.text
-            return f"HTTP error {e.response.status_code}: {body[:300]}{'…' if len(body) > 300 else ''}"
-        except Exception as e:
-            return f"Error getting restaurant details: {e}"
+    try:
+        data = await tripadvisor_get(get_client(), url, params)
+    except httpx.HTTPStatusError as e:
+        body = e.response.text
+        return f"HTTP error {e.response.status_code}: {body[:300]}{'…' if len(body) > 300 else ''}"
+    except Exception as e:
+        return f"Error getting restaurant details: {e}"
 
     lines: List[str] = []
     lines.append(f"Details for {data.get('name', 'Unknown')}:")
@@ -283,14 +309,13 @@ async def tool_get_restaurant_reviews(arguments: Dict[str, Any]) -> str:
     url = f"https://api.content.tripadvisor.com/api/v1/location/{location_id}/reviews"
     params = {"language": DEFAULT_LANGUAGE, "limit": limit, "key": TRIPADVISOR_API_KEY}
 
-    async with httpx.AsyncClient() as client:
-        try:
-            data = await tripadvisor_get(client, url, params)
-        except httpx.HTTPStatusError as e:
-            body = e.response.text
-            return f"HTTP error {e.response.status_code}: {body[:300]}{'…' if len(body) > 300 else ''}"
-        except Exception as e:
-            return f"Error getting reviews: {e}"
+    try:
+        data = await tripadvisor_get(get_client(), url, params)
+    except httpx.HTTPStatusError as e:
+        body = e.response.text
+        return f"HTTP error {e.response.status_code}: {body[:300]}{'…' if len(body) > 300 else ''}"
+    except Exception as e:
+        return f"Error getting reviews: {e}"
 
     reviews = data.get("data") or []
     if not reviews:
@@ -374,6 +399,13 @@ async def openapi(_request: Request):
         },
     })
 
+# ------------- Lifespan -------------
+async def lifespan(app):
+    yield
+    # Close the shared TripAdvisor client cleanly on shutdown
+    if _client is not None:
+        await _client.aclose()
+
 # ------------- Starlette app -------------
 app = Starlette(
     routes=[
@@ -382,7 +414,8 @@ app = Starlette(
         Route("/message", endpoint=handle_messages, methods=["POST"]),
         Route("/health", endpoint=health),
         Route("/openapi.json", endpoint=openapi),
-    ]
+    ],
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -0,0 +1,118 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Tuple
+
+from osm_overpass import OverpassClient
+from osm_tiles import element_coords
+
+# ===== OSM entity cache =====
+# Elements seen in search results, keyed by (osm_type, osm_id), so the usual
+# follow-up get_osm_place_details is answered without another Overpass query:
+# searches already fetch full tags and centers (`out tags center`), exactly
+# what a detail lookup returns. Misses go to the offline index when present,
+# then to Overpass (one union query for a whole batch).
+
+ENTITY_TTL_S = float(os.getenv("OSM_ENTITY_TTL_S", str(6 * 3600)))
+MAX_ENTITIES = int(os.getenv("OSM_ENTITY_CACHE_SIZE", "20000"))
+MAX_BATCH_IDS = 50
+OSM_TYPES = ("node", "way", "relation")
+
+OsmRef = Tuple[str, int]
+
+
+def details_query(refs: Iterable[OsmRef]) -> str:
+    """
+    One Overpass union query for many elements: node(id:1,2);way(id:3);...
+    """
+    by_type: Dict[str, List[int]] = {}
+    for osm_type, osm_id in refs:
+        by_type.setdefault(osm_type, []).append(osm_id)
+    parts = "".join(f"{t}(id:{','.join(map(str, ids))});" for t, ids in by_type.items())
+    return f"[out:json][timeout:25];({parts});out tags center;"
+
+
+class OsmEntityCache:
+    def __init__(self, overpass: OverpassClient, index=None, ttl_s: float = ENTITY_TTL_S, max_entries: int = MAX_ENTITIES):
+        self.overpass = overpass
+        self.index = index  # optional osm_index.RestaurantIndex
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self._entities: "OrderedDict[OsmRef, Tuple[float, dict]]" = OrderedDict()
+        self.hits = 0
+        self.index_hits = 0
+        self.misses = 0
+        self.fetch_queries = 0
+
+    def remember(self, elements: Iterable[dict]) -> None:
+        """
+        Record search results (Overpass elements, raw or flattened).
+        """
+        now = time.time()
+        for el in elements:
+            if el.get("id") is None:
+                continue
+            lat, lon = element_coords(el)
+            ref = (el.get("type", "node"), int(el["id"]))
+            self._entities[ref] = (now, {"type": ref[0], "id": ref[1], "lat": lat, "lon": lon, "tags": el.get("tags") or {}})
+            self._entities.move_to_end(ref)
+        while len(self._entities) > self.max_entries:
+            self._entities.popitem(last=False)
+
+    def _get(self, ref: OsmRef) -> dict | None:
+        entry = self._entities.get(ref)
+        if entry is None:
+            return None
+        seen_at, el = entry
+        if time.time() - seen_at > self.ttl_s:
+            del self._entities[ref]
+            return None
+        self._entities.move_to_end(ref)
+        return el
+
+    async def get_many(self, refs: List[OsmRef]) -> Dict[OsmRef, dict | None]:
+        """
+        Elements for `refs` (None for ones that do not exist). Everything not
+        cached is fetched with a single Overpass query; raises like
+        OverpassClient.query when that fails.
+        """
+        found: Dict[OsmRef, dict | None] = {}
+        missing = []
+        for ref in dict.fromkeys(refs):
+            el = self._get(ref)
+            if el is None and self.index is not None:
+                el = self.index.get(*ref)
+                if el is not None:
+                    self.index_hits += 1
+                    self.remember([el])
+            elif el is not None:
+                self.hits += 1
+            if el is None:
+                missing.append(ref)
+            found[ref] = el
+        if missing:
+            self.misses += len(missing)
+            self.fetch_queries += 1
+            # Each ref matches at most one element: stop reading once all have arrived
+            data = await self.overpass.query(details_query(missing), max_elements=len(missing))
+            elements = data.get("elements", [])
+            self.remember(elements)
+            for ref in missing:
+                found[ref] = self._get(ref)
+        return found
+
+    async def get(self, osm_type: str, osm_id: int) -> dict | None:
+        return (await self.get_many([(osm_type, osm_id)]))[(osm_type, osm_id)]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.index_hits + self.misses
+        return {
+            "entities": len(self._entities),
+            "hits": self.hits,
+            "index_hits": self.index_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.index_hits) / lookups, 4) if lookups else 0.0,
+            "fetch_queries": self.fetch_queries,
+            "ttl_s": self.ttl_s,
+            "max_entries": self.max_entries,
+        }
@@ -0,0 +1,307 @@
+import argparse
+import json
+import math
+import os
+import sqlite3
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+from osm_tiles import EARTH_RADIUS_M, RestaurantTileCache, element_coords, rank_by_distance
+
+# ===== Offline OSM restaurant index =====
+# amenity=restaurant elements from a regional extract, stored in SQLite with an
+# R*Tree over their coordinates. Radius and nearest-k searches are answered
+# locally; searches outside the imported area go to live Overpass (through the
+# tile cache) unless OSM_INDEX_FALLBACK=none.
+#
+# Build once, offline:
+#   python osm_index.py import kanto.osm.pbf          # needs `pip install osmium`
+#   python osm_index.py import tokyo_restaurants.json # Overpass JSON dump ([out:json] ... out tags center;)
+#   python osm_index.py nearest 35.6595 139.7005 -k 5
+# Servers open OSM_INDEX_PATH at startup when the file exists.
+
+DEFAULT_INDEX_PATH = os.getenv(
+    "OSM_INDEX_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "osm_restaurants.sqlite"),
+)
+OSM_INDEX_FALLBACK = os.getenv("OSM_INDEX_FALLBACK", "live")  # "live" or "none"
+NEAREST_MAX_RADIUS_M = 50_000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS restaurants (
+    id INTEGER PRIMARY KEY,
+    osm_type TEXT NOT NULL,
+    osm_id INTEGER NOT NULL,
+    lat REAL NOT NULL,
+    lon REAL NOT NULL,
+    tags TEXT NOT NULL,
+    UNIQUE (osm_type, osm_id)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS restaurants_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+
+def _degree_box(lat: float, lon: float, radius_m: float) -> Tuple[float, float, float, float]:
+    rlat = math.degrees(radius_m / EARTH_RADIUS_M)
+    rlon = rlat / max(math.cos(math.radians(lat)), 1e-6)
+    return lat - rlat, lon - rlon, lat + rlat, lon + rlon
+
+
+class RestaurantIndex:
+    def __init__(self, path: str = DEFAULT_INDEX_PATH):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(_SCHEMA)
+        self._coverage = self._read_coverage()
+        self.searches = 0
+        self.search_time_s = 0.0
+
+    # ---------- import ----------
+    def import_elements(self, elements: Iterable[dict], bounds: Tuple[float, float, float, float] | None = None) -> int:
+        """
+        Insert restaurant elements (Overpass-style dicts). Coverage grows to
+        `bounds` (south, west, north, east) or, without it, to the elements'
+        own extent.
+        """
+        count = 0
+        south, west, north, east = self._coverage or (90.0, 180.0, -90.0, -180.0)
+        with self.conn:
+            for el in elements:
+                if (el.get("tags") or {}).get("amenity") != "restaurant":
+                    continue
+                lat, lon = element_coords(el)
+                if lat is None or lon is None:
+                    continue
+                cur = self.conn.execute(
+                    "INSERT INTO restaurants (osm_type, osm_id, lat, lon, tags) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (osm_type, osm_id) DO UPDATE SET lat = excluded.lat, lon = excluded.lon, tags = excluded.tags "
+                    "RETURNING id",
+                    (el.get("type", "node"), int(el["id"]), lat, lon, json.dumps(el.get("tags") or {}, ensure_ascii=False)),
+                )
+                rowid = cur.fetchone()[0]
+                self.conn.execute("INSERT OR REPLACE INTO restaurants_rtree VALUES (?, ?, ?, ?, ?)", (rowid, lat, lat, lon, lon))
+                if bounds is None:
+                    south, west, north, east = min(south, lat), min(west, lon), max(north, lat), max(east, lon)
+                count += 1
+            if bounds is not None:
+                s, w, n, e = bounds
+                south, west, north, east = min(south, s), min(west, w), max(north, n), max(east, e)
+            if south <= north:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('coverage', ?)", (json.dumps([south, west, north, east]),)
+                )
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('imported_at', ?)", (str(int(time.time())),))
+        self._coverage = self._read_coverage()
+        return count
+
+    # ---------- queries ----------
+    def _read_coverage(self) -> Tuple[float, float, float, float] | None:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'coverage'").fetchone()
+        return tuple(json.loads(row[0])) if row else None
+
+    def coverage(self) -> Tuple[float, float, float, float] | None:
+        """
+        (south, west, north, east) of the imported area, or None when empty.
+        """
+        return self._coverage
+
+    def covers(self, lat: float, lon: float, radius_m: float) -> bool:
+        """
+        True when the whole search circle lies inside the imported area, so a
+        local answer is complete.
+        """
+        cov = self.coverage()
+        if cov is None:
+            return False
+        south, west, north, east = _degree_box(lat, lon, radius_m)
+        return cov[0] <= south and cov[1] <= west and north <= cov[2] and east <= cov[3]
+
+    def _candidates(self, lat: float, lon: float, radius_m: float) -> Iterator[dict]:
+        south, west, north, east = _degree_box(lat, lon, radius_m)
+        rows = self.conn.execute(
+            "SELECT r.osm_type, r.osm_id, r.lat, r.lon, r.tags FROM restaurants_rtree t "
+            "JOIN restaurants r ON r.id = t.id "
+            "WHERE t.max_lat >= ? AND t.min_lat <= ? AND t.max_lon >= ? AND t.min_lon <= ?",
+            (south, north, west, east),
+        )
+        for osm_type, osm_id, el_lat, el_lon, tags in rows:
+            yield {"type": osm_type, "id": osm_id, "lat": el_lat, "lon": el_lon, "tags": json.loads(tags)}
+
+    def search(self, lat: float, lon: float, radius_m: float, limit: int) -> List[dict]:
+        """
+        The `limit` nearest restaurants within `radius_m`, nearest first, with
+        "distance_m".
+        """
+        start = time.perf_counter()
+        try:
+            # R*Tree box query, then exact (vectorized) haversine filter and ranking
+            return rank_by_distance(lat, lon, self._candidates(lat, lon, radius_m), limit, radius_m)
+        finally:
+            self.searches += 1
+            self.search_time_s += time.perf_counter() - start
+
+    def nearest(self, lat: float, lon: float, k: int, max_radius_m: float = NEAREST_MAX_RADIUS_M) -> List[dict]:
+        """
+        The k nearest restaurants (up to `max_radius_m` away), nearest first.
+        Searches a circle that doubles until it holds k restaurants: every
+        restaurant closer than the k-th is then inside it.
+        """
+        radius = 250.0
+        while True:
+            radius = min(radius, max_radius_m)
+            found = self.search(lat, lon, radius, k)
+            if len(found) >= k or radius >= max_radius_m:
+                return found
+            radius *= 2
+
+    def get(self, osm_type: str, osm_id: int) -> dict | None:
+        row = self.conn.execute(
+            "SELECT lat, lon, tags FROM restaurants WHERE osm_type = ? AND osm_id = ?", (osm_type, int(osm_id))
+        ).fetchone()
+        if row is None:
+            return None
+        return {"type": osm_type, "id": int(osm_id), "lat": row[0], "lon": row[1], "tags": json.loads(row[2])}
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        imported = self.conn.execute("SELECT value FROM meta WHERE key = 'imported_at'").fetchone()
+        return {
+            "path": self.path,
+            "restaurants": self.conn.execute("SELECT COUNT(*) FROM restaurants").fetchone()[0],
+            "coverage": self.coverage(),
+            "imported_at": int(imported[0]) if imported else None,
+            "searches": self.searches,
+            "avg_search_ms": round(1000 * self.search_time_s / self.searches, 3) if self.searches else 0.0,
+            "fallback": OSM_INDEX_FALLBACK,
+        }
+
+
+def load_restaurant_index(path: str = DEFAULT_INDEX_PATH) -> RestaurantIndex | None:
+    """
+    The index is optional: returns None (all searches go to Overpass) if it
+    was never built or cannot be opened.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        index = RestaurantIndex(path)
+        print(f"[osm-index] {index.stats()['restaurants']} restaurants in {path}")
+        return index
+    except Exception as e:
+        print(f"[osm-index] Could not open {path} ({type(e).__name__}: {e}); searching live Overpass.")
+        return None
+
+
+async def search_restaurants(
+    index: RestaurantIndex | None,
+    live: RestaurantTileCache,
+    lat: float,
+    lon: float,
+    radius_m: int,
+    limit: int,
+) -> List[dict]:
+    """
+    Offline index when it covers the search circle, otherwise live Overpass
+    (through the tile cache). Raises LookupError when the circle is outside
+    the index and OSM_INDEX_FALLBACK=none.
+    """
+    if index is not None and index.covers(lat, lon, radius_m):
+        return index.search(lat, lon, radius_m, limit)
+    if index is not None and OSM_INDEX_FALLBACK == "none":
+        raise LookupError(
+            f"{lat}, {lon} (radius {radius_m} m) is outside the offline OSM index and live Overpass is disabled."
+        )
+    return await live.search(lat, lon, radius_m, limit)
+
+
+# ---------- extract readers ----------
+def read_overpass_json(path: str) -> Tuple[List[dict], Tuple[float, float, float, float] | None]:
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    bounds = data.get("bounds")  # present with `out bb`; otherwise coverage is the elements' extent
+    bbox = (bounds["minlat"], bounds["minlon"], bounds["maxlat"], bounds["maxlon"]) if bounds else None
+    return data.get("elements", []), bbox
+
+
+def read_pbf(path: str) -> Tuple[List[dict], Tuple[float, float, float, float] | None]:
+    """
+    Restaurant nodes and ways (way position = mean of its nodes) from an OSM
+    PBF/XML extract. Relations are skipped: they have no cheap center here.
+    """
+    try:
+        import osmium
+    except ImportError as e:
+        raise SystemExit("Reading .pbf extracts needs pyosmium: pip install osmium") from e
+
+    elements: List[dict] = []
+
+    class Handler(osmium.SimpleHandler):
+        def node(self, n):
+            if n.tags.get("amenity") == "restaurant":
+                elements.append({"type": "node", "id": n.id, "lat": n.location.lat, "lon": n.location.lon,
+                                 "tags": {t.k: t.v for t in n.tags}})
+
+        def way(self, w):
+            if w.tags.get("amenity") == "restaurant":
+                locs = [nd.location for nd in w.nodes if nd.location.valid()]
+                if locs:
+                    elements.append({"type": "way", "id": w.id,
+                                     "center": {"lat": sum(p.lat for p in locs) / len(locs),
+                                                "lon": sum(p.lon for p in locs) / len(locs)},
+                                     "tags": {t.k: t.v for t in w.tags}})
+
+    Handler().apply_file(path, locations=True)
+    reader = osmium.io.Reader(path)
+    box = reader.header().box()
+    reader.close()
+    bbox = None
+    if box.valid():
+        bbox = (box.bottom_left.lat, box.bottom_left.lon, box.top_right.lat, box.top_right.lon)
+    return elements, bbox
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline OSM restaurant index (SQLite R*Tree)")
+    parser.add_argument("--path", default=DEFAULT_INDEX_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_import = sub.add_parser("import", help="ingest an Overpass JSON dump or an OSM .pbf/.osm extract")
+    p_import.add_argument("extract")
+    p_import.add_argument("--replace", action="store_true", help="start from an empty index")
+    p_search = sub.add_parser("search")
+    p_search.add_argument("lat", type=float)
+    p_search.add_argument("lon", type=float)
+    p_search.add_argument("--radius", type=int, default=1500)
+    p_search.add_argument("--limit", type=int, default=10)
+    p_nearest = sub.add_parser("nearest")
+    p_nearest.add_argument("lat", type=float)
+    p_nearest.add_argument("lon", type=float)
+    p_nearest.add_argument("-k", type=int, default=5)
+    sub.add_parser("stats")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        if args.replace and os.path.exists(args.path):
+            os.remove(args.path)
+        start = time.perf_counter()
+        if args.extract.endswith(".json"):
+            elements, bbox = read_overpass_json(args.extract)
+        else:
+            elements, bbox = read_pbf(args.extract)
+        index = RestaurantIndex(args.path)
+        n = index.import_elements(elements, bbox)
+        print(f"[osm-index] {n} restaurants imported into {args.path} in {time.perf_counter() - start:.1f}s")
+        print(index.stats())
+    else:
+        index = RestaurantIndex(args.path)
+        if args.command == "stats":
+            print(index.stats())
+        else:
+            if args.command == "search":
+                found = index.search(args.lat, args.lon, args.radius, args.limit)
+            else:
+                found = index.nearest(args.lat, args.lon, args.k)
+            for el in found:
+                print(f"{el['distance_m']:7d} m  {el['tags'].get('name', 'Unnamed')}  ({el['type']}/{el['id']})")
@@ -0,0 +1,524 @@
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import random
+import re
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List
+
+import httpx
+
+from deadlines import current_deadline, http_timeout, remaining, start_shared
+from osm_slots import STATUS_TIMEOUT_S, SlotScheduler, parse_status, status_url
+from overpass_fixtures import RECORD_DIR, normalize_query, record_fixture
+
+# ===== Shared Overpass client =====
+# One long-lived httpx.AsyncClient per process, opened in the app lifespan:
+# TCP+TLS to each mirror is set up once and reused (keep-alive, HTTP/2 when
+# the optional `h2` package is installed) instead of once per tool call.
+
+OVERPASS_ENDPOINTS = [
+    "https://overpass-api.de/api/interpreter",
+    "https://overpass.kumi.systems/api/interpreter",
+    "https://z.overpass-api.de/api/interpreter",
+]
+# Comma-separated URLs replacing every server's mirror list, e.g. local
+# overpass_standin.py instances for load tests
+ENDPOINTS_OVERRIDE = [u.strip() for u in os.getenv("OVERPASS_ENDPOINTS", "").split(",") if u.strip()]
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+# A handful of mirrors, a few concurrent queries each; idle connections are
+# kept long enough to span an agent's burst of follow-up tool calls
+POOL_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=90.0)
+
+# Mirror health scoring: route each attempt to the best-scoring healthy mirror
+EWMA_ALPHA = 0.3  # weight of the newest sample in latency / error averages
+BREAKER_FAILURES = 3  # consecutive failures that open a mirror's circuit breaker
+BREAKER_BASE_S = 30.0  # first open period; doubles on every re-open, up to BREAKER_MAX_S
+BREAKER_MAX_S = 300.0
+OVERLOAD_STATUSES = (503, 504)  # "busy, come back later": opens the breaker at once
+# 429 is not a mirror fault but our IP being out of slots: osm_slots holds the mirror instead
+
+# Hedged requests: when the primary mirror is slower than its own p<N>, the same
+# query also goes to the next-ranked mirror and the first success wins. At p95
+# about 1 in 20 queries is duplicated, which is what keeps this polite to the
+# public mirrors. 0 disables hedging.
+HEDGE_PERCENTILE = float(os.getenv("OVERPASS_HEDGE_PERCENTILE", "95"))
+HEDGE_DEFAULT_DELAY_S = 3.0  # until a mirror has HEDGE_MIN_SAMPLES latencies
+HEDGE_MIN_DELAY_S = 0.25
+HEDGE_MIN_SAMPLES = 10
+LATENCY_WINDOW = 200  # recent samples kept for percentiles
+
+
+_ELEMENTS_START = re.compile(r'"elements"\s*:\s*\[')
+
+
+class ElementStream:
+    """
+    Incremental parser for Overpass JSON: feed() body text as it arrives and
+    get back the members of the top-level "elements" array completed so far.
+    Each element is decoded on its own, so nothing after a cutoff is parsed.
+    """
+
+    def __init__(self):
+        self._buf = ""
+        self._in_array = False
+        self.done = False  # the closing "]" was seen
+        self._decoder = json.JSONDecoder()
+
+    def feed(self, text: str) -> List[dict]:
+        self._buf += text
+        if not self._in_array:
+            m = _ELEMENTS_START.search(self._buf)
+            if m is None:
+                return []  # still in the header (version, osm3s, ...)
+            self._in_array = True
+            self._buf = self._buf[m.end():]
+        out = []
+        pos = 0
+        while not self.done:
+            while pos < len(self._buf) and self._buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos >= len(self._buf):
+                break
+            if self._buf[pos] == "]":
+                self.done = True
+                break
+            try:
+                el, pos = self._decoder.raw_decode(self._buf, pos)
+            except json.JSONDecodeError:
+                break  # element not complete yet
+            out.append(el)
+        self._buf = self._buf[pos:]
+        return out
+
+
+def percentile(samples, q: float) -> float | None:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+class _MirrorStats:
+    __slots__ = (
+        "requests", "new_connections", "reused_connections", "errors", "http_versions",
+        "ewma_latency_s", "error_rate", "consecutive_failures", "overloads", "breaker_opens", "open_until",
+        "latencies",
+    )
+
+    def __init__(self):
+        self.requests = 0
+        self.new_connections = 0
+        self.reused_connections = 0
+        self.errors = 0
+        self.http_versions: Dict[str, int] = {}
+        self.ewma_latency_s: float | None = None  # None until the first response: tried early
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.overloads = 0
+        self.breaker_opens = 0
+        self.open_until = 0.0
+        self.latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+
+    def record_success(self, latency_s: float) -> None:
+        self.latencies.append(latency_s)
+        if self.ewma_latency_s is None:
+            self.ewma_latency_s = latency_s
+        else:
+            self.ewma_latency_s += EWMA_ALPHA * (latency_s - self.ewma_latency_s)
+        self.error_rate *= 1 - EWMA_ALPHA
+        self.consecutive_failures = 0
+        self.breaker_opens = 0
+
+    def record_abandoned(self, elapsed_s: float) -> None:
+        """
+        A request cancelled mid-flight (a hedge won, or the caller gave up)
+        took at least `elapsed_s`: count that as a latency sample so a mirror
+        that keeps losing hedges drops in the ranking and raises its own
+        hedge delay, instead of keeping its old fast numbers.
+        """
+        self.latencies.append(elapsed_s)
+        if self.ewma_latency_s is None or elapsed_s > self.ewma_latency_s:
+            prev = self.ewma_latency_s or elapsed_s
+            self.ewma_latency_s = prev + EWMA_ALPHA * (elapsed_s - prev)
+
+    def record_failure(self, latency_s: float, overloaded: bool = False) -> None:
+        self.errors += 1
+        # A failure took at least this long: timeouts push the latency estimate up too
+        if self.ewma_latency_s is None or latency_s > self.ewma_latency_s:
+            prev = self.ewma_latency_s or latency_s
+            self.ewma_latency_s = prev + EWMA_ALPHA * (latency_s - prev)
+        self.error_rate += EWMA_ALPHA * (1.0 - self.error_rate)
+        self.consecutive_failures += 1
+        if overloaded:
+            self.overloads += 1
+        if overloaded or self.consecutive_failures >= BREAKER_FAILURES:
+            self.open_until = time.monotonic() + min(BREAKER_BASE_S * 2 ** self.breaker_opens, BREAKER_MAX_S)
+            self.breaker_opens += 1
+
+    def is_open(self, now: float) -> bool:
+        return now < self.open_until
+
+    def score(self) -> float:
+        """
+        Expected cost of an attempt (lower is better): latency inflated by the
+        recent error rate, since a failure means paying for another mirror too.
+        """
+        if self.ewma_latency_s is None:
+            return 0.0
+        return self.ewma_latency_s * (1.0 + 4.0 * self.error_rate)
+
+    def as_dict(self) -> Dict[str, Any]:
+        connected = self.new_connections + self.reused_connections
+        now = time.monotonic()
+        return {
+            "requests": self.requests,
+            "new_connections": self.new_connections,
+            "reused_connections": self.reused_connections,
+            "reuse_rate": round(self.reused_connections / connected, 4) if connected else 0.0,
+            "errors": self.errors,
+            "http_versions": self.http_versions,
+            "ewma_latency_ms": round(1000 * self.ewma_latency_s, 1) if self.ewma_latency_s is not None else None,
+            "error_rate": round(self.error_rate, 4),
+            "overloads": self.overloads,
+            "score": round(self.score(), 4),
+            "breaker": "open" if self.is_open(now) else "closed",
+            "breaker_retry_in_s": round(self.open_until - now, 1) if self.is_open(now) else 0.0,
+            "p95_latency_ms": _ms(percentile(self.latencies, 95)),
+        }
+
+
+def _ms(seconds: float | None) -> float | None:
+    return round(1000 * seconds, 1) if seconds is not None else None
+
+
+class OverpassClient:
+    """
+    Overpass queries with retries and health-scored mirror selection over a
+    pooled client.
+    `start()` / `close()` belong in the app lifespan; `query()` starts the
+    client lazily if it was never started (scripts, tests).
+    """
+
+    def __init__(
+        self,
+        user_agent: str,
+        endpoints: List[str] | None = None,
+        http2: bool = HTTP2_AVAILABLE,
+        hedge_percentile: float = HEDGE_PERCENTILE,
+    ):
+        self.user_agent = user_agent
+        self.endpoints = list(ENDPOINTS_OVERRIDE or endpoints or OVERPASS_ENDPOINTS)
+        self.http2 = http2
+        self.hedge_percentile = hedge_percentile
+        self._client: httpx.AsyncClient | None = None
+        self._mirrors = {base: _MirrorStats() for base in self.endpoints}
+        self._slots = {base: SlotScheduler() for base in self.endpoints}
+        self._status_tasks: Dict[str, asyncio.Task] = {}
+        self.queries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._query_latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        # Single-flight: normalized query -> [shared upstream task, callers still waiting]
+        self._inflight: Dict[str, list] = {}
+        self.coalesced = 0
+        self.cutoffs = 0
+
+    async def start(self) -> None:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=self.http2,
+                limits=POOL_LIMITS,
+                headers={"user-agent": self.user_agent},
+            )
+
+    async def close(self) -> None:
+        for task in self._status_tasks.values():
+            task.cancel()
+        if self._client is not None:
+            client, self._client = self._client, None
+            await client.aclose()
+
+    async def _refresh_status(self, base: str) -> None:
+        slots = self._slots[base]
+        try:
+            resp = await self._client.get(status_url(base), timeout=STATUS_TIMEOUT_S)
+            resp.raise_for_status()
+            slots.apply_status(parse_status(resp.text))
+        except httpx.HTTPError:
+            slots.status_errors += 1
+            slots.status_checked_at = time.monotonic()  # retried at the next refresh interval
+
+    def _schedule_status(self, base: str) -> asyncio.Task:
+        task = self._status_tasks.get(base)
+        if task is None or task.done():
+            task = self._status_tasks[base] = asyncio.ensure_future(self._refresh_status(base))
+        return task
+
+    async def _post(self, base: str, query: str, max_elements: int | None = None) -> dict:
+        slots = self._slots[base]
+        if slots.status_checked_at is None:
+            # First use of this mirror: learn its slot limit before queueing on a guess
+            await asyncio.shield(self._schedule_status(base))
+        elif slots.status_due():
+            self._schedule_status(base)
+        # Queued (FIFO, across all tool calls) until this mirror has a free slot
+        await slots.acquire()
+        try:
+            return await self._post_in_slot(base, query, max_elements)
+        finally:
+            slots.release()
+
+    async def _post_in_slot(self, base: str, query: str, max_elements: int | None) -> dict:
+        stats = self._mirrors[base]
+        stats.requests += 1
+        opened = False
+        start = time.monotonic()
+
+        async def trace(event: str, info: dict) -> None:
+            nonlocal opened
+            # Only fired when the pool has no idle connection to this mirror
+            if event == "connection.connect_tcp.complete":
+                opened = True
+                stats.new_connections += 1
+
+        try:
+            async with self._client.stream(
+                "POST",
+                base,
+                data={"data": query},
+                headers={"content-type": "application/x-www-form-urlencoded"},
+                # never wait past the tool call's deadline
+                timeout=http_timeout(connect=5.0, read=20.0, write=10.0, pool=5.0),
+                extensions={"trace": trace},
+            ) as resp:
+                resp.raise_for_status()
+                try:
+                    if max_elements is None:
+                        data = json.loads(await resp.aread())
+                    else:
+                        data = await self._read_elements(resp, max_elements)
+                except ValueError as e:
+                    # Cut-off or garbled body: this mirror failed, the next one may not
+                    raise httpx.DecodingError(f"Unreadable Overpass response: {e}", request=resp.request) from e
+        except httpx.HTTPError as e:
+            status = e.response.status_code if isinstance(e, httpx.HTTPStatusError) else None
+            if status == 429:
+                # Out of slots: hold the mirror, then learn from /api/status when a slot frees up
+                self._slots[base].on_rate_limited()
+                self._schedule_status(base)
+            else:
+                stats.record_failure(time.monotonic() - start, status in OVERLOAD_STATUSES)
+            raise
+        except asyncio.CancelledError:
+            # Usually the losing side of a hedge: it was at least this slow
+            stats.record_abandoned(time.monotonic() - start)
+            raise
+        latency = time.monotonic() - start
+        stats.record_success(latency)
+        if RECORD_DIR and not data.get("truncated"):
+            record_fixture(RECORD_DIR, query, base, latency, data)
+        if not opened:
+            stats.reused_connections += 1
+        stats.http_versions[resp.http_version] = stats.http_versions.get(resp.http_version, 0) + 1
+        return data
+
+    async def _read_elements(self, resp: httpx.Response, max_elements: int) -> dict:
+        """
+        Parse elements while the body streams in and stop reading once more
+        than `max_elements` have arrived; leaving the stream early closes the
+        response, so the rest of a large body is never downloaded. A body that
+        was read to the end is returned whole and never counts as truncated,
+        even past `max_elements`.
+        """
+        stream = ElementStream()
+        elements: List[dict] = []
+        async for text in resp.aiter_text():
+            elements.extend(stream.feed(text))
+            if stream.done:
+                break
+            if len(elements) > max_elements:
+                self.cutoffs += 1
+                return {"elements": elements[:max_elements], "truncated": True}
+        if not stream.done:
+            raise ValueError("Overpass response ended before the elements array was complete")
+        return {"elements": elements, "truncated": False}
+
+    def ranked_mirrors(self) -> List[str]:
+        """
+        Healthy mirrors, best score first (random among equals). Mirrors with
+        an open breaker are skipped; if every breaker is open, the one closest
+        to reopening gets a single half-open probe.
+        """
+        now = time.monotonic()
+        order = self.endpoints[:]
+        random.shuffle(order)  # tie-break, and spread load over untried mirrors
+        healthy = sorted((b for b in order if not self._mirrors[b].is_open(now)), key=self._expected_cost)
+        tripped = sorted((b for b in order if self._mirrors[b].is_open(now)), key=lambda b: self._mirrors[b].open_until)
+        return healthy or tripped[:1]
+
+    def _expected_cost(self, base: str) -> float:
+        # Health score plus the time a new request would wait for one of our slots there
+        stats = self._mirrors[base]
+        return stats.score() + self._slots[base].expected_wait_s(stats.ewma_latency_s or 1.0)
+
+    def hedge_delay(self, base: str) -> float | None:
+        """
+        How long to wait on `base` before hedging, or None when hedging is off.
+        """
+        if self.hedge_percentile <= 0:
+            return None
+        latencies = self._mirrors[base].latencies
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY_S
+        return max(HEDGE_MIN_DELAY_S, percentile(latencies, self.hedge_percentile))
+
+    async def _hedged_post(self, base: str, backups: List[str], query: str, max_elements: int | None) -> dict:
+        """
+        POST to `base`; if it is still running after hedge_delay(), also POST to
+        the first of `backups` (consumed from the list) and return whichever
+        succeeds first. The other request is cancelled.
+        """
+        primary = asyncio.ensure_future(self._post(base, query, max_elements))
+        pending = {primary}
+        try:
+            delay = self.hedge_delay(base)
+            if delay is not None and backups:
+                done, _ = await asyncio.wait(pending, timeout=delay)
+                if not done:
+                    self.hedges += 1
+                    pending.add(asyncio.ensure_future(self._post(backups.pop(0), query, max_elements)))
+            last_exc = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        return task.result()
+                    last_exc = task.exception()
+            raise last_exc
+        finally:
+            for task in pending:
+                task.cancel()  # the losing request, or both when our caller is cancelled
+
+    async def query(self, query: str, max_elements: int | None = None) -> dict:
+        """
+        Query Overpass with retries, fastest-healthy-mirror routing, hedging and
+        a polite User-Agent. Identical queries already in flight share one
+        upstream request; the parsed result is shared too, so treat it as read-only.
+
+        With `max_elements`, the body is parsed as it streams in and reading
+        stops once more than that many elements arrived ("truncated": True in
+        the result, which then holds exactly `max_elements`).
+        """
+        key = f"{max_elements}|{normalize_query(query)}"
+        entry = self._inflight.get(key)
+        if entry is None:
+            # The shared request gets a context of its own, not a copy of the first
+            # caller's: it runs until the latest deadline among everyone waiting on it
+            task, shared = start_shared(self._query_upstream(query, max_elements), current_deadline())
+            entry = self._inflight[key] = [task, 0, shared]
+            task.add_done_callback(lambda _t: self._inflight.pop(key, None) if self._inflight.get(key) is entry else None)
+        else:
+            self.coalesced += 1
+            entry[2].extend(current_deadline())
+        entry[1] += 1
+        try:
+            # shield: one caller timing out must not cancel the request for the others
+            return await asyncio.shield(entry[0])
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and not entry[0].done():
+                entry[0].cancel()  # nobody is waiting any more
+
+    async def _query_upstream(self, query: str, max_elements: int | None) -> dict:
+        await self.start()
+        self.queries += 1
+        start = time.monotonic()
+        attempts = 0
+        last_exc = None
+        while attempts < 4:
+            # Re-ranked every round: failures in the previous round reorder or trip mirrors
+            candidates = self.ranked_mirrors()
+            while candidates:
+                if remaining() == 0.0:
+                    raise RuntimeError(f"Overpass query ran out of time. Last error: {last_exc}")
+                base = candidates.pop(0)
+                try:
+                    data = await self._hedged_post(base, candidates, query, max_elements)
+                except (httpx.TimeoutException, httpx.HTTPStatusError, httpx.TransportError, httpx.DecodingError) as e:
+                    last_exc = e
+                    continue
+                self._query_latencies.append(time.monotonic() - start)
+                return data
+            attempts += 1
+            if isinstance(last_exc, httpx.HTTPStatusError) and last_exc.response.status_code == 429:
+                continue  # no blind sleep: the slot schedulers hold the next round until a slot frees up
+            backoff = min(2 ** attempts, 6)  # 2s, 4s, 6s, 6s
+            if remaining(backoff) < backoff:
+                break  # the caller gives up before another round could finish
+            await asyncio.sleep(backoff)
+        raise RuntimeError(f"Overpass query failed across mirrors. Last error: {last_exc}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "http2": self.http2,
+            "pool": {
+                "max_connections": POOL_LIMITS.max_connections,
+                "max_keepalive_connections": POOL_LIMITS.max_keepalive_connections,
+                "keepalive_expiry_s": POOL_LIMITS.keepalive_expiry,
+            },
+            "open": self._client is not None,
+            "mirror_order": self.ranked_mirrors(),
+            "mirrors": {base: stats.as_dict() for base, stats in self._mirrors.items()},
+            "slots": {base: slots.stats() for base, slots in self._slots.items()},
+            "single_flight": {
+                "coalesced_queries": self.coalesced,
+                "in_flight": len(self._inflight),
+            },
+            "streaming_cutoffs": self.cutoffs,
+            "hedging": {
+                "percentile": self.hedge_percentile,
+                "queries": self.queries,
+                "hedges": self.hedges,
+                "hedge_rate": round(self.hedges / self.queries, 4) if self.queries else 0.0,
+                "hedge_wins": self.hedge_wins,
+            },
+            "query_latency_ms": {
+                "p50": _ms(percentile(self._query_latencies, 50)),
+                "p95": _ms(percentile(self._query_latencies, 95)),
+                "p99": _ms(percentile(self._query_latencies, 99)),
+            },
+        }
+
+
+async def _bench(queries: int, hedge_percentile: float) -> Dict[str, Any]:
+    client = OverpassClient("MCP-Overpass-Bench/1.0 (overpass_server.py)", hedge_percentile=hedge_percentile)
+    # A small, cheap query (one city block) so the measurement is mostly mirror latency
+    query = '[out:json][timeout:25];node["amenity"="restaurant"](35.6595,139.7005,35.6605,139.7015);out tags center;'
+    try:
+        for _ in range(queries):
+            try:
+                await client.query(query)
+            except RuntimeError as e:
+                print(f"[bench] {e}")
+        return client.stats()
+    finally:
+        await client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare Overpass query latency without and with hedging")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--percentile", type=float, default=HEDGE_PERCENTILE)
+    args = parser.parse_args()
+
+    for label, pct in (("unhedged", 0.0), (f"hedged@p{args.percentile:g}", args.percentile)):
+        result = asyncio.run(_bench(args.queries, pct))
+        lat, hedging = result["query_latency_ms"], result["hedging"]
+        print(f"{label:>14}: p50={lat['p50']} ms  p95={lat['p95']} ms  p99={lat['p99']} ms  "
+              f"hedge_rate={hedging['hedge_rate']}  hedge_wins={hedging['hedge_wins']}")
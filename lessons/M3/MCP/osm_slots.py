@@ -0,0 +1,155 @@
+import asyncio
+import re
+import time
+from collections import deque
+from typing import Any, Deque, Dict
+
+# ===== Overpass slot scheduler =====
+# Overpass grants each client IP a few query slots per mirror (overpass-api.de:
+# 2) and answers 429 beyond that. Instead of firing and backing off blindly,
+# every request takes a slot from its mirror's scheduler first:
+#   - at most `limit` requests run per mirror, the rest wait in a FIFO queue,
+#     so tool calls are served in arrival order;
+#   - after a 429, or when /api/status says no slot is free, the mirror is
+#     held until the time the server announces;
+#   - `limit` and those times come from the mirror's /api/status.
+# Waiting is bounded by the tool call's deadline (the caller is cancelled),
+# not by failing the request.
+
+DEFAULT_SLOTS = 2  # overpass-api.de's default per-IP rate limit
+RATE_LIMITED_HOLD_S = 5.0  # hold after a 429 until /api/status says otherwise
+STATUS_REFRESH_S = 60.0
+STATUS_TIMEOUT_S = 3.0
+WAIT_WINDOW = 200
+
+_RATE_LIMIT = re.compile(r"Rate limit:\s*(\d+)")
+_AVAILABLE = re.compile(r"(\d+) slots? available now")
+_AVAILABLE_IN = re.compile(r"Slot available after: \S+, in (-?\d+) seconds?")
+
+
+def status_url(interpreter_url: str) -> str:
+    return interpreter_url.rsplit("/", 1)[0] + "/status"
+
+
+def parse_status(text: str) -> Dict[str, Any]:
+    """
+    {"rate_limit": int | None, "available": int | None, "next_slot_in_s": float | None}
+    from an Overpass /api/status page. rate_limit 0 means unlimited.
+    """
+    rate = _RATE_LIMIT.search(text)
+    available = _AVAILABLE.search(text)
+    waits = [max(0, int(s)) for s in _AVAILABLE_IN.findall(text)]
+    return {
+        "rate_limit": int(rate.group(1)) if rate else None,
+        "available": int(available.group(1)) if available else (0 if waits else None),
+        "next_slot_in_s": float(min(waits)) if waits else None,
+    }
+
+
+class SlotScheduler:
+    def __init__(self, limit: int = DEFAULT_SLOTS):
+        self.limit = limit  # 0 = no limit announced
+        self.in_flight = 0
+        self.held_until = 0.0  # time.monotonic()
+        self._queue: Deque[asyncio.Future] = deque()
+        self._wakeup: asyncio.TimerHandle | None = None
+        self._waits: Deque[float] = deque(maxlen=WAIT_WINDOW)
+        self.granted = 0
+        self.queued = 0
+        self.rate_limited = 0
+        self.status_checked_at: float | None = None
+        self.status_errors = 0
+        self.last_status: Dict[str, Any] | None = None
+
+    def _free(self, now: float) -> bool:
+        return now >= self.held_until and (self.limit == 0 or self.in_flight < self.limit)
+
+    def _dispatch(self) -> None:
+        now = time.monotonic()
+        while self._queue and self._free(now):
+            fut = self._queue.popleft()
+            if fut.done():  # its caller gave up while queued
+                continue
+            self.in_flight += 1
+            fut.set_result(None)
+        if self._queue and now < self.held_until and self._wakeup is None:
+            self._wakeup = asyncio.get_running_loop().call_later(self.held_until - now, self._on_wakeup)
+
+    def _on_wakeup(self) -> None:
+        self._wakeup = None
+        self._dispatch()
+
+    async def acquire(self) -> None:
+        start = time.monotonic()
+        if not self._queue and self._free(start):
+            self.in_flight += 1
+        else:
+            self.queued += 1
+            fut = asyncio.get_running_loop().create_future()
+            self._queue.append(fut)
+            self._dispatch()
+            try:
+                await fut
+            except asyncio.CancelledError:
+                if fut.done() and not fut.cancelled():
+                    self.release()  # granted just as the caller gave up: pass it on
+                raise
+        self.granted += 1
+        self._waits.append(time.monotonic() - start)
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._dispatch()
+
+    def hold(self, seconds: float) -> None:
+        """
+        Start nothing on this mirror for `seconds` (queued requests keep their place).
+        """
+        self.held_until = max(self.held_until, time.monotonic() + seconds)
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+            self._wakeup = None
+        self._dispatch()
+
+    def on_rate_limited(self) -> None:
+        self.rate_limited += 1
+        self.hold(RATE_LIMITED_HOLD_S)
+
+    def apply_status(self, status: Dict[str, Any]) -> None:
+        self.status_checked_at = time.monotonic()
+        self.last_status = status
+        if status["rate_limit"] is not None:
+            self.limit = status["rate_limit"]
+        if status["available"] == 0 and status["next_slot_in_s"] is not None:
+            self.hold(status["next_slot_in_s"])
+        else:
+            self._dispatch()
+
+    def status_due(self) -> bool:
+        return self.status_checked_at is None or time.monotonic() - self.status_checked_at > STATUS_REFRESH_S
+
+    def expected_wait_s(self, service_time_s: float) -> float:
+        """
+        Rough time a new request would queue here, for mirror ranking.
+        """
+        held = max(0.0, self.held_until - time.monotonic())
+        if self.limit == 0:
+            return held
+        ahead = len(self._queue) + self.in_flight - self.limit + 1
+        return held + max(0, ahead) * service_time_s / self.limit
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self._waits)
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "queue_depth": sum(1 for f in self._queue if not f.done()),
+            "held_for_s": round(max(0.0, self.held_until - time.monotonic()), 1),
+            "granted": self.granted,
+            "queued": self.queued,
+            "rate_limited": self.rate_limited,
+            "avg_wait_ms": round(1000 * sum(waits) / len(waits), 1) if waits else 0.0,
+            "p95_wait_ms": round(1000 * waits[int(0.95 * (len(waits) - 1))], 1) if waits else 0.0,
+            "status": self.last_status,
+            "status_errors": self.status_errors,
+        }
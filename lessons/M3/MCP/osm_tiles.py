@@ -0,0 +1,336 @@
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from osm_overpass import OverpassClient
+
+# ===== Geohash tile cache for restaurant searches =====
+# Restaurants are fetched per geohash tile (complete tile contents, no limit)
+# and kept with a TTL. A radius search assembles the covering tiles and filters
+# by haversine distance, so repeated and nearby searches never hit the network.
+# Results are ranked nearest-first. A search starts at a small radius and only
+# grows (doubling, up to the requested radius) while it has fewer than `limit`
+# results, so dense areas fetch a few tiles instead of the whole circle.
+# Searches needing too many tiles continue with live `around:` queries, still
+# growing the radius; a capped answer (not nearest-first) is only returned,
+# and logged, when bisecting the radius cannot avoid the cap.
+
+TILE_PRECISION = int(os.getenv("OSM_TILE_PRECISION", "6"))  # ~1.2 km x 0.6 km tiles
+TILE_TTL_S = float(os.getenv("OSM_TILE_TTL_S", str(6 * 3600)))
+MAX_CACHED_TILES = int(os.getenv("OSM_TILE_CACHE_SIZE", "4096"))
+MAX_TILES_PER_SEARCH = int(os.getenv("OSM_TILE_MAX_PER_SEARCH", "48"))  # ~2 km radius at precision 6
+INITIAL_SEARCH_RADIUS_M = int(os.getenv("OSM_INITIAL_RADIUS_M", "400"))
+# The live fallback is only reached when fewer than `limit` restaurants are within
+# the tile-able radius (a sparse area), so this cap is rarely hit. Overpass
+# applies it in its own order, not by distance: a capped answer is retried at a
+# smaller radius rather than ranked as if it were complete.
+LIVE_FALLBACK_MAX_RESULTS = 500
+EARTH_RADIUS_M = 6371008.8
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash_encode(lat: float, lon: float, precision: int = TILE_PRECISION) -> str:
+    lat_lo, lat_hi, lon_lo, lon_hi = -90.0, 90.0, -180.0, 180.0
+    chars, ch, bit, even = [], 0, 0, True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            ch = ch * 2 + (lon >= mid)
+            lon_lo, lon_hi = (mid, lon_hi) if lon >= mid else (lon_lo, mid)
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            ch = ch * 2 + (lat >= mid)
+            lat_lo, lat_hi = (mid, lat_hi) if lat >= mid else (lat_lo, mid)
+        even = not even
+        bit += 1
+        if bit == 5:
+            chars.append(_BASE32[ch])
+            ch, bit = 0, 0
+    return "".join(chars)
+
+
+def tile_size(precision: int) -> Tuple[float, float]:
+    """
+    (degrees latitude, degrees longitude) covered by one tile.
+    """
+    lon_bits = math.ceil(5 * precision / 2)
+    lat_bits = 5 * precision - lon_bits
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def geohash_bbox(tile: str) -> Tuple[float, float, float, float]:
+    """
+    (south, west, north, east) of a tile.
+    """
+    lat_lo, lat_hi, lon_lo, lon_hi = -90.0, 90.0, -180.0, 180.0
+    even = True
+    for c in tile:
+        v = _BASE32.index(c)
+        for shift in range(4, -1, -1):
+            bit = (v >> shift) & 1
+            if even:
+                mid = (lon_lo + lon_hi) / 2
+                lon_lo, lon_hi = (mid, lon_hi) if bit else (lon_lo, mid)
+            else:
+                mid = (lat_lo + lat_hi) / 2
+                lat_lo, lat_hi = (mid, lat_hi) if bit else (lat_lo, mid)
+            even = not even
+    return lat_lo, lon_lo, lat_hi, lon_hi
+
+
+def covering_tiles(lat: float, lon: float, radius_m: float, precision: int = TILE_PRECISION) -> List[str]:
+    """
+    Tiles intersecting the bounding box of the search circle.
+    """
+    dlat, dlon = tile_size(precision)
+    rlat = math.degrees(radius_m / EARTH_RADIUS_M)
+    rlon = rlat / max(math.cos(math.radians(lat)), 1e-6)
+    south, north = max(lat - rlat, -90.0), min(lat + rlat, 90.0 - 1e-9)
+    west, east = lon - rlon, lon + rlon
+    tiles = []
+    row = math.floor((south + 90.0) / dlat)
+    while row * dlat - 90.0 <= north:
+        col = math.floor((west + 180.0) / dlon)
+        while col * dlon - 180.0 <= east:
+            center_lon = (col + 0.5) * dlon - 180.0
+            center_lon = (center_lon + 180.0) % 360.0 - 180.0  # wrap across the antimeridian
+            tiles.append(geohash_encode((row + 0.5) * dlat - 90.0, center_lon, precision))
+            col += 1
+        row += 1
+    return list(dict.fromkeys(tiles))
+
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def haversine_many_m(lat: float, lon: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    p1, p2 = np.radians(lat), np.radians(lats)
+    dp, dl = p2 - p1, np.radians(lons - lon)
+    a = np.sin(dp / 2) ** 2 + np.cos(p1) * np.cos(p2) * np.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def rank_by_distance(
+    lat: float, lon: float, elements: Iterable[dict], limit: int, radius_m: float | None = None
+) -> List[dict]:
+    """
+    The `limit` elements nearest to (lat, lon), nearest first, as copies with
+    flat lat/lon and a "distance_m" field. Elements beyond `radius_m` or
+    without coordinates are dropped.
+    """
+    located = []
+    for el in elements:
+        el_lat, el_lon = element_coords(el)
+        if el_lat is not None and el_lon is not None:
+            located.append((el, el_lat, el_lon))
+    if not located:
+        return []
+    coords = np.array([(la, lo) for _, la, lo in located], dtype=np.float64)
+    dist = haversine_many_m(lat, lon, coords[:, 0], coords[:, 1])
+    order = np.argsort(dist, kind="stable")
+    if radius_m is not None:
+        order = order[dist[order] <= radius_m]
+    return [
+        {**located[i][0], "lat": located[i][1], "lon": located[i][2], "distance_m": round(float(dist[i]))}
+        for i in order[:limit]
+    ]
+
+
+def element_coords(el: dict) -> Tuple[float | None, float | None]:
+    if "lat" in el and "lon" in el:
+        return el["lat"], el["lon"]
+    center = el.get("center") or {}
+    return center.get("lat"), center.get("lon")
+
+
+def restaurants_around_query(lat: float, lon: float, radius_m: int, limit: int | None = None) -> str:
+    out_limit = f" {limit}" if limit else ""
+    return f"""
+    [out:json][timeout:25];
+    (
+      node["amenity"="restaurant"](around:{radius_m},{lat},{lon});
+      way["amenity"="restaurant"](around:{radius_m},{lat},{lon});
+      relation["amenity"="restaurant"](around:{radius_m},{lat},{lon});
+    );
+    out tags center{out_limit};
+    """
+
+
+def restaurants_bbox_query(south: float, west: float, north: float, east: float) -> str:
+    bbox = f"{south},{west},{north},{east}"
+    return f"""
+    [out:json][timeout:25];
+    (
+      node["amenity"="restaurant"]({bbox});
+      way["amenity"="restaurant"]({bbox});
+      relation["amenity"="restaurant"]({bbox});
+    );
+    out tags center;
+    """
+
+
+class RestaurantTileCache:
+    def __init__(
+        self,
+        overpass: OverpassClient,
+        precision: int = TILE_PRECISION,
+        ttl_s: float = TILE_TTL_S,
+        max_tiles: int = MAX_CACHED_TILES,
+    ):
+        self.overpass = overpass
+        self.precision = precision
+        self.ttl_s = ttl_s
+        self.max_tiles = max_tiles
+        # tile -> (fetched_at, elements with flat lat/lon)
+        self._tiles: "OrderedDict[str, Tuple[float, List[dict]]]" = OrderedDict()
+        self.searches = 0
+        self.local_searches = 0
+        self.live_searches = 0
+        self.expansions = 0
+        self.tile_hits = 0
+        self.tile_misses = 0
+        self.tile_fetches = 0
+        self.live_bisections = 0
+        self.live_truncated = 0  # capped live answers returned anyway (order approximate)
+
+    def _get(self, tile: str) -> List[dict] | None:
+        entry = self._tiles.get(tile)
+        if entry is None:
+            return None
+        fetched_at, elements = entry
+        if time.time() - fetched_at > self.ttl_s:
+            del self._tiles[tile]
+            return None
+        self._tiles.move_to_end(tile)
+        return elements
+
+    def _put(self, tile: str, elements: List[dict]) -> None:
+        self._tiles[tile] = (time.time(), elements)
+        self._tiles.move_to_end(tile)
+        while len(self._tiles) > self.max_tiles:
+            self._tiles.popitem(last=False)
+
+    async def _fetch(self, tiles: List[str]) -> None:
+        """
+        Fill `tiles` with one bbox query over their union; every element is
+        filed under the tile of its coordinates.
+        """
+        boxes = [geohash_bbox(t) for t in tiles]
+        data = await self.overpass.query(restaurants_bbox_query(
+            min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes), max(b[3] for b in boxes),
+        ))
+        self.tile_fetches += 1
+        contents: Dict[str, List[dict]] = {t: [] for t in tiles}
+        for el in data.get("elements", []):
+            el_lat, el_lon = element_coords(el)
+            if el_lat is None or el_lon is None:
+                continue
+            tile = geohash_encode(el_lat, el_lon, self.precision)
+            if tile in contents:
+                contents[tile].append({
+                    "type": el.get("type", "node"),
+                    "id": el.get("id"),
+                    "lat": el_lat,
+                    "lon": el_lon,
+                    "tags": el.get("tags") or {},
+                })
+        for tile, elements in contents.items():
+            self._put(tile, elements)
+
+    async def search(self, lat: float, lon: float, radius_m: int, limit: int) -> List[dict]:
+        """
+        The `limit` restaurants nearest to (lat, lon) within `radius_m`,
+        nearest first, with "distance_m". Raises like OverpassClient.query
+        when a needed fetch fails.
+        """
+        self.searches += 1
+        fetched = False
+        radius = min(radius_m, INITIAL_SEARCH_RADIUS_M)
+        while True:
+            tiles = covering_tiles(lat, lon, radius, self.precision)
+            if len(tiles) > MAX_TILES_PER_SEARCH:
+                # Too large an area to fetch as tiles: go on with live queries
+                return await self._live_search(lat, lon, radius, radius_m, limit)
+
+            missing = [t for t in tiles if self._get(t) is None]
+            self.tile_hits += len(tiles) - len(missing)
+            self.tile_misses += len(missing)
+            if missing:
+                await self._fetch(missing)
+                fetched = True
+
+            candidates = [el for tile in tiles for el in self._get(tile) or []]
+            found = rank_by_distance(lat, lon, candidates, limit, radius)
+            # Everything within `radius` is known, so these are the true nearest `limit`
+            if len(found) >= limit or radius >= radius_m:
+                if not fetched:
+                    self.local_searches += 1
+                return found
+            self.expansions += 1
+            radius = min(radius * 2, radius_m)
+
+    async def _live_search(self, lat: float, lon: float, radius: int, radius_m: int, limit: int) -> List[dict]:
+        """
+        The search loop past the tile budget, one live query per radius. Half
+        of `radius` is known (from tiles) to hold fewer than `limit`
+        restaurants; once an answer hits the cap, the radius is bisected
+        between that and the capped one instead of ranking a capped answer
+        as exact.
+        """
+        self.live_searches += 1
+        complete_radius = radius // 2  # complete, fewer than `limit` within
+        capped_radius, capped_found = None, []  # smallest radius whose answer hit the cap
+        while True:
+            query = restaurants_around_query(lat, lon, radius, LIVE_FALLBACK_MAX_RESULTS)
+            # Streamed: a mirror ignoring the `out` limit still costs at most this many elements
+            data = await self.overpass.query(query, max_elements=LIVE_FALLBACK_MAX_RESULTS)
+            elements = data.get("elements", [])
+            found = rank_by_distance(lat, lon, elements, limit, radius)
+            if data.get("truncated") or len(elements) >= LIVE_FALLBACK_MAX_RESULTS:
+                capped_radius, capped_found = radius, found
+            elif len(found) >= limit or radius >= radius_m:
+                return found
+            else:
+                complete_radius = radius
+            if capped_radius is None:
+                self.expansions += 1
+                radius = min(radius * 2, radius_m)
+            elif capped_radius - complete_radius > max(50, capped_radius // 8):
+                self.live_bisections += 1
+                radius = (complete_radius + capped_radius) // 2
+            else:
+                self.live_truncated += 1
+                print(f"[osm-tiles] Live search at {lat}, {lon} (radius {capped_radius} m) hit the "
+                      f"{LIVE_FALLBACK_MAX_RESULTS}-element cap; nearest-first order is approximate.")
+                return capped_found
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.tile_hits + self.tile_misses
+        return {
+            "searches": self.searches,
+            "served_locally": self.local_searches,
+            "live_fallbacks": self.live_searches,
+            "radius_expansions": self.expansions,
+            "live_bisections": self.live_bisections,
+            "live_truncated": self.live_truncated,
+            "tile_hits": self.tile_hits,
+            "tile_misses": self.tile_misses,
+            "tile_hit_rate": round(self.tile_hits / lookups, 4) if lookups else 0.0,
+            "tile_fetch_queries": self.tile_fetches,
+            "cached_tiles": len(self._tiles),
+            "config": {
+                "precision": self.precision,
+                "ttl_s": self.ttl_s,
+                "max_tiles": self.max_tiles,
+                "max_tiles_per_search": MAX_TILES_PER_SEARCH,
+                "initial_radius_m": INITIAL_SEARCH_RADIUS_M,
+            },
+        }
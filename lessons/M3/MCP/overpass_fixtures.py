@@ -0,0 +1,52 @@
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict
+
+# ===== Overpass request/response fixtures =====
+# With OVERPASS_RECORD_DIR set, OverpassClient writes every complete response
+# it gets from a real mirror to <dir>/<key>.json; overpass_standin.py replays
+# them. Keys depend only on the query text (whitespace-normalized), so the
+# same tool calls against the stand-in hit the same fixtures.
+
+RECORD_DIR = os.getenv("OVERPASS_RECORD_DIR")
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.split())
+
+
+def fixture_key(query: str) -> str:
+    return hashlib.sha1(normalize_query(query).encode("utf-8")).hexdigest()
+
+
+def record_fixture(directory: str, query: str, mirror: str, latency_s: float, response: dict) -> None:
+    path = Path(directory)
+    path.mkdir(parents=True, exist_ok=True)
+    fixture = {
+        "query": normalize_query(query),
+        "mirror": mirror,
+        "latency_s": round(latency_s, 4),
+        "recorded_at": int(time.time()),
+        "response": response,
+    }
+    tmp = path / f".{fixture_key(query)}.tmp"
+    tmp.write_text(json.dumps(fixture, ensure_ascii=False), encoding="utf-8")
+    tmp.replace(path / f"{fixture_key(query)}.json")  # readers never see a half-written file
+
+
+def load_fixtures(directory: str) -> Dict[str, Dict[str, Any]]:
+    """
+    key -> {"query", "latency_s", "body" (the response as JSON bytes)}.
+    """
+    fixtures = {}
+    for f in sorted(Path(directory).glob("*.json")):
+        fixture = json.loads(f.read_text(encoding="utf-8"))
+        fixtures[f.stem] = {
+            "query": fixture["query"],
+            "latency_s": fixture.get("latency_s", 0.0),
+            "body": json.dumps(fixture["response"], ensure_ascii=False).encode("utf-8"),
+        }
+    return fixtures
@@ -2,8 +2,6 @@ import json
 from datetime import datetime, timezone as dt_timezone
 from typing import Any, Dict, List
 
-import asyncio
-import random
 import httpx
 from mcp.server import Server
 from mcp.server.sse import SseServerTransport
@@ -15,6 +13,12 @@ from starlette.middleware.cors import CORSMiddleware
 from starlette.requests import Request
 import uvicorn
 
+from deadlines import run_with_deadline
+from osm_overpass import OverpassClient
+from osm_tiles import RestaurantTileCache
+from osm_index import load_restaurant_index, search_restaurants
+from osm_entities import MAX_BATCH_IDS, OSM_TYPES, OsmEntityCache
+
 # --------- Optional: proper timezone conversion ----------
 try:
     from zoneinfo import ZoneInfo  # Python 3.9+
@@ -70,36 +74,53 @@ def schema_get_osm_place_details() -> Dict[str, Any]:
         "required": ["osm_type", "osm_id"],
     }
 
+def schema_get_osm_places_details() -> Dict[str, Any]:
+    return {
+        "type": "object",
+        "properties": {
+            "places": {
+                "type": "array",
+                "description": f"OSM elements to look up (at most {MAX_BATCH_IDS})",
+                "items": schema_get_osm_place_details(),
+                "maxItems": MAX_BATCH_IDS,
+            },
+        },
+        "required": ["places"],
+    }
+
+@mcp_server.list_tools()
+async def list_tools() -> List[Tool]:
+    return [
+        Tool(
+            name="get_current_time",
+            description="Get the current time in a specified timezone.",
+            inputSchema=schema_get_current_time(),
+        ),
+        Tool(
+            name="search_osm_restaurants",
+            description="Find nearby restaurants from OpenStreetMap (no API key), nearest first.",
+            inputSchema=schema_search_osm_restaurants(),
+        ),
+        Tool(
+            name="get_osm_place_details",
+            description="Get detailed tags for an OSM element (node/way/relation).",
+            inputSchema=schema_get_osm_place_details(),
+        ),
+        Tool(
+            name="get_osm_places_details",
+            description=f"Get detailed tags for up to {MAX_BATCH_IDS} OSM elements in one call.",
+            inputSchema=schema_get_osm_places_details(),
+        ),
+    ]
+
 # ---------------- Overpass helper with mirrors/retries ----------------
-async def overpass_query(client: httpx.AsyncClient, query: str) -> dict:
-    """
-    Query Overpass with retries, mirror rotation, and a polite User-Agent.
-    """
-    endpoints = OVERPASS_ENDPOINTS[:]
-    random.shuffle(endpoints)
-
-    attempts = 0
-    last_exc = None
-    while attempts < 4:
-        for base in endpoints:
-            try:
-                resp = await client.post(
-                    base,
-                    data={"data": query},
-                    headers={
-                        "content-type": "application/x-www-form-urlencoded",
-                        "user-agent": USER_AGENT,
-                    },
-                    timeout=httpx.Timeout(connect=5.0, read=20.0, write=10.0, pool=5.0),
-                )
-                resp.raise_for_status()
-                return resp.json()
-            except (httpx.TimeoutException, httpx.HTTPStatusError, httpx.TransportError) as e:
-                last_exc = e
-                continue
-        attempts += 1
-        await asyncio.sleep(min(2 ** attempts, 6))  # 2s, 4s, 6s, 6s
-    raise RuntimeError(f"Overpass query failed across mirrors. Last error: {last_exc}")
+# Process-wide pooled client (keep-alive / HTTP/2); opened and closed in the lifespan
+_overpass = OverpassClient(USER_AGENT, OVERPASS_ENDPOINTS)
+_restaurants = RestaurantTileCache(_overpass)
+# Optional offline index (osm_index.py import ...); None -> every search goes to Overpass
+_osm_index = load_restaurant_index()
+# Places seen in search results, for detail lookups without another query
+_entities = OsmEntityCache(_overpass, _osm_index)
 
 # ---------------- Helpers ----------------
 def format_hours(tags: dict) -> str:
@@ -151,29 +172,21 @@ async def tool_search_osm_restaurants(arguments: Dict[str, Any]) -> str:
     limit = int(arguments.get("limit", 10))
     radius_m = int(arguments.get("radius_m", DEFAULT_SEARCH_RADIUS_M))
 
-    overpass = f"""
-    [out:json][timeout:25];
-    (
-      node["amenity"="restaurant"](around:{radius_m},{lat},{lon});
-      way["amenity"="restaurant"](around:{radius_m},{lat},{lon});
-      relation["amenity"="restaurant"](around:{radius_m},{lat},{lon});
-    );
-    out tags center {limit};
-    """
-
-    async with httpx.AsyncClient() as client:
-        try:
-            data = await overpass_query(client, overpass)
-        except httpx.HTTPStatusError as e:
-            return f"Overpass error {e.response.status_code}. Try again later or reduce radius."
-        except Exception as e:
-            return f"Error querying Overpass: {e}"
-
-    elements = data.get("elements", [])
+    try:
+        # Offline index when it covers the area, else cached geohash tiles / live Overpass
+        elements = await search_restaurants(_osm_index, _restaurants, lat, lon, radius_m, limit)
+    except httpx.HTTPStatusError as e:
+        return f"Overpass error {e.response.status_code}. Try again later or reduce radius."
+    except LookupError as e:
+        return str(e)
+    except Exception as e:
+        return f"Error querying Overpass: {e}"
+
+    _entities.remember(elements)
     if not elements:
         return f"No OSM restaurants found near {lat}, {lon} within {radius_m} m."
 
-    lines: List[str] = [f"OSM restaurants near {lat}, {lon} (radius {radius_m} m):", ""]
+    lines: List[str] = [f"OSM restaurants near {lat}, {lon} (radius {radius_m} m, nearest first):", ""]
     for idx, el in enumerate(elements[:limit], 1):
         tags = el.get("tags", {}) or {}
         name = tags.get("name", "Unnamed")
@@ -196,6 +209,7 @@ async def tool_search_osm_restaurants(arguments: Dict[str, Any]) -> str:
         lines.append(f"{idx}. {name}")
         lines.append(f"   OSM: {url}")
         lines.append(f"   Coords: {el_lat}, {el_lon}")
+        lines.append(f"   Distance: {el.get('distance_m', 'N/A')} m")
         lines.append(f"   Address: {addr}")
         lines.append(f"   Cuisine: {cuisine}")
         lines.append(f"   Phone: {phone}")
@@ -205,32 +219,7 @@ async def tool_search_osm_restaurants(arguments: Dict[str, Any]) -> str:
 
     return "\n".join(lines).strip()
 
-async def tool_get_osm_place_details(arguments: Dict[str, Any]) -> str:
-    osm_type = str(arguments["osm_type"]).lower().strip()
-    osm_id = int(arguments["osm_id"])
-
-    if osm_type not in {"node", "way", "relation"}:
-        return "osm_type must be one of: node, way, relation."
-
-    query = f"""
-    [out:json][timeout:25];
-    {osm_type}({osm_id});
-    out tags center;
-    """
-
-    async with httpx.AsyncClient() as client:
-        try:
-            data = await overpass_query(client, query)
-        except httpx.HTTPStatusError as e:
-            return f"Overpass error {e.response.status_code}."
-        except Exception as e:
-            return f"Error querying Overpass: {e}"
-
-    elements = data.get("elements", [])
-    if not elements:
-        return f"No element found for {osm_type} {osm_id}."
-
-    el = elements[0]
+def format_place_details(osm_type: str, osm_id: int, el: dict) -> str:
     tags = el.get("tags", {}) or {}
     name = tags.get("name", "Unnamed")
     addr = format_osm_address(tags)
@@ -240,7 +229,7 @@ async def tool_get_osm_place_details(arguments: Dict[str, Any]) -> str:
     opening = format_hours(tags)
     url = osm_url(osm_type, osm_id)
 
-    if "lat" in el and "lon" in el:
+    if el.get("lat") is not None and el.get("lon") is not None:
         el_lat, el_lon = el["lat"], el["lon"]
     else:
         center = el.get("center") or {}
@@ -263,12 +252,56 @@ async def tool_get_osm_place_details(arguments: Dict[str, Any]) -> str:
     ]
     return "\n".join(lines).strip()
 
+async def tool_get_osm_place_details(arguments: Dict[str, Any]) -> str:
+    osm_type = str(arguments["osm_type"]).lower().strip()
+    osm_id = int(arguments["osm_id"])
+
+    if osm_type not in OSM_TYPES:
+        return "osm_type must be one of: node, way, relation."
+
+    try:
+        # Places from recent search results are answered from the entity cache
+        el = await _entities.get(osm_type, osm_id)
+    except httpx.HTTPStatusError as e:
+        return f"Overpass error {e.response.status_code}."
+    except Exception as e:
+        return f"Error querying Overpass: {e}"
+
+    if el is None:
+        return f"No element found for {osm_type} {osm_id}."
+    return format_place_details(osm_type, osm_id, el)
+
+async def tool_get_osm_places_details(arguments: Dict[str, Any]) -> str:
+    try:
+        refs = [(str(p["osm_type"]).lower().strip(), int(p["osm_id"])) for p in arguments["places"]]
+    except (KeyError, TypeError, ValueError):
+        return "places must be a list of {osm_type, osm_id} objects."
+    if not refs:
+        return "places must not be empty."
+    if len(refs) > MAX_BATCH_IDS:
+        return f"At most {MAX_BATCH_IDS} places per call."
+    if any(t not in OSM_TYPES for t, _ in refs):
+        return "osm_type must be one of: node, way, relation."
+
+    try:
+        # Cached places are answered locally; the rest share one Overpass union query
+        found = await _entities.get_many(refs)
+    except httpx.HTTPStatusError as e:
+        return f"Overpass error {e.response.status_code}."
+    except Exception as e:
+        return f"Error querying Overpass: {e}"
+
+    blocks = [
+        format_place_details(t, i, found[(t, i)]) if found[(t, i)] is not None else f"No element found for {t} {i}."
+        for t, i in dict.fromkeys(refs)
+    ]
+    return "\n\n---\n\n".join(blocks)
+
 # ------------- MCP dispatcher -------------
 async def _with_overall_timeout(coro, seconds: float, on_timeout: str):
-    try:
-        return await asyncio.wait_for(coro, timeout=seconds)
-    except asyncio.TimeoutError:
-        return on_timeout
+    # The same deadline bounds the Overpass requests and retries inside `coro`,
+    # so a timed-out call releases its connections instead of retrying on
+    return await run_with_deadline(coro, seconds, on_timeout)
 
 @mcp_server.call_tool()
 async def call_tool(name: str, arguments: Dict[str, Any]) -> List[TextContent]:
@@ -288,6 +321,11 @@ async def call_tool(name: str, arguments: Dict[str, Any]) -> List[TextContent]:
                 tool_get_osm_place_details(arguments), 20.0,
                 "Timed out getting OSM place details."
             )
+        elif name == "get_osm_places_details":
+            out = await _with_overall_timeout(
+                tool_get_osm_places_details(arguments), 25.0,
+                "Timed out getting OSM place details."
+            )
         else:
             out = f"Unknown tool: {name}"
     except Exception as e:
@@ -315,11 +353,22 @@ async def root(_request: Request):
             "sse": "/sse",
             "message": "/message",
             "health": "/health",
+            "info": "/info",
             "openapi": "/openapi.json",
         },
         "tools": [t.name for t in await list_tools()],
     })
 
+async def info(_request: Request):
+    # Runtime stats: Overpass pool, mirror scores/breakers, slots and caches
+    return JSONResponse({
+        "service": SERVICE_NAME,
+        "overpass": _overpass.stats(),
+        "restaurant_tiles": _restaurants.stats(),
+        "osm_index": _osm_index.stats() if _osm_index is not None else None,
+        "osm_entities": _entities.stats(),
+    })
+
 async def openapi(_request: Request):
     return JSONResponse({
         "openapi": "3.0.0",
@@ -333,9 +382,17 @@ async def openapi(_request: Request):
             "/sse": {"get": {"summary": "SSE endpoint for MCP communication", "responses": {"200": {"description": "SSE stream"}}}},
             "/message": {"post": {"summary": "POST messages endpoint for MCP", "responses": {"200": {"description": "OK"}}}},
             "/health": {"get": {"summary": "Health check", "responses": {"200": {"description": "Healthy"}}}},
+            "/info": {"get": {"summary": "Overpass mirror, connection pool and cache statistics", "responses": {"200": {"description": "Stats"}}}},
         },
     })
 
+# ------------- Lifespan -------------
+async def lifespan(app):
+    # One pooled Overpass client for the whole process, closed cleanly on shutdown
+    await _overpass.start()
+    yield
+    await _overpass.close()
+
 # ------------- Starlette app -------------
 app = Starlette(
     routes=[
@@ -343,8 +400,10 @@ app = Starlette(
         Route("/sse", endpoint=handle_sse),
         Route("/message", endpoint=handle_messages, methods=["POST"]),
         Route("/health", endpoint=health),
+        Route("/info", endpoint=info),
         Route("/openapi.json", endpoint=openapi),
-    ]
+    ],
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -363,6 +422,7 @@ if __name__ == "__main__":
     print("  - SSE:      http://localhost:8001/sse")
     print("  - Message:  http://localhost:8001/message (POST)")
     print("  - Health:   http://localhost:8001/health")
+    print("  - Info:     http://localhost:8001/info")
     print("  - OpenAPI:  http://localhost:8001/openapi.json")
     uvicorn.run(app, host="0.0.0.0", port=8001)
 
@@ -0,0 +1,174 @@
+import argparse
+import asyncio
+import math
+import random
+import time
+from typing import Any, Dict
+from urllib.parse import parse_qs
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Route
+
+from overpass_fixtures import fixture_key, load_fixtures
+
+# ===== Local Overpass stand-in =====
+# Replays fixtures recorded with OVERPASS_RECORD_DIR, fully offline, with
+# configurable latency and injected failures, so load and failover tests never
+# touch the public mirrors and give the same numbers run after run.
+#
+#   1. record:  OVERPASS_RECORD_DIR=fixtures/overpass python overpass_server.py   (drive some tool calls)
+#   2. replay:  python overpass_standin.py fixtures/overpass --port 8701 --latency lognormal:0.8,0.6
+#               python overpass_standin.py fixtures/overpass --port 8702 --p504 0.2 --p-timeout 0.05
+#   3. serve:   OVERPASS_ENDPOINTS=http://127.0.0.1:8701/api/interpreter,http://127.0.0.1:8702/api/interpreter \
+#                   python overpass_server.py
+#
+# Like the real service it answers /api/status and returns 429 beyond `--slots`
+# concurrent queries per client IP.
+
+
+class LatencyModel:
+    """
+    "recorded" (each fixture's own latency), "fixed:S", "uniform:A,B" or
+    "lognormal:MEDIAN,SIGMA", all in seconds, times `scale`.
+    """
+
+    def __init__(self, spec: str, scale: float = 1.0):
+        self.spec = spec
+        self.scale = scale
+        kind, _, args = spec.partition(":")
+        self.kind = kind
+        self.args = [float(a) for a in args.split(",")] if args else []
+        if kind not in {"recorded", "fixed", "uniform", "lognormal"}:
+            raise ValueError(f"Unknown latency model: {spec}")
+
+    def sample(self, rng: random.Random, recorded_s: float) -> float:
+        if self.kind == "recorded":
+            value = recorded_s
+        elif self.kind == "fixed":
+            value = self.args[0]
+        elif self.kind == "uniform":
+            value = rng.uniform(self.args[0], self.args[1])
+        else:
+            value = rng.lognormvariate(math.log(max(self.args[0], 1e-6)), self.args[1])
+        return max(0.0, value * self.scale)
+
+
+class StandIn:
+    def __init__(self, fixtures: Dict[str, Dict[str, Any]], args: argparse.Namespace):
+        self.fixtures = fixtures
+        self.latency = LatencyModel(args.latency, args.latency_scale)
+        self.p429 = args.p429
+        self.p504 = args.p504
+        self.p_timeout = args.p_timeout
+        self.hang_s = args.hang_s
+        self.slots = args.slots
+        self.on_miss = args.on_miss
+        self.rng = random.Random(args.seed)
+        self.running: Dict[str, int] = {}  # client IP -> queries in progress
+        self.counts = {"requests": 0, "hits": 0, "misses": 0, "injected_429": 0, "slot_429": 0,
+                       "injected_504": 0, "injected_timeouts": 0}
+
+    async def interpreter(self, request: Request) -> Response:
+        self.counts["requests"] += 1
+        if request.method == "POST":
+            form = parse_qs((await request.body()).decode("utf-8"))
+        else:
+            form = {k: [v] for k, v in request.query_params.items()}
+        query = (form.get("data") or [""])[0]
+        ip = request.client.host if request.client else "?"
+
+        if self.slots and self.running.get(ip, 0) >= self.slots:
+            self.counts["slot_429"] += 1
+            return PlainTextResponse("rate_limited: too many concurrent queries", status_code=429)
+        # One draw per request decides its fate: the same seed gives the same error mix
+        roll = self.rng.random()
+        if roll < self.p429:
+            self.counts["injected_429"] += 1
+            return PlainTextResponse("rate_limited (injected)", status_code=429)
+        roll -= self.p429
+
+        self.running[ip] = self.running.get(ip, 0) + 1
+        try:
+            if roll < self.p_timeout:
+                self.counts["injected_timeouts"] += 1
+                await asyncio.sleep(self.hang_s)  # past the client's read timeout
+                return PlainTextResponse("timeout (injected)", status_code=504)
+            roll -= self.p_timeout
+            fixture = self.fixtures.get(fixture_key(query))
+            await asyncio.sleep(self.latency.sample(self.rng, fixture["latency_s"] if fixture else 0.0))
+            if roll < self.p504:
+                self.counts["injected_504"] += 1
+                return PlainTextResponse("gateway timeout (injected)", status_code=504)
+            if fixture is None:
+                self.counts["misses"] += 1
+                if self.on_miss == "404":
+                    return PlainTextResponse("no fixture for this query", status_code=404)
+                return JSONResponse({"version": 0.6, "generator": "overpass-standin", "elements": [],
+                                     "remark": "no recorded fixture for this query"})
+            self.counts["hits"] += 1
+            return Response(fixture["body"], media_type="application/json")
+        finally:
+            self.running[ip] -= 1
+
+    async def status(self, request: Request) -> Response:
+        ip = request.client.host if request.client else "?"
+        free = max(0, self.slots - self.running.get(ip, 0)) if self.slots else 0
+        lines = [
+            f"Connected as: {abs(hash(ip)) % 10**9}",
+            f"Current time: {time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}",
+            "Announced endpoint: none",
+            f"Rate limit: {self.slots}",
+        ]
+        if not self.slots or free:
+            lines.append(f"{free} slots available now.")
+        else:
+            # A slot frees when a running query finishes; one second is a fair guess
+            lines.append(f"Slot available after: {time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}, in 1 seconds.")
+        lines.append("Currently running queries (pid, space limit, time limit, start time):")
+        return PlainTextResponse("\n".join(lines) + "\n")
+
+    async def stats(self, _request: Request) -> Response:
+        return JSONResponse({
+            "fixtures": len(self.fixtures),
+            "latency": self.latency.spec,
+            "latency_scale": self.latency.scale,
+            "p429": self.p429,
+            "p504": self.p504,
+            "p_timeout": self.p_timeout,
+            "slots": self.slots,
+            "running": sum(self.running.values()),
+            "counts": self.counts,
+        })
+
+    def app(self) -> Starlette:
+        return Starlette(routes=[
+            Route("/api/interpreter", endpoint=self.interpreter, methods=["GET", "POST"]),
+            Route("/api/status", endpoint=self.status),
+            Route("/stats", endpoint=self.stats),
+        ])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline Overpass stand-in replaying recorded fixtures")
+    parser.add_argument("fixtures", help="directory written with OVERPASS_RECORD_DIR")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8701)
+    parser.add_argument("--latency", default="recorded", help="recorded | fixed:S | uniform:A,B | lognormal:MEDIAN,SIGMA")
+    parser.add_argument("--latency-scale", type=float, default=1.0)
+    parser.add_argument("--p429", type=float, default=0.0, help="probability of an injected 429")
+    parser.add_argument("--p504", type=float, default=0.0, help="probability of a 504 after the latency")
+    parser.add_argument("--p-timeout", type=float, default=0.0, help="probability of hanging for --hang-s")
+    parser.add_argument("--hang-s", type=float, default=60.0)
+    parser.add_argument("--slots", type=int, default=2, help="concurrent queries per client IP before 429 (0 = unlimited)")
+    parser.add_argument("--on-miss", choices=["empty", "404"], default="empty")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures)
+    print(f"[standin] {len(fixtures)} fixtures from {args.fixtures}; latency={args.latency} "
+          f"p429={args.p429} p504={args.p504} p_timeout={args.p_timeout} slots={args.slots}")
+    print(f"[standin] OVERPASS_ENDPOINTS=http://{args.host}:{args.port}/api/interpreter")
+    uvicorn.run(StandIn(fixtures, args).app(), host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict
+
+# ===== Two-tier translation cache =====
+# Bounded in-memory LRU in front of a SQLite file that survives restarts.
+# Keys cover the NFKC-normalized text, language pair, model id and generation
+# params, so a different model or max_length never returns a stale entry.
+
+DEFAULT_CACHE_PATH = os.getenv(
+    "TRANSLATION_CACHE_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "translation_cache.db"),
+)
+
+
+def normalize_text(text: str) -> str:
+    return unicodedata.normalize("NFKC", text).strip()
+
+
+class TranslationCache:
+    def __init__(self, path: str | None = DEFAULT_CACHE_PATH, max_memory_items: int = 4096):
+        """
+        `path=None` keeps the cache in memory only.
+        """
+        self.path = path
+        self.max_memory_items = max_memory_items
+        self._lru: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+        self._db_error: str | None = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if path:
+            try:
+                self._db = sqlite3.connect(path, check_same_thread=False)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute("PRAGMA synchronous=NORMAL")
+                self._db.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS translations (
+                        key TEXT PRIMARY KEY,
+                        src_lang TEXT,
+                        tgt_lang TEXT,
+                        model_id TEXT,
+                        source TEXT,
+                        translation TEXT,
+                        created_at REAL
+                    )
+                    """
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                # Never take the server down because of the cache: fall back to memory only
+                self._db = None
+                self._db_error = f"{type(e).__name__}: {e}"
+                print(f"[cache] SQLite unavailable ({self._db_error}); using memory-only cache.")
+
+    @staticmethod
+    def make_key(text: str, src_lang: str, tgt_lang: str, model_id: str, params: Dict[str, Any]) -> str:
+        payload = json.dumps(
+            [normalize_text(text), src_lang, tgt_lang, model_id, params],
+            ensure_ascii=False,
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, translation: str) -> None:
+        self._lru[key] = translation
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_memory_items:
+            self._lru.popitem(last=False)
+
+    def get(self, text: str, src_lang: str, tgt_lang: str, model_id: str, params: Dict[str, Any]) -> str | None:
+        key = self.make_key(text, src_lang, tgt_lang, model_id, params)
+        with self._lock:
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                self.memory_hits += 1
+                return self._lru[key]
+            if self._db is not None:
+                row = self._db.execute("SELECT translation FROM translations WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self._remember(key, row[0])
+                    self.disk_hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def put(self, text: str, src_lang: str, tgt_lang: str, model_id: str, params: Dict[str, Any], translation: str) -> None:
+        key = self.make_key(text, src_lang, tgt_lang, model_id, params)
+        with self._lock:
+            self._remember(key, translation)
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (key, src_lang, tgt_lang, model_id, normalize_text(text), translation, time.time()),
+                    )
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    print(f"[cache] write failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            disk_items = None
+            if self._db is not None:
+                disk_items = self._db.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+            return {
+                "lookups": lookups,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                "memory_items": len(self._lru),
+                "memory_capacity": self.max_memory_items,
+                "disk_items": disk_items,
+                "path": self.path if self._db is not None else None,
+                "error": self._db_error,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
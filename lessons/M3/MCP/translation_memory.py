@@ -0,0 +1,167 @@
+import argparse
+import os
+import pickle
+import time
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+import numpy as np
+
+from translation_cache import normalize_text
+
+# ===== Translation memory (ja -> en) =====
+# Human translations from the Kyoto wiki corpus, consulted before mBART:
+#   exact match    normalized source -> dict lookup (microseconds)
+#   fuzzy match    char 2-3-gram TF-IDF nearest neighbour, like the notebook's
+#                  ebmt_tfidf_baseline, accepted only above `min_similarity`;
+#                  scored through an inverted index, so a lookup only touches
+#                  the entries sharing an n-gram with the query
+# Everything else falls through to the model.
+#
+# Build once, offline:
+#   python translation_memory.py build            # all corpus pairs
+#   python translation_memory.py build --split train   # keep the test split unseen
+# Servers load TRANSLATION_MEMORY_PATH at startup when the file exists.
+
+DEFAULT_TM_PATH = os.getenv(
+    "TRANSLATION_MEMORY_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "translation_memory.pkl"),
+)
+MIN_SIMILARITY = float(os.getenv("TRANSLATION_MEMORY_MIN_SIMILARITY", "0.92"))
+
+
+class TMMatch(NamedTuple):
+    translation: str
+    source: str
+    similarity: float
+    kind: str  # "exact" or "fuzzy"
+
+
+class TranslationMemory:
+    def __init__(self, sources: List[str], targets: List[str], vectorizer, matrix, path: str | None = None):
+        self.sources = sources
+        self.targets = targets
+        self.vectorizer = vectorizer
+        self.matrix = matrix  # L2-normalized TF-IDF rows: dot product = cosine similarity
+        # Inverted index: row j lists the entries containing n-gram j (CSR of the transpose)
+        self.postings = matrix.T.tocsr()
+        self.exact = {src: i for i, src in enumerate(sources)}
+        self.path = path
+        self.exact_hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+        self.lookup_time_s = 0.0
+
+    @classmethod
+    def build(cls, pairs: List[Tuple[str, str]]) -> "TranslationMemory":
+        from sklearn.feature_extraction.text import TfidfVectorizer
+
+        seen = {}
+        for ja, en in pairs:
+            seen.setdefault(normalize_text(ja), en)  # first translation wins for duplicates
+        sources = list(seen)
+        # Character n-grams: Japanese has no spaces, so word tokens would be whole clauses.
+        # max_df drops n-grams in most sentences (particles, 。) that only slow down retrieval.
+        vectorizer = TfidfVectorizer(analyzer="char", ngram_range=(2, 3), sublinear_tf=True, max_df=0.3, dtype=np.float32)
+        matrix = vectorizer.fit_transform(sources).tocsr()
+        return cls(sources, list(seen.values()), vectorizer, matrix)
+
+    def save(self, path: str = DEFAULT_TM_PATH) -> None:
+        with open(path, "wb") as f:
+            pickle.dump(
+                {"sources": self.sources, "targets": self.targets, "vectorizer": self.vectorizer, "matrix": self.matrix},
+                f,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        self.path = path
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_TM_PATH) -> "TranslationMemory":
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        return cls(data["sources"], data["targets"], data["vectorizer"], data["matrix"], path)
+
+    def lookup(self, text: str, min_similarity: float = MIN_SIMILARITY) -> TMMatch | None:
+        start = time.perf_counter()
+        try:
+            return self._lookup(normalize_text(text), min_similarity)
+        finally:
+            self.lookup_time_s += time.perf_counter() - start
+
+    def _lookup(self, query: str, min_similarity: float) -> TMMatch | None:
+        idx = self.exact.get(query)
+        if idx is not None:
+            self.exact_hits += 1
+            return TMMatch(self.targets[idx], self.sources[idx], 1.0, "exact")
+        if min_similarity < 1.0 and query:
+            # query (1 x V) @ postings (V x N) walks only the posting lists of the
+            # query's n-grams, not every entry's row like matrix @ query.T would
+            sims = (self.vectorizer.transform([query]) @ self.postings).tocoo()
+            if sims.nnz:
+                best = sims.data.argmax()
+                idx, sim = int(sims.col[best]), float(sims.data[best])
+                # A near-identical string of very different length is a different sentence
+                ratio = len(self.sources[idx]) / max(1, len(query))
+                if sim >= min_similarity and 0.8 <= ratio <= 1.25:
+                    self.fuzzy_hits += 1
+                    return TMMatch(self.targets[idx], self.sources[idx], round(sim, 4), "fuzzy")
+        self.misses += 1
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.exact_hits + self.fuzzy_hits + self.misses
+        return {
+            "entries": len(self.sources),
+            "lookups": lookups,
+            "exact_hits": self.exact_hits,
+            "fuzzy_hits": self.fuzzy_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.exact_hits + self.fuzzy_hits) / lookups, 4) if lookups else 0.0,
+            "avg_lookup_us": round(1e6 * self.lookup_time_s / lookups, 1) if lookups else 0.0,
+            "min_similarity": MIN_SIMILARITY,
+            "path": self.path,
+        }
+
+
+def load_translation_memory(path: str = DEFAULT_TM_PATH) -> TranslationMemory | None:
+    """
+    The memory is optional: returns None (servers go straight to mBART) if it
+    was never built or cannot be read.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        start = time.perf_counter()
+        tm = TranslationMemory.load(path)
+        print(f"[tm] Loaded {len(tm.sources)} translation-memory entries in {time.perf_counter() - start:.2f}s")
+        return tm
+    except Exception as e:
+        print(f"[tm] Could not load {path} ({type(e).__name__}: {e}); translating everything with mBART.")
+        return None
+
+
+if __name__ == "__main__":
+    from kyoto_corpus import kyoto_splits, load_kyoto_pairs
+
+    parser = argparse.ArgumentParser(description="Build the ja->en translation memory from the Kyoto wiki corpus")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_build = sub.add_parser("build")
+    p_build.add_argument("--split", choices=["all", "train"], default="all")
+    p_build.add_argument("--out", default=DEFAULT_TM_PATH)
+    p_query = sub.add_parser("query")
+    p_query.add_argument("text")
+    p_query.add_argument("--path", default=DEFAULT_TM_PATH)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        pairs = load_kyoto_pairs()
+        if args.split == "train":
+            pairs = kyoto_splits(pairs)["train"]
+        print(f"[tm] Indexing {len(pairs)} pairs…")
+        start = time.perf_counter()
+        tm = TranslationMemory.build(pairs)
+        tm.save(args.out)
+        print(f"[tm] {len(tm.sources)} entries written to {args.out} in {time.perf_counter() - start:.1f}s")
+    else:
+        tm = TranslationMemory.load(args.path)
+        print(tm.lookup(args.text) or "[tm] no match")
+        print(tm.stats())